@@ -0,0 +1,58 @@
+"""Initial schema: users and calculations
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+OPERATION_TYPES = ('ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'POWER', 'MODULO')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+    op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+
+    op.create_table(
+        'calculations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('operation', sa.Enum(*OPERATION_TYPES, name='operationtype'), nullable=False),
+        sa.Column('operand1', sa.Float(), nullable=False),
+        sa.Column('operand2', sa.Float(), nullable=False),
+        sa.Column('result', sa.Float(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_calculations_id'), 'calculations', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_calculations_id'), table_name='calculations')
+    op.drop_table('calculations')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_index(op.f('ix_users_username'), table_name='users')
+    op.drop_index(op.f('ix_users_id'), table_name='users')
+    op.drop_table('users')
+    sa.Enum(name='operationtype').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,50 @@
+"""Add user_calculation_stats rollup and backfill it from calculations
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+OPERATION_TYPES = ('ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'POWER', 'MODULO')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_calculation_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        # Reuse the enum type created with the calculations table
+        sa.Column(
+            'operation',
+            postgresql.ENUM(*OPERATION_TYPES, name='operationtype', create_type=False),
+            nullable=False
+        ),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('result_sum', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'operation')
+    )
+
+    # Backfill from existing history
+    op.execute(
+        """
+        INSERT INTO user_calculation_stats (user_id, operation, count, result_sum)
+        SELECT user_id, operation, COUNT(id), COALESCE(SUM(result), 0)
+        FROM calculations
+        GROUP BY user_id, operation
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_calculation_stats')
@@ -0,0 +1,29 @@
+"""Add (user_id, created_at DESC, id DESC) index for history paging
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_calculations_user_created_id',
+        'calculations',
+        ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_calculations_user_created_id', table_name='calculations')
@@ -0,0 +1,40 @@
+"""Index audit for the calculations table
+
+Every router query on calculations filters on user_id:
+
+* history pages and the recent-10 statistics query use
+  ix_calculations_user_created_id (added in 0003),
+* single-row reads/updates/deletes on (id, user_id) use the primary key,
+* the rollup recompute groups a user's rows by operation, which gets
+  ix_calculations_user_operation below.
+
+ix_calculations_user_created_id also covers the user_id foreign key, so
+cascading account deletes no longer scan the table.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_calculations_user_operation',
+        'calculations',
+        ['user_id', 'operation'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_calculations_user_operation', table_name='calculations')
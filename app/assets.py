@@ -0,0 +1,183 @@
+"""Frontend assets served from memory with hashed names and precompressed variants
+
+Every file in app/static is read once at startup, in the app's lifespan,
+so no request waits for the disk or the compressor. Each asset except
+index.html gets a content-hashed name (app.js -> app.1a2b3c4d5e6f.js). The
+bodies are compressed ahead of time with gzip, and with brotli when the
+optional `brotli` package is installed. index.html is rewritten to point at
+the hashed names. A hashed name always refers to the same bytes, so those
+assets are sent with a one-year `Cache-Control: immutable`. The page itself
+and the unhashed names are revalidated with an ETag.
+
+Responses use the best encoding the client accepts. After the first load,
+a repeat visit reads nothing from disk and transfers a 304 for the page and
+nothing at all for the assets.
+
+With STATIC_RELOAD=true (for development) the files are re-read on the
+next request after one of them changes.
+"""
+import gzip
+import hashlib
+import mimetypes
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+from starlette.requests import Request
+from starlette.responses import Response
+from app.config import get_settings
+
+try:
+    import brotli
+except ImportError:  # optional; without it only gzip variants are built
+    brotli = None
+
+settings = get_settings()
+
+STATIC_DIR = Path(__file__).parent / "static"
+INDEX = "index.html"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+# Preferred first when the client accepts several encodings
+ENCODINGS = ("br", "gzip")
+STATIC_REFERENCE = re.compile(r'(["\'])/static/([^"\']+)\1')
+
+
+@dataclass(frozen=True)
+class Asset:
+    media_type: str
+    etag: str
+    variants: Dict[str, bytes]
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if _etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+        encoding = negotiate(request.headers.get("accept-encoding", ""), self.variants)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+def build_asset(body: bytes, media_type: str) -> Asset:
+    """Hash the body and precompress it, keeping only variants that are smaller"""
+    variants = {"identity": body}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        variants.update((encoding, data) for encoding, data in compressed.items() if len(data) < len(body))
+    return Asset(media_type, f'W/"{content_hash(body)}"', variants)
+
+
+def content_hash(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:12]
+
+
+def hashed_name(name: str, body: bytes) -> str:
+    """app.js -> app.<hash>.js"""
+    stem, dot, suffix = name.rpartition(".")
+    return f"{stem}.{content_hash(body)}.{suffix}" if dot else f"{name}.{content_hash(body)}"
+
+
+def media_type(name: str) -> str:
+    # Starlette adds "; charset=utf-8" to text/* types
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def negotiate(accept_encoding: str, available: Iterable[str], preference: Iterable[str] = ENCODINGS) -> str:
+    """The first encoding in `preference` that is available and accepted (q > 0), else identity"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        encoding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[encoding.strip().lower()] = quality
+    for encoding in preference:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+class AssetBundle:
+    """The static files of one directory, with hashed names, and the rewritten index page"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.assets: Dict[str, Asset] = {}
+        # Unhashed name -> hashed name
+        self.hashed: Dict[str, str] = {}
+        self.index: Optional[Asset] = None
+        for path in sorted(directory.iterdir()):
+            if path.is_file() and path.name != INDEX:
+                body = path.read_bytes()
+                self.hashed[path.name] = hashed_name(path.name, body)
+                self.assets[self.hashed[path.name]] = build_asset(body, media_type(path.name))
+        index = directory / INDEX
+        if index.is_file():
+            html = STATIC_REFERENCE.sub(self._hashed_reference, index.read_text(encoding="utf-8"))
+            self.index = build_asset(html.encode("utf-8"), media_type(INDEX))
+
+    def _hashed_reference(self, match: "re.Match") -> str:
+        quote, name = match.groups()
+        return f"{quote}/static/{self.hashed.get(name, name)}{quote}"
+
+    def lookup(self, name: str) -> Tuple[Optional[Asset], str]:
+        """The asset for a hashed or unhashed name and the Cache-Control it is served with"""
+        if name in self.assets:
+            return self.assets[name], IMMUTABLE
+        if name in self.hashed:
+            return self.assets[self.hashed[name]], REVALIDATE
+        return None, REVALIDATE
+
+
+def _signature(directory: Path) -> Tuple:
+    signature = []
+    for path in sorted(directory.iterdir()):
+        if path.is_file():
+            stat = path.stat()
+            signature.append((path.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class StaticAssets:
+    """Builds the bundle on first use and, with `reload`, again when the files change"""
+
+    def __init__(self, directory: Path, reload: bool = False):
+        self.directory = directory
+        self.reload = reload
+        self._bundle: Optional[AssetBundle] = None
+        self._signature: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def bundle(self) -> AssetBundle:
+        if self._bundle is not None and not self.reload:
+            return self._bundle
+        with self._lock:
+            signature = _signature(self.directory) if self.reload else None
+            if self._bundle is None or signature != self._signature:
+                self._bundle = AssetBundle(self.directory)
+                self._signature = signature
+            return self._bundle
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bundle = None
+            self._signature = None
+
+
+static_assets = StaticAssets(STATIC_DIR, reload=settings.static_reload)
@@ -1,19 +1,33 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.config import get_settings
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.models import User
 from app.schemas import TokenData
+from app.hashing import PasswordHasher
+from app.instrumentation import timed
 
 settings = get_settings()
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    pwd_context,
+    workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_max_queue,
+    retry_after=settings.password_hash_retry_after_seconds
+)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
@@ -21,12 +35,22 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against a hashed password"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password without blocking the event loop"""
+    return await password_hasher.verify_async(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password without blocking the event loop"""
+    return await password_hasher.hash_async(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -37,7 +61,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
+    with timed("jwt"):
+        encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
 
@@ -51,6 +76,16 @@ def get_user_by_email(db: Session, email: str) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
 
+async def get_user_by_username_async(db: AsyncSession, username: str) -> Optional[User]:
+    """Get a user by username"""
+    return (await db.execute(select(User).where(User.username == username))).scalars().first()
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str) -> Optional[User]:
+    """Get a user by email"""
+    return (await db.execute(select(User).where(User.email == email))).scalars().first()
+
+
 def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
     """Authenticate a user"""
     user = get_user_by_username(db, username)
@@ -61,26 +96,202 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
     return user
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get the current authenticated user"""
-    credentials_exception = HTTPException(
+async def authenticate_user_async(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    """Authenticate a user"""
+    user = await get_user_by_username_async(db, username)
+    if not user:
+        return None
+    if not await verify_password_async(password, user.hashed_password):
+        return None
+    return user
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Read-only snapshot of a user, safe to share between requests"""
+    id: int
+    username: str
+    email: str
+    token_version: int
+    history_version: int
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            token_version=user.token_version,
+            history_version=user.history_version or 0,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+        )
+
+
+class UserCache:
+    """Small in-process TTL cache of user snapshots keyed by user id"""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user: CachedUser) -> None:
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl_seconds, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(settings.user_cache_ttl_seconds, settings.user_cache_max_size)
+
+
+def create_user_token(user: User, expires_delta: Optional[timedelta] = None) -> str:
+    """Create an access token carrying the user's id and token version"""
+    return create_access_token(
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version},
+        expires_delta=expires_delta
+    )
+
+
+def revoke_user_tokens(user: User) -> None:
+    """Invalidate every token issued to the user so far
+
+    Takes effect on commit; invalidate the user cache after committing, or a
+    concurrent request could cache the old version in between.
+    """
+    user.token_version = (user.token_version or 0) + 1
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_token(token: str) -> dict:
+    """Decode a JWT, raising a 401 if it is invalid"""
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
+        with timed("jwt"):
+            payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
     except JWTError:
-        raise credentials_exception
-    
-    user = get_user_by_username(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
+        raise credentials_exception()
+    if payload.get("uid") is None and payload.get("sub") is None:
+        raise credentials_exception()
+    return payload
+
+
+def _check_token_user(user: Optional[User], payload: dict) -> User:
+    if user is None or user.token_version != payload.get("ver", 0):
+        raise credentials_exception()
     return user
+
+
+def _cached_token_user(payload: dict) -> Optional[CachedUser]:
+    user_id = payload.get("uid")
+    if user_id is None:
+        return None
+    cached = user_cache.get(user_id)
+    if cached is not None and cached.token_version == payload.get("ver", 0):
+        return cached
+    return None
+
+
+def load_token_user(db: Session, payload: dict) -> User:
+    """Load the user a decoded token belongs to and check its version"""
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = db.get(User, user_id)
+    else:
+        # Tokens issued before user ids were embedded only carry the username
+        user = get_user_by_username(db, username=TokenData(username=payload["sub"]).username)
+    return _check_token_user(user, payload)
+
+
+async def load_token_user_async(db: AsyncSession, payload: dict) -> User:
+    """Async version of load_token_user"""
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = await db.get(User, user_id)
+    else:
+        user = await get_user_by_username_async(db, username=TokenData(username=payload["sub"]).username)
+    return _check_token_user(user, payload)
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> CachedUser:
+    """Get the current authenticated user
+
+    Tokens carrying a user id are checked against the in-process user cache,
+    so most requests need no database query to authenticate. Handlers that
+    modify the user should depend on get_current_db_user instead.
+    """
+    payload = decode_token(token)
+    cached = _cached_token_user(payload)
+    if cached is not None:
+        return cached
+
+    user = CachedUser.from_user(load_token_user(db, payload))
+    user_cache.put(user)
+    return user
+
+
+async def get_current_db_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> User:
+    """Get the current authenticated user as an ORM object bound to the request session"""
+    return load_token_user(db, decode_token(token))
+
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> CachedUser:
+    """Async version of get_current_user"""
+    payload = decode_token(token)
+    cached = _cached_token_user(payload)
+    if cached is not None:
+        return cached
+
+    user = CachedUser.from_user(await load_token_user_async(db, payload))
+    user_cache.put(user)
+    return user
+
+
+async def get_current_db_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """Async version of get_current_db_user"""
+    return await load_token_user_async(db, decode_token(token))
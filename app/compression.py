@@ -0,0 +1,203 @@
+"""Compression of API responses
+
+`CompressionMiddleware` compresses compressible responses (JSON, NDJSON,
+CSV, text) with the best encoding that the client accepts and that is
+listed in COMPRESSION_ENCODINGS. gzip is always available. br and zstd need
+the optional `brotli` and `zstandard` packages. A body sent in one piece is
+compressed when it is at least COMPRESSION_MINIMUM_SIZE bytes. A streamed
+body (an export) is compressed chunk by chunk, with a flush after each
+chunk, so the client keeps receiving data as it is produced and memory
+stays flat.
+
+Responses that already have a Content-Encoding (precompressed assets, or
+exports requested with gzip=true) are left alone. Event streams are also
+left alone, because their small events must reach the client immediately.
+The time spent compressing is reported as the `compress` phase of
+Server-Timing.
+"""
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.assets import negotiate
+from app.instrumentation import timed
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/x-ndjson", "application/javascript", "image/svg+xml",
+)
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+
+class Compressor(ABC):
+    """Incremental compressor; `compress(data, flush=True)` returns everything decodable so far"""
+
+    @abstractmethod
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        ...
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        ...
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int):
+        # wbits=31 writes a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, level: int):
+        import brotli
+
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self._compressor.process(data)
+        return output + self._compressor.flush() if flush else output
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int):
+        import zstandard
+
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(self._flush_block) if flush else output
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+COMPRESSORS: Dict[str, Callable[[int], Compressor]] = {
+    "gzip": GzipCompressor,
+    "br": BrotliCompressor,
+    "zstd": ZstdCompressor,
+}
+# The package each encoding needs, for the error message when it is missing
+REQUIRED_PACKAGES = {"br": "brotli", "zstd": "zstandard"}
+
+
+def parse_encodings(value: str) -> List[str]:
+    """The encodings of a comma-separated setting, checking each is known and its package installed"""
+    encodings = [encoding.strip().lower() for encoding in value.split(",") if encoding.strip()]
+    for encoding in encodings:
+        if encoding not in COMPRESSORS:
+            raise RuntimeError(f"Unknown compression encoding {encoding!r} (use gzip, br or zstd)")
+        package = REQUIRED_PACKAGES.get(encoding)
+        if package is not None:
+            try:
+                __import__(package)
+            except ImportError:
+                raise RuntimeError(f"{encoding} compression requires the {package} package (pip install {package})") from None
+    return encodings
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    if content_type.startswith(UNCOMPRESSED_TYPES):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type
+
+
+class CompressionMiddleware:
+    """Compress response bodies with the client's preferred configured encoding"""
+
+    def __init__(self, app: ASGIApp, encodings: Sequence[str] = ("gzip",), level: int = 6, minimum_size: int = 1000):
+        self.app = app
+        self.encodings = tuple(encodings)
+        self.level = level
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encodings, self.encodings)
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, CompressionResponder(send, encoding, self.level, self.minimum_size).send)
+
+
+class CompressionResponder:
+    """Holds back the response start until the first body chunk shows how to send it"""
+
+    def __init__(self, send: Send, encoding: str, level: int, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self._start: Optional[Message] = None
+        # None until decided, then a compressor or False for pass-through
+        self._compressor = None
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self._start = message
+            headers = Headers(raw=message.get("headers", []))
+            if (
+                message["status"] < 200 or message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or not is_compressible(headers.get("content-type", ""))
+            ):
+                self._compressor = False
+                await self._send_start()
+            return
+
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+        if self._compressor is False:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self._compressor is None:
+            if not more_body and len(body) < self.minimum_size:
+                self._compressor = False
+                await self._send_start()
+                await self._send(message)
+                return
+            self._compressor = COMPRESSORS[self.encoding](self.level)
+            body = self._compress(body, more_body)
+            await self._send_start(compressed_length=None if more_body else len(body))
+        else:
+            body = self._compress(body, more_body)
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        with timed("compress"):
+            if more_body:
+                return self._compressor.compress(body, flush=True)
+            return self._compressor.compress(body) + self._compressor.finish()
+
+    async def _send_start(self, compressed_length: Optional[int] = None) -> None:
+        start = self._start
+        headers = MutableHeaders(raw=list(start.get("headers", [])))
+        if self._compressor:
+            headers["Content-Encoding"] = self.encoding
+            if compressed_length is None:
+                # Streamed: the length is unknown until the end
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(compressed_length)
+        vary = [value.strip().lower() for value in headers.get("vary", "").split(",")]
+        if "accept-encoding" not in vary and (self._compressor or is_compressible(headers.get("content-type", ""))):
+            headers.add_vary_header("Accept-Encoding")
+        await self._send({**start, "headers": headers.raw})
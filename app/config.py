@@ -1,12 +1,71 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, Optional
 
 
 class Settings(BaseSettings):
     database_url: str
+    # Serve the API with AsyncEngine/AsyncSession and async handlers
+    database_async: bool = False
+    # Defaults to database_url with an async driver (asyncpg / aiosqlite)
+    async_database_url: Optional[str] = None
+    # Connection pool (ignored for in-memory SQLite)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_pre_ping: bool = False
+    db_pool_recycle: int = -1
+    # Create missing tables at startup; off by default because Alembic owns the schema
+    create_tables: bool = False
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    user_cache_ttl_seconds: float = 30.0
+    user_cache_max_size: int = 10000
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 16
+    password_hash_retry_after_seconds: int = 1
+    calculation_batch_max_size: int = 1000
+    # Memoized calculation results (size 0 disables, no TTL keeps entries until evicted)
+    calculation_cache_size: int = 0
+    calculation_cache_ttl_seconds: Optional[float] = None
+    # Cached read responses (TTL 0 disables); a redis:// URL shares them between workers
+    response_cache_ttl_seconds: int = 60
+    response_cache_max_entries: int = 10000
+    response_cache_url: Optional[str] = None
+    # Server-sent events: queued events per stream, keep-alive interval, PostgreSQL URL for LISTEN/NOTIFY
+    event_queue_size: int = 100
+    event_heartbeat_seconds: float = 15.0
+    event_broker_url: Optional[str] = None
+    # Select column tuples and encode list/statistics responses with orjson
+    fast_json_responses: bool = False
+    # Rows per transaction and errors kept per report for bulk imports
+    import_chunk_size: int = 5000
+    import_max_errors: int = 1000
+    # Server-Timing header on responses; a statement limit per request for tests (see app.instrumentation)
+    server_timing: bool = True
+    max_queries_per_request: Optional[int] = None
+    # python -m app.server: worker processes (default: available CPUs) and the drain timeout on SIGTERM
+    server_workers: Optional[int] = None
+    server_graceful_timeout_seconds: float = 25.0
+    # Response compression: encodings offered in order of preference (gzip, br, zstd; empty disables),
+    # the level passed to each compressor, and the smallest non-streamed body worth compressing
+    compression_encodings: str = "gzip"
+    compression_level: int = 6
+    compression_minimum_size: int = 1000
+    # Token-bucket limits per "METHOD /path" as "<count>/<period>", per user with a valid token, else per IP;
+    # buckets kept in-process, or in redis (shared between workers) with a redis:// URL
+    rate_limits: Dict[str, str] = {
+        "POST /api/auth/login": "10/minute",
+        "POST /api/auth/register": "5/minute",
+        "POST /api/calculations/": "120/minute",
+        "POST /api/calculations/batch": "30/minute",
+        "POST /api/calculations/import": "10/minute",
+    }
+    rate_limit_url: Optional[str] = None
+    rate_limit_max_entries: int = 100000
+    # Re-read app/static when its files change (development); otherwise they are read once
+    static_reload: bool = False
     debug: bool = True
 
     class Config:
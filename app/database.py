@@ -1,20 +1,223 @@
-from sqlalchemy import create_engine
+import os
+import threading
+import time
+from typing import Optional
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from app.config import get_settings
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.config import Settings, get_settings
+from app.metrics import LatencyHistogram
 
 settings = get_settings()
 
-engine = create_engine(settings.database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class PoolMonitor:
+    """Connection pool telemetry recorded through SQLAlchemy pool events"""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.max_checked_out = 0
+        self.checkout_wait = LatencyHistogram(buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+        self._lock = threading.Lock()
+
+        engine.pool.monitor = self
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+        # dispose() replaces the pool; point the new one back at this monitor
+        event.listen(engine, "engine_disposed", lambda e: setattr(e.pool, "monitor", self))
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        checked_out = self._pool_checked_out()
+        with self._lock:
+            self.checkouts += 1
+            if checked_out is not None and checked_out > self.max_checked_out:
+                self.max_checked_out = checked_out
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, seconds: float, timed_out: bool) -> None:
+        self.checkout_wait.observe(seconds)
+        if timed_out:
+            with self._lock:
+                self.timeouts += 1
+
+    def _pool_checked_out(self) -> Optional[int]:
+        pool = self.engine.pool
+        return pool.checkedout() if hasattr(pool, "checkedout") else None
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        with self._lock:
+            counters = {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "max_checked_out": self.max_checked_out,
+            }
+        state = {"pool_class": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            state.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(0, pool.overflow()),
+                "max_overflow": pool._max_overflow,
+            })
+        return {**state, **counters, "checkout_wait": self.checkout_wait.snapshot()}
+
+
+class _TimedCheckoutMixin:
+    """Measures how long each checkout waits for a free connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            monitor = getattr(self, "monitor", None)
+            if monitor is not None:
+                monitor.record_wait(time.perf_counter() - started, timed_out)
+
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url: str, config: Settings, is_async: bool = False) -> dict:
+    """Pool keyword arguments for create_engine/create_async_engine"""
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":")):
+        # In-memory SQLite keeps its single-connection pool
+        return {}
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_size": config.db_pool_size,
+        "max_overflow": config.db_max_overflow,
+        "pool_timeout": config.db_pool_timeout,
+        "pool_pre_ping": config.db_pool_pre_ping,
+        "pool_recycle": config.db_pool_recycle,
+    }
+
+
+# The engines are built on first use, so importing the app opens no connections
+# and a forked worker creates its own pool
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+pool_monitor: Optional[PoolMonitor] = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
+# Sync driver URL prefixes and the async drivers that replace them
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+_async_engine: Optional[AsyncEngine] = None
+_async_sessionmaker: Optional[async_sessionmaker] = None
+async_pool_monitor: Optional[PoolMonitor] = None
+
+
+def get_engine() -> Engine:
+    """Build the engine on first use and bind SessionLocal to it"""
+    global _engine, pool_monitor
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(settings.database_url, **engine_options(settings.database_url, settings))
+                pool_monitor = PoolMonitor(engine)
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+
+async def dispose_engines() -> None:
+    """Close the pooled connections of the engines built so far"""
+    if _engine is not None:
+        _engine.dispose()
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+
+def to_async_url(url: str) -> str:
+    """Swap a sync database URL's driver for its async counterpart"""
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def get_async_engine() -> AsyncEngine:
+    """Build the async engine on first use"""
+    global _async_engine, _async_sessionmaker, async_pool_monitor
+    if _async_engine is None:
+        url = settings.async_database_url or to_async_url(settings.database_url)
+        _async_engine = create_async_engine(url, **engine_options(url, settings, is_async=True))
+        async_pool_monitor = PoolMonitor(_async_engine.sync_engine)
+        # Objects stay usable after commit without an implicit (awaitable) refresh
+        _async_sessionmaker = async_sessionmaker(
+            _async_engine, autoflush=False, expire_on_commit=False
+        )
+    return _async_engine
+
+
+def _forget_engines() -> None:
+    """Drop engines inherited across a fork without closing the parent's connections"""
+    global _engine, _engine_lock, pool_monitor, _async_engine, _async_sessionmaker, async_pool_monitor
+    for inherited in (_engine, _async_engine and _async_engine.sync_engine):
+        if inherited is not None:
+            inherited.dispose(close=False)
+    _engine = _async_engine = _async_sessionmaker = None
+    pool_monitor = async_pool_monitor = None
+    _engine_lock = threading.Lock()
+    SessionLocal.configure(bind=None)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_engines)
+
 
 def get_db():
     """Dependency for getting database session"""
+    get_engine()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Dependency for getting an async database session"""
+    get_async_engine()
+    async with _async_sessionmaker() as db:
+        yield db
@@ -0,0 +1,355 @@
+"""Server-sent events for changes to a user's calculations
+
+Write handlers publish an Event after they commit. The broker carries it to
+every worker: `LocalBroker` delivers in-process (the default, enough for one
+worker) and `PostgresBroker` relays through LISTEN/NOTIFY when
+EVENT_BROKER_URL points at PostgreSQL. Each worker's `EventHub` then fans the
+event out to the open streams of that user.
+
+Every event carries the history version its write committed (see
+app.history). A stream starts with a snapshot of the rollup and the version
+it was read at, skips events already included in it and tells the client to
+resync when it sees a gap, so clients never apply a change twice or miss one.
+A password change publishes a `revoked` event, which ends every stream that
+was opened with an older token, on every worker.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import select as io_select
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, select
+from app.config import get_settings
+from app.models import OperationType, User, UserCalculationStats
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Per-operation (count, result_sum) changes, as CalculationBatch.rollup_deltas returns them
+StatisticsDelta = Dict[OperationType, Tuple[int, float]]
+
+RESYNC = "resync"
+REVOKED = "revoked"
+NOTIFY_CHANNEL = "calculation_events"
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_PAYLOAD = 7900
+
+
+@dataclass(frozen=True)
+class Event:
+    kind: str
+    version: int
+    data: dict = field(default_factory=dict)
+
+    def to_json(self, user_id: int) -> str:
+        return json.dumps({"user_id": user_id, "kind": self.kind, "version": self.version, "data": self.data})
+
+
+def statistics_delta(*changes: Tuple[OperationType, int, float]) -> StatisticsDelta:
+    """Combine (operation, count, result_sum) changes"""
+    delta: Dict[OperationType, Tuple[int, float]] = {}
+    for operation, count, result_sum in changes:
+        previous_count, previous_sum = delta.get(operation, (0, 0.0))
+        delta[operation] = (previous_count + count, previous_sum + result_sum)
+    return delta
+
+
+def calculations_event(kind: str, version: int, delta: StatisticsDelta, calculations: Iterable[dict] = (), ids: Iterable[int] = ()) -> Event:
+    """A created/updated/deleted event with the statistics change it caused"""
+    data = {
+        "version": version,
+        "statistics": {
+            operation.value: {"count": count, "result_sum": result_sum}
+            for operation, (count, result_sum) in delta.items()
+        },
+    }
+    if kind == "deleted":
+        data["ids"] = list(ids)
+    else:
+        data["calculations"] = list(calculations)
+    return Event(kind, version, data)
+
+
+def resync_event(version: int) -> Event:
+    """Tell clients to reload instead of applying a change (bulk imports, overflows)"""
+    return Event(RESYNC, version, {"version": version})
+
+
+def revoked_event(token_version: int) -> Event:
+    """End the streams opened with a token older than token_version (after a password change)"""
+    return Event(REVOKED, 0, {"token_version": token_version})
+
+
+class Subscription:
+    """One open stream; events are queued on the loop serving it"""
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop, max_size: int):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=max_size)
+        self.overflowed = False
+
+    def deliver(self, event: Event) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client is not keeping up: drop what is queued and make it start over
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(resync_event(event.version))
+
+
+class EventHub:
+    """In-process fan-out of a user's events to their open streams"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscriptions: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self.dispatched = 0
+        self.overflows = 0
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """Register a stream; must be called on the event loop that will read it"""
+        subscription = Subscription(user_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+        if subscription.overflowed:
+            self.overflows += 1
+
+    def dispatch(self, user_id: int, event: Event) -> None:
+        """Queue an event for the user's streams; safe to call from any thread"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The loop serving this stream has shut down
+                self.unsubscribe(subscription)
+        self.dispatched += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._subscriptions),
+                "streams": sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+                "dispatched": self.dispatched,
+                "overflows": self.overflows,
+            }
+
+
+Handler = Callable[[int, Event], None]
+
+
+class LocalBroker:
+    """Deliver events to the hubs attached in this process"""
+
+    def __init__(self):
+        self._handlers: List[Handler] = []
+
+    def attach(self, handler: Handler) -> None:
+        self._handlers.append(handler)
+
+    def start(self) -> None:
+        pass
+
+    def publish(self, user_id: int, event: Event) -> None:
+        for handler in self._handlers:
+            handler(user_id, event)
+
+
+def _decode(payload: str) -> Tuple[int, Event]:
+    message = json.loads(payload)
+    return message["user_id"], Event(message["kind"], message["version"], message["data"])
+
+
+class PostgresBroker:
+    """Relay events between workers with LISTEN/NOTIFY
+
+    A daemon thread owns one autocommit psycopg2 connection. It sends queued
+    events with pg_notify and hands every notification on the channel,
+    including this worker's own, to the attached hubs. Events published while
+    the connection is down are lost; streams notice the version gap and
+    resync. The thread starts on first use, so it is never inherited by a fork.
+    """
+
+    def __init__(self, dsn: str, channel: str = NOTIFY_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        self._handlers: List[Handler] = []
+        self._outbox: "queue.Queue[str]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def attach(self, handler: Handler) -> None:
+        self._handlers.append(handler)
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._wake_read, self._wake_write = os.pipe()
+                self._thread = threading.Thread(target=self._run, name="event-broker", daemon=True)
+                self._thread.start()
+
+    def publish(self, user_id: int, event: Event) -> None:
+        payload = event.to_json(user_id)
+        if len(payload.encode("utf-8")) > MAX_NOTIFY_PAYLOAD:
+            payload = resync_event(event.version).to_json(user_id)
+        self.start()
+        self._outbox.put(payload)
+        os.write(self._wake_write, b"\0")
+
+    def _run(self) -> None:
+        import psycopg2
+        import psycopg2.extensions
+
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(self.dsn)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                    while True:
+                        while not self._outbox.empty():
+                            cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, self._outbox.get_nowait()))
+                        readable, _, _ = io_select.select([connection, self._wake_read], [], [], 5.0)
+                        if self._wake_read in readable:
+                            os.read(self._wake_read, 4096)
+                        connection.poll()
+                        while connection.notifies:
+                            self._dispatch(connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("Event broker connection failed, reconnecting")
+                time.sleep(1.0)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _dispatch(self, payload: str) -> None:
+        user_id, event = _decode(payload)
+        for handler in self._handlers:
+            handler(user_id, event)
+
+
+def make_broker(url: Optional[str]):
+    if not url:
+        return LocalBroker()
+    from sqlalchemy.engine import make_url
+
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "postgresql":
+        raise RuntimeError("EVENT_BROKER_URL must be a PostgreSQL URL")
+    # psycopg2 takes a libpq URI, without SQLAlchemy's "+driver" suffix
+    return PostgresBroker(parsed.set(drivername="postgresql").render_as_string(hide_password=False))
+
+
+# Keep proxies from caching or buffering the stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_event(kind: str, data: dict) -> str:
+    return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(
+    request: Request, subscription: Subscription, version: int, statistics: dict, token_version: int = 0
+) -> AsyncIterator[str]:
+    """Send the snapshot, then the user's changes after it, with keep-alives while idle
+
+    token_version is that of the token the stream was opened with; the
+    stream ends once a newer one revokes it.
+    """
+    try:
+        yield format_event("snapshot", {"version": version, "statistics": statistics})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.event_heartbeat_seconds)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            if event.kind == REVOKED:
+                if event.data["token_version"] > token_version:
+                    yield format_event(REVOKED, {})
+                    return
+                continue
+            if event.version <= version:
+                # Already part of the snapshot
+                continue
+            if event.kind == RESYNC or event.version != version + 1:
+                yield format_event(RESYNC, {"version": event.version})
+                return
+            version = event.version
+            yield format_event(event.kind, event.data)
+    finally:
+        event_hub.unsubscribe(subscription)
+
+
+def event_response(
+    request: Request, subscription: Subscription, version: int, statistics: dict, token_version: int = 0
+) -> StreamingResponse:
+    return StreamingResponse(
+        event_stream(request, subscription, version, statistics, token_version),
+        media_type="text/event-stream",
+        headers=STREAM_HEADERS
+    )
+
+
+def snapshot_statement(user_id: int):
+    """The user's history version with their rollup rows, read in one statement so they agree"""
+    return select(
+        User.history_version,
+        UserCalculationStats.operation,
+        UserCalculationStats.count,
+        UserCalculationStats.result_sum
+    ).outerjoin(
+        UserCalculationStats,
+        and_(UserCalculationStats.user_id == User.id, UserCalculationStats.count > 0)
+    ).where(User.id == user_id)
+
+
+def snapshot(rows) -> Tuple[int, dict]:
+    """The version and per-operation statistics from the rows of snapshot_statement"""
+    version = 0
+    statistics = {}
+    for version, operation, count, result_sum in rows:
+        if operation is not None:
+            statistics[operation.value] = {"count": count, "result_sum": result_sum}
+    return version, statistics
+
+
+event_hub = EventHub(settings.event_queue_size)
+event_broker = make_broker(settings.event_broker_url)
+event_broker.attach(event_hub.dispatch)
+
+
+def subscribe(user_id: int) -> Subscription:
+    """Open a stream for the user on the running event loop"""
+    event_broker.start()
+    return event_hub.subscribe(user_id)
+
+
+def publish(user_id: int, event: Event) -> None:
+    """Send an event to the user's streams on every worker (call after commit)"""
+    event_broker.publish(user_id, event)
@@ -0,0 +1,132 @@
+"""Streaming export of a user's calculation history
+
+Rows are read through a server-side cursor (`yield_per`) and encoded into
+fixed-size chunks, so an export holds one chunk in memory however long the
+history is.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional
+from sqlalchemy import select
+from app.models import Calculation
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Same fields, in the same order, as CalculationResponse
+EXPORT_COLUMNS = (
+    Calculation.id,
+    Calculation.user_id,
+    Calculation.operation,
+    Calculation.operand1,
+    Calculation.operand2,
+    Calculation.result,
+    Calculation.created_at,
+)
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+
+YIELD_PER = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def _naive_utc(value: datetime) -> datetime:
+    # created_at is stored as naive UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def export_statement(user_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Select the user's calculations oldest first, from `since` (inclusive) to `until` (exclusive)"""
+    stmt = select(*EXPORT_COLUMNS).where(Calculation.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(Calculation.created_at >= _naive_utc(since))
+    if until is not None:
+        stmt = stmt.where(Calculation.created_at < _naive_utc(until))
+    return stmt.order_by(Calculation.created_at, Calculation.id).execution_options(yield_per=YIELD_PER)
+
+
+def export_filename(export_format: str, compress: bool) -> str:
+    return f"calculations.{export_format}" + (".gz" if compress else "")
+
+
+def _row_values(row) -> list:
+    # Unpacking is much cheaper than attribute access on Row
+    calculation_id, user_id, operation, operand1, operand2, result, created_at = row
+    return [
+        calculation_id,
+        user_id,
+        operation.value,
+        operand1,
+        operand2,
+        result,
+        created_at.isoformat() if created_at else None,
+    ]
+
+
+class ExportWriter:
+    """Encode rows as NDJSON or CSV and hand back output in CHUNK_SIZE pieces"""
+
+    def __init__(self, export_format: str, compress: bool = False):
+        if export_format not in EXPORT_MEDIA_TYPES:
+            raise ValueError(f"Unknown export format: {export_format}")
+        self.export_format = export_format
+        # wbits=31 writes a gzip header and trailer
+        self.compressor = zlib.compressobj(wbits=31) if compress else None
+        self.buffer = io.StringIO()
+        self.csv_writer = None
+        if export_format == "csv":
+            self.csv_writer = csv.writer(self.buffer, lineterminator="\n")
+            self.csv_writer.writerow(EXPORT_FIELDS)
+
+    def write(self, row) -> Optional[bytes]:
+        """Add a row, returning a chunk once enough output has accumulated"""
+        values = _row_values(row)
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(values)
+        else:
+            self.buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, values))))
+            self.buffer.write("\n")
+        if self.buffer.tell() >= CHUNK_SIZE:
+            return self._drain()
+        return None
+
+    def close(self) -> bytes:
+        """Return whatever is left, including the gzip trailer"""
+        chunk = self._drain()
+        if self.compressor is not None:
+            chunk += self.compressor.flush()
+        return chunk
+
+    def _drain(self) -> bytes:
+        data = self.buffer.getvalue().encode("utf-8")
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        return data
+
+
+def iter_export(rows: Iterable, export_format: str, compress: bool = False) -> Iterator[bytes]:
+    """Stream encoded chunks for rows from export_statement"""
+    writer = ExportWriter(export_format, compress)
+    for row in rows:
+        chunk = writer.write(row)
+        if chunk:
+            yield chunk
+    yield writer.close()
+
+
+async def aiter_export(rows: AsyncIterable, export_format: str, compress: bool = False) -> AsyncIterator[bytes]:
+    """Async version of iter_export"""
+    writer = ExportWriter(export_format, compress)
+    async for row in rows:
+        chunk = writer.write(row)
+        if chunk:
+            yield chunk
+    yield writer.close()
@@ -0,0 +1,83 @@
+"""Fast JSON rendering for the calculation list and statistics responses
+
+The default path loads ORM objects, validates each one into
+CalculationResponse and encodes the result with the stdlib encoder. With
+FAST_JSON_RESPONSES the handlers select plain column tuples instead, build
+the dicts directly and encode them with orjson.
+
+The output is byte-identical to the default path. orjson formats floats like
+float.__repr__ (which the stdlib encoder uses) only in fixed notation, that
+is for zero and magnitudes in [1e-4, 1e16). Pages holding any other float,
+including inf and nan which the stdlib encoder rejects, are encoded with the
+stdlib encoder exactly as JSONResponse would.
+"""
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, List, Sequence
+import orjson
+from pydantic import TypeAdapter
+from app.models import Calculation
+
+# In CalculationResponse field order, which is the order of the JSON keys
+CALCULATION_COLUMNS = (
+    Calculation.operation,
+    Calculation.operand1,
+    Calculation.operand2,
+    Calculation.id,
+    Calculation.user_id,
+    Calculation.result,
+    Calculation.created_at,
+)
+
+_DATETIME = TypeAdapter(datetime)
+
+
+def _datetime_json(value: datetime) -> str:
+    # Pydantic writes naive datetimes in isoformat, but UTC offsets as "Z"
+    if value.tzinfo is None:
+        return value.isoformat()
+    return _DATETIME.dump_python(value, mode="json")
+
+
+def calculation_dicts(rows: Sequence) -> List[dict]:
+    """CalculationResponse-shaped dicts for rows of CALCULATION_COLUMNS"""
+    return [
+        {
+            "operation": operation.value,
+            "operand1": operand1,
+            "operand2": operand2,
+            "id": calculation_id,
+            "user_id": user_id,
+            "result": result,
+            "created_at": _datetime_json(created_at),
+        }
+        for operation, operand1, operand2, calculation_id, user_id, result, created_at in rows
+    ]
+
+
+def calculation_floats(rows: Sequence) -> Iterator[float]:
+    for row in rows:
+        yield row[1]
+        yield row[2]
+        yield row[5]
+
+
+def _fixed_notation(value: float) -> bool:
+    return value == 0.0 or 1e-4 <= abs(value) < 1e16
+
+
+def dumps(content, floats: Iterable[float]) -> bytes:
+    """Encode content as starlette's JSONResponse does; `floats` must cover every float in it"""
+    if all(map(_fixed_notation, floats)):
+        return orjson.dumps(content)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def render_calculations(rows: Sequence) -> bytes:
+    return dumps(calculation_dicts(rows), calculation_floats(rows))
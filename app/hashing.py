@@ -0,0 +1,127 @@
+"""Bounded worker pool for bcrypt hashing and verification
+
+bcrypt is deliberately slow. Running it inline lets a burst of logins occupy
+every threadpool worker and starve unrelated endpoints. Password work is
+instead handed to a dedicated pool with a fixed number of workers and a
+bounded backlog. When the backlog is full the caller gets
+PasswordPoolSaturated straight away (turned into a 503 by the app) and does
+not join the queue.
+
+The pool uses threads: the bcrypt extension releases the GIL while hashing.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from passlib.context import CryptContext
+from app.metrics import LatencyHistogram
+from app.instrumentation import timed
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when the password pool's backlog is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing pool is saturated")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Runs passlib hash/verify calls on a bounded worker pool"""
+
+    def __init__(self, context: CryptContext, workers: int, max_queue: int, retry_after: int = 1):
+        self.context = context
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._counter_lock = threading.Lock()
+        self.latency: Dict[str, LatencyHistogram] = {"hash": LatencyHistogram(), "verify": LatencyHistogram()}
+        self.queue_wait = LatencyHistogram()
+
+    def hash(self, password: str) -> str:
+        return self._run("hash", self.context.hash, password)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run("verify", self.context.verify, password, hashed)
+
+    async def hash_async(self, password: str) -> str:
+        return await self._run_async("hash", self.context.hash, password)
+
+    async def verify_async(self, password: str, hashed: str) -> bool:
+        return await self._run_async("verify", self.context.verify, password, hashed)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created on first use so forked workers never inherit a parent's threads
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="password-hash"
+                    )
+        return self._executor
+
+    def _acquire(self) -> None:
+        if not self._slots.acquire(blocking=False):
+            with self._counter_lock:
+                self._rejected += 1
+            raise PasswordPoolSaturated(self.retry_after)
+        with self._counter_lock:
+            self._in_flight += 1
+
+    def _release(self) -> None:
+        with self._counter_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _submit(self, kind: str, func: Callable, *args):
+        submitted = time.perf_counter()
+
+        def run_timed():
+            started = time.perf_counter()
+            self.queue_wait.observe(started - submitted)
+            try:
+                return func(*args)
+            finally:
+                self.latency[kind].observe(time.perf_counter() - started)
+
+        return self._get_executor().submit(run_timed)
+
+    def _run(self, kind: str, func: Callable, *args):
+        self._acquire()
+        try:
+            with timed("bcrypt"):
+                return self._submit(kind, func, *args).result()
+        finally:
+            self._release()
+
+    async def _run_async(self, kind: str, func: Callable, *args):
+        self._acquire()
+        try:
+            with timed("bcrypt"):
+                return await asyncio.wrap_future(self._submit(kind, func, *args))
+        finally:
+            self._release()
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def metrics(self) -> Dict:
+        with self._counter_lock:
+            in_flight, rejected = self._in_flight, self._rejected
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": in_flight,
+            "rejected": rejected,
+            "queue_wait": self.queue_wait.snapshot(),
+            "latency": {kind: histogram.snapshot() for kind, histogram in self.latency.items()},
+        }
@@ -0,0 +1,42 @@
+"""Per-user calculation history version
+
+Every write to a user's calculations bumps users.history_version in the same
+transaction. The read endpoints derive their ETag from the version on the
+authenticated user snapshot, so a conditional GET from an idle client is
+answered with 304 before any query runs. Events sent to open streams carry it
+too, so clients can tell whether they missed one.
+"""
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.auth import user_cache
+from app.models import User
+from app.response_cache import response_cache
+from app.events import Event, publish
+
+
+def _bump_statement(user_id: int):
+    # Keep updated_at: it records profile changes, not calculation writes
+    return update(User).where(User.id == user_id).values(
+        history_version=User.history_version + 1,
+        updated_at=User.updated_at
+    ).returning(User.history_version).execution_options(synchronize_session=False)
+
+
+def bump_history_version(db: Session, user_id: int) -> int:
+    """Mark the user's history as changed (takes effect on commit) and return the new version"""
+    return db.execute(_bump_statement(user_id)).scalar_one()
+
+
+async def bump_history_version_async(db: AsyncSession, user_id: int) -> int:
+    """Async version of bump_history_version"""
+    return (await db.execute(_bump_statement(user_id))).scalar_one()
+
+
+def history_changed(user_id: int, calculation_id: Optional[int] = None, event: Optional[Event] = None) -> None:
+    """Drop cached state derived from the old version and notify open streams, after the write committed"""
+    user_cache.invalidate(user_id)
+    response_cache.invalidate_calculations(user_id, calculation_id)
+    if event is not None:
+        publish(user_id, event)
@@ -0,0 +1,282 @@
+"""Bulk import of calculations from uploaded CSV or NDJSON files
+
+An upload is copied to a temporary file and processed by a background job.
+The job reads the file one line at a time, validates and evaluates rows
+`import_chunk_size` at a time (the same rules as POST /api/calculations/batch),
+and commits each chunk with a bulk insert (COPY on PostgreSQL/psycopg2).
+Progress and a per-line error report are written to the import_jobs table in
+the same transaction as each chunk, so any worker can answer a progress poll
+and the reported counts always match the committed rows.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.config import get_settings
+from app.models import Calculation, ImportJobState
+from app.rollup import record_calculations, record_calculations_async
+from app.history import bump_history_version, bump_history_version_async, history_changed
+from app.events import resync_event
+
+if TYPE_CHECKING:
+    from app.routers.calculations import CalculationBatch
+
+settings = get_settings()
+
+IMPORT_FORMATS = ("ndjson", "csv")
+GZIP_MAGIC = b"\x1f\x8b"
+UPLOAD_COPY_CHUNK = 1024 * 1024
+
+COPY_COLUMNS = ("user_id", "operation", "operand1", "operand2", "result", "created_at")
+COPY_SQL = f"COPY calculations ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+# A parsed line: (line number, item to validate or None, parse error or None)
+ParsedLine = Tuple[int, Any, Optional[str]]
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """Guess the format from the file name (.csv, .ndjson/.jsonl, optionally .gz)"""
+    name = (filename or "").lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return None
+
+
+def open_text(raw) -> io.TextIOWrapper:
+    # Accept gzip-compressed uploads, such as the files /export?gzip=true produces
+    stream = gzip.GzipFile(fileobj=raw) if raw.read(2) == GZIP_MAGIC else raw
+    raw.seek(0)
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+def _iter_ndjson(text: io.TextIOWrapper) -> Iterator[ParsedLine]:
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except ValueError:
+            yield line_number, None, "Invalid JSON"
+
+
+def _iter_csv(text: io.TextIOWrapper) -> Iterator[ParsedLine]:
+    # Extra columns (such as those in an export file) are ignored
+    reader = csv.DictReader(text)
+    for row in reader:
+        if None in row:
+            yield reader.line_num, None, "Too many fields"
+        else:
+            yield reader.line_num, row, None
+
+
+def iter_lines(text: io.TextIOWrapper, import_format: str) -> Iterator[ParsedLine]:
+    """Parse an uploaded file incrementally"""
+    return _iter_ndjson(text) if import_format == "ndjson" else _iter_csv(text)
+
+
+def _copy_rows(db: Session, rows: List[Dict]) -> None:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    now = datetime.utcnow().isoformat()
+    for row in rows:
+        writer.writerow([
+            row["user_id"], row["operation"].name, repr(row["operand1"]),
+            repr(row["operand2"]), repr(row["result"]), now
+        ])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(COPY_SQL, buffer)
+    finally:
+        cursor.close()
+
+
+def save_upload(source) -> Tuple[str, int]:
+    """Copy an uploaded file to a temporary path the job owns, returning (path, size)"""
+    with tempfile.NamedTemporaryFile(prefix="calculations-import-", delete=False) as target:
+        shutil.copyfileobj(source, target, UPLOAD_COPY_CHUNK)
+        return target.name, target.tell()
+
+
+async def save_upload_async(upload) -> Tuple[str, int]:
+    """Async version of save_upload for a Starlette UploadFile"""
+    with tempfile.NamedTemporaryFile(prefix="calculations-import-", delete=False) as target:
+        while chunk := await upload.read(UPLOAD_COPY_CHUNK):
+            target.write(chunk)
+        return target.name, target.tell()
+
+
+class ImportJob:
+    """State and progress of one import"""
+
+    def __init__(self, user_id: int, import_format: str, path: str, total_bytes: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.format = import_format
+        self.path = path
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.status = "pending"
+        self.lines_processed = 0
+        self.created = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def chunks(self, raw) -> Iterator["CalculationBatch"]:
+        """Parse, validate and evaluate the file, yielding batches ready to insert"""
+        from app.routers.calculations import CalculationBatch
+
+        # Hold on to the wrapper: it closes `raw` when garbage collected
+        text = open_text(raw)
+        lines = iter_lines(text, self.format)
+        while True:
+            items, line_numbers = [], []
+            for line_number, item, error in lines:
+                self.lines_processed += 1
+                if error is not None:
+                    self._record_error(line_number, error)
+                    continue
+                items.append(item)
+                line_numbers.append(line_number)
+                if len(items) >= settings.import_chunk_size:
+                    break
+            if not items:
+                return
+            batch = CalculationBatch(items, self.user_id)
+            for index, error in batch.errors.items():
+                self._record_error(line_numbers[index], error)
+            self.bytes_read = raw.tell()
+            if batch.rows:
+                yield batch
+
+    def insert_statement(self):
+        return insert(ImportJobState).values(user_id=self.user_id, **self.snapshot())
+
+    def update_statement(self, **overrides):
+        """Save the job's progress, with `overrides` for counts that only hold once the transaction commits"""
+        return update(ImportJobState).where(ImportJobState.id == self.id).values({**self.snapshot(), **overrides})
+
+    def _record_error(self, line_number: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < settings.import_max_errors:
+            self.errors.append({"line": line_number, "error": error})
+
+    def _finish(self, error: Optional[str] = None) -> None:
+        self.status = "failed" if error else "completed"
+        self.error = error
+        if not error:
+            self.bytes_read = self.total_bytes
+        self.finished_at = datetime.utcnow()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def run(self, session_factory) -> None:
+        """Import the file, committing one chunk at a time"""
+        self.status = "running"
+        db = session_factory()
+        try:
+            db.execute(self.update_statement())
+            db.commit()
+            use_copy = db.get_bind().dialect.driver == "psycopg2"
+            with open(self.path, "rb") as raw:
+                for batch in self.chunks(raw):
+                    if use_copy:
+                        _copy_rows(db, batch.rows)
+                    else:
+                        db.execute(insert(Calculation), batch.rows)
+                    record_calculations(db, self.user_id, batch.rollup_deltas())
+                    version = bump_history_version(db, self.user_id)
+                    db.execute(self.update_statement(created=self.created + len(batch.rows)))
+                    db.commit()
+                    # Chunks are too big to push to streams; have them reload instead
+                    history_changed(self.user_id, event=resync_event(version))
+                    self.created += len(batch.rows)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            db.rollback()
+            self._finish(f"Could not read file: {e}")
+        except Exception as e:
+            db.rollback()
+            self._finish(str(e) or type(e).__name__)
+            raise
+        else:
+            self._finish()
+        finally:
+            try:
+                db.execute(self.update_statement())
+                db.commit()
+            finally:
+                db.close()
+
+    async def run_async(self, session_factory) -> None:
+        """Async version of run"""
+        self.status = "running"
+        async with session_factory() as db:
+            try:
+                await db.execute(self.update_statement())
+                await db.commit()
+                with open(self.path, "rb") as raw:
+                    # Parsing and evaluation are CPU bound, keep them off the event loop
+                    chunks = self.chunks(raw)
+                    while (batch := await run_in_threadpool(next, chunks, None)) is not None:
+                        await db.execute(insert(Calculation), batch.rows)
+                        await record_calculations_async(db, self.user_id, batch.rollup_deltas())
+                        version = await bump_history_version_async(db, self.user_id)
+                        await db.execute(self.update_statement(created=self.created + len(batch.rows)))
+                        await db.commit()
+                        history_changed(self.user_id, event=resync_event(version))
+                        self.created += len(batch.rows)
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                await db.rollback()
+                self._finish(f"Could not read file: {e}")
+            except Exception as e:
+                await db.rollback()
+                self._finish(str(e) or type(e).__name__)
+                raise
+            else:
+                self._finish()
+            finally:
+                await db.execute(self.update_statement())
+                await db.commit()
+
+    def snapshot(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "format": self.format,
+            "total_bytes": self.total_bytes,
+            "bytes_read": self.bytes_read,
+            "lines_processed": self.lines_processed,
+            "created": self.created,
+            "failed": self.failed,
+            "errors": list(self.errors),
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def import_job_statement(job_id: str, user_id: int):
+    """The state of one of the user's jobs; other users' jobs are not found"""
+    return select(ImportJobState).where(ImportJobState.id == job_id, ImportJobState.user_id == user_id)
@@ -0,0 +1,230 @@
+"""Per-request timing and SQL query counts
+
+`InstrumentationMiddleware` opens a RequestStats for every HTTP request in a
+context variable. SQLAlchemy cursor events, registered on every Engine (sync
+and the async engines' sync cores), add each statement's count and duration
+to it, and `timed` blocks add named phases such as bcrypt and JWT work. When
+the response starts the middleware adds a Server-Timing header. When it
+ends, the request is recorded in per-route histograms, which /metrics
+exposes in the Prometheus text format.
+
+With MAX_QUERIES_PER_REQUEST set, or a limit in `query_limits` for the
+route, the statement that goes over the limit raises QueryLimitExceeded.
+Tests use it to fail at the query that broke an endpoint's budget.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import get_settings
+from app.metrics import DEFAULT_LATENCY_BUCKETS, LatencyHistogram
+
+settings = get_settings()
+
+# Buckets for statements per request and for DB time per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+DB_TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+UNMATCHED_ROUTE = "unmatched"
+
+# Per-route query limits for tests, keyed like "GET /api/calculations/{calculation_id}"
+query_limits: Dict[str, int] = {}
+
+
+class QueryLimitExceeded(Exception):
+    """A request ran more SQL statements than its route allows"""
+
+    def __init__(self, route: str, limit: int, statement: str):
+        super().__init__(f"{route} exceeded its limit of {limit} queries with: {statement}")
+        self.route = route
+        self.limit = limit
+        self.statement = statement
+
+
+def route_key(scope: Scope) -> str:
+    """Method and route template of the request, so metrics stay one series per endpoint"""
+    route = scope.get("route")
+    return f"{scope['method']} {route.path if route is not None else UNMATCHED_ROUTE}"
+
+
+class RequestStats:
+    """Statement count and phase timings of one request"""
+
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.phases: Dict[str, float] = {}
+        self.elapsed: Optional[float] = None
+        # Background tasks run after the response, in the same context; they are not counted
+        self.finished = False
+
+    def finish(self) -> None:
+        if not self.finished:
+            self.finished = True
+            self.elapsed = time.perf_counter() - self.started
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def query_limit(self) -> Optional[int]:
+        return query_limits.get(route_key(self.scope), settings.max_queries_per_request)
+
+    def server_timing(self) -> str:
+        metrics = [f'db;dur={self.query_seconds * 1000:.2f};desc="queries={self.queries}"']
+        metrics.extend(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items())
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """Stats of the request being served, if any"""
+    stats = _current.get()
+    return None if stats is None or stats.finished else stats
+
+
+@contextmanager
+def timed(name: str):
+    """Add the duration of the block to the current request's `name` phase"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.add_phase(name, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    if stats is None:
+        return
+    stats.queries += 1
+    limit = stats.query_limit()
+    if limit is not None and stats.queries > limit:
+        raise QueryLimitExceeded(route_key(stats.scope), limit, statement)
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    started = conn.info.get("query_started")
+    if stats is None or not started:
+        return
+    stats.query_seconds += time.perf_counter() - started.pop()
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+class RouteMetrics:
+    """Latency, statement count and DB time histograms plus status counts per route"""
+
+    def __init__(self):
+        self._routes: Dict[str, Tuple[LatencyHistogram, LatencyHistogram, LatencyHistogram]] = {}
+        self._statuses: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, status: int, stats: RequestStats, seconds: float) -> None:
+        with self._lock:
+            histograms = self._routes.get(key)
+            if histograms is None:
+                histograms = self._routes[key] = (
+                    LatencyHistogram(DEFAULT_LATENCY_BUCKETS),
+                    LatencyHistogram(QUERY_COUNT_BUCKETS),
+                    LatencyHistogram(DB_TIME_BUCKETS),
+                )
+            self._statuses[key, status] = self._statuses.get((key, status), 0) + 1
+        latency, queries, query_seconds = histograms
+        latency.observe(seconds)
+        queries.observe(stats.queries)
+        query_seconds.observe(stats.query_seconds)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._routes.clear()
+            self._statuses.clear()
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            statuses = sorted(self._statuses.items())
+        lines: List[str] = []
+        families = [
+            ("http_request_duration_seconds", "Request latency by route", 0),
+            ("db_queries_per_request", "SQL statements per request by route", 1),
+            ("db_query_duration_seconds", "Time spent in SQL per request by route", 2),
+        ]
+        for name, description, index in families:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+            for key, histograms in routes:
+                lines += _histogram_lines(name, _labels(key), histograms[index].snapshot())
+        lines += ["# HELP http_requests_total Requests by route and status", "# TYPE http_requests_total counter"]
+        for (key, status), count in statuses:
+            lines.append(f'http_requests_total{{{_labels(key)},status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: str) -> str:
+    method, route = key.split(" ", 1)
+    return f'method="{method}",route="{route}"'
+
+
+def _histogram_lines(name: str, labels: str, snapshot: dict) -> List[str]:
+    lines = [f'{name}_bucket{{{labels},le="{bound}"}} {count}' for bound, count in snapshot["buckets"].items()]
+    lines.append(f"{name}_sum{{{labels}}} {snapshot['sum_seconds']}")
+    lines.append(f"{name}_count{{{labels}}} {snapshot['count']}")
+    return lines
+
+
+request_metrics = RouteMetrics()
+
+
+class InstrumentationMiddleware:
+    """Time each HTTP request, count its SQL statements and report both"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", stats.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                stats.finish()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            stats.finish()
+            _current.reset(token)
+            request_metrics.observe(route_key(scope), status, stats, stats.elapsed)
@@ -1,21 +1,49 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pathlib import Path
-from app.database import engine, Base
-from app.routers import auth, calculations, users
+from starlette.concurrency import run_in_threadpool
+from app import database
+from app.database import Base
+from app.assets import REVALIDATE, static_assets
+from app.config import get_settings
+from app.auth import password_hasher
+from app.hashing import PasswordPoolSaturated
+from app.result_cache import calculation_cache
+from app.response_cache import response_cache
+from app.events import event_hub
+from app.instrumentation import InstrumentationMiddleware, request_metrics
+from app.compression import CompressionMiddleware, parse_encodings
+from app.rate_limit import RateLimitMiddleware, rate_limiter
+
+settings = get_settings()
+
+if settings.database_async:
+    from app.routers import auth_async as auth, calculations_async as calculations, events_async as events, users_async as users
+else:
+    from app.routers import auth, calculations, events, users
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown work that must not run at import time"""
+    if settings.create_tables:
+        await run_in_threadpool(Base.metadata.create_all, bind=database.get_engine())
+    # Read, hash and compress the frontend now rather than on the first page load
+    await run_in_threadpool(static_assets.bundle)
+    yield
+    await database.dispose_engines()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
 
 # Create FastAPI app
 app = FastAPI(
     title="Advanced Calculator API",
     description="A FastAPI application with calculator functionality, user authentication, and statistics",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Inside CORS, so 429s carry the CORS headers and preflight requests are not counted
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -23,25 +51,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining"],
 )
+app.add_middleware(
+    CompressionMiddleware,
+    encodings=parse_encodings(settings.compression_encodings),
+    level=settings.compression_level,
+    minimum_size=settings.compression_minimum_size,
+)
+# Outermost, so the timings cover the other middleware too
+app.add_middleware(InstrumentationMiddleware)
+
+@app.exception_handler(PasswordPoolSaturated)
+async def password_pool_saturated_handler(request: Request, exc: PasswordPoolSaturated):
+    """Shed load when too many password hashes are already queued"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 # Include routers
 app.include_router(auth.router)
 app.include_router(calculations.router)
 app.include_router(users.router)
+app.include_router(events.router)
 
-# Mount static files
-static_dir = Path(__file__).parent / "static"
-static_dir.mkdir(exist_ok=True)
-app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
+@app.get("/static/{name}", include_in_schema=False)
+async def static_file(name: str, request: Request):
+    """Serve a frontend asset from memory; hashed names are cached by browsers for good"""
+    asset, cache_control = static_assets.bundle().lookup(name)
+    if asset is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return asset.response(request, cache_control)
 
 
 @app.get("/", response_class=HTMLResponse)
-async def root():
+async def root(request: Request):
     """Serve the main page"""
-    html_file = Path(__file__).parent / "static" / "index.html"
-    if html_file.exists():
-        return html_file.read_text()
+    index = static_assets.bundle().index
+    if index is not None:
+        return index.response(request, REVALIDATE)
     return """
     <html>
         <head>
@@ -59,3 +110,49 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Per-route latency, SQL statement count and DB time in the Prometheus text format"""
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/password-hashing")
+async def password_hashing_metrics():
+    """Password pool saturation and bcrypt latency"""
+    return password_hasher.metrics()
+
+
+@app.get("/metrics/calculation-cache")
+async def calculation_cache_metrics():
+    """Result cache size and hit/miss/eviction counters"""
+    return calculation_cache.metrics()
+
+
+@app.get("/metrics/response-cache")
+async def response_cache_metrics():
+    """Response cache hits, misses, 304s and invalidations"""
+    return response_cache.metrics()
+
+
+@app.get("/metrics/rate-limit")
+async def rate_limit_metrics():
+    """Configured limits and allowed/limited request counts"""
+    return rate_limiter.metrics()
+
+
+@app.get("/metrics/events")
+async def event_metrics():
+    """Open event streams, dispatched events and queue overflows"""
+    return event_hub.metrics()
+
+
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    """Connection pool occupancy, overflow and checkout wait times"""
+    database.get_engine()
+    pools = {"sync": database.pool_monitor.snapshot()}
+    if database.async_pool_monitor is not None:
+        pools["async"] = database.async_pool_monitor.snapshot()
+    return pools
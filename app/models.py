@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Text, JSON, DateTime, Float, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -12,11 +12,17 @@ class User(Base):
     username = Column(String, unique=True, index=True, nullable=False)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
+    # Bumped to revoke every token issued before a credential change
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Bumped by every write to the user's calculations; read endpoints derive their ETag from it
+    history_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     calculations = relationship("Calculation", back_populates="user", cascade="all, delete-orphan")
+    calculation_stats = relationship("UserCalculationStats", back_populates="user", cascade="all, delete-orphan")
+    import_jobs = relationship("ImportJobState", back_populates="user", cascade="all, delete-orphan")
 
 
 class OperationType(str, enum.Enum):
@@ -41,3 +47,46 @@ class Calculation(Base):
 
     # Relationships
     user = relationship("User", back_populates="calculations")
+
+    __table_args__ = (
+        # Serves history pages in both offset and keyset (cursor) mode
+        Index("ix_calculations_user_created_id", "user_id", created_at.desc(), id.desc()),
+        # Serves per-user GROUP BY operation recomputes of the statistics rollup
+        Index("ix_calculations_user_operation", "user_id", "operation"),
+    )
+
+
+class UserCalculationStats(Base):
+    """Per-user, per-operation rollup maintained alongside the calculations table"""
+    __tablename__ = "user_calculation_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    operation = Column(Enum(OperationType), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    result_sum = Column(Float, nullable=False, default=0.0)
+
+    # Relationships
+    user = relationship("User", back_populates="calculation_stats")
+
+
+class ImportJobState(Base):
+    """Progress and error report of a bulk import, readable from any worker"""
+    __tablename__ = "import_jobs"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    status = Column(String(16), nullable=False)
+    format = Column(String(16), nullable=False)
+    total_bytes = Column(BigInteger, nullable=False)
+    bytes_read = Column(BigInteger, nullable=False, default=0)
+    lines_processed = Column(Integer, nullable=False, default=0)
+    created = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    # The first IMPORT_MAX_ERRORS rejected lines, as [{"line": ..., "error": ...}]
+    errors = Column(JSON, nullable=False, default=list)
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+
+    # Relationships
+    user = relationship("User", back_populates="import_jobs")
@@ -0,0 +1,288 @@
+"""Token-bucket rate limits per route
+
+RATE_LIMITS maps "METHOD /path" to "<count>/<second|minute|hour|day>". Each
+client gets a bucket of `count` tokens per route. A bucket refills evenly over
+the period, and every request takes one token. A request that finds its bucket
+empty is answered with 429 and a Retry-After header, before the body is read,
+a session is opened or a password is hashed. A request with a valid access
+token is limited per user until the token expires; any other request, and
+every request to the login and register routes under /api/auth/, is limited
+per client IP.
+Limited routes also get X-RateLimit-Limit and X-RateLimit-Remaining headers.
+
+Buckets live in an in-process LRU. Set RATE_LIMIT_URL to a redis:// URL to
+share them between workers. The shared backend is a single Lua script, so
+checking a bucket is one round trip. Both backends do O(1) work per request.
+If the shared backend fails, requests are let through and counted in
+/metrics/rate-limit.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Mapping, Optional, Tuple
+from jose import JWTError, jwt
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import get_settings
+from app.instrumentation import timed
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    capacity: int
+    period_seconds: float
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.capacity / self.period_seconds
+
+    @classmethod
+    def parse(cls, value: str) -> "RateLimit":
+        """"10/minute" -> 10 requests, refilled evenly over a minute"""
+        count, _, period = value.partition("/")
+        try:
+            capacity = int(count)
+            seconds = PERIODS[period.strip().lower().rstrip("s")]
+        except (KeyError, ValueError):
+            raise RuntimeError(f"Invalid rate limit {value!r} (use <count>/<second|minute|hour|day>)") from None
+        if capacity < 1:
+            raise RuntimeError(f"Invalid rate limit {value!r} (the count must be at least 1)")
+        return cls(capacity, seconds)
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    remaining: int
+    # Seconds until the next token, when not allowed
+    retry_after: float = 0.0
+
+
+def take_token(tokens: float, elapsed: float, limit: RateLimit) -> Tuple[bool, float]:
+    """Refill a bucket holding `tokens` for `elapsed` seconds and take one token if there is one"""
+    tokens = min(limit.capacity, tokens + max(elapsed, 0.0) * limit.refill_per_second)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+def decide(allowed: bool, tokens: float, limit: RateLimit) -> Decision:
+    if allowed:
+        return Decision(True, int(tokens))
+    return Decision(False, 0, (1 - tokens) / limit.refill_per_second)
+
+
+class InMemoryBackend:
+    """Buckets in a thread-safe LRU; an evicted bucket starts full again"""
+
+    def __init__(self, max_entries: int, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: RateLimit) -> Decision:
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.capacity, now))
+            allowed, tokens = take_token(tokens, now - updated, limit)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return decide(allowed, tokens, limit)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+# Same arithmetic as take_token, on the server's clock so every worker agrees
+TAKE_TOKEN_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """Buckets shared between workers; needs only `eval` from the redis-py client"""
+
+    def __init__(self, client, prefix: str = "rl"):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key: str, limit: RateLimit) -> Decision:
+        allowed, tokens = self.client.eval(
+            TAKE_TOKEN_SCRIPT, 1, f"{self.prefix}:{key}", limit.capacity, repr(limit.refill_per_second)
+        )
+        return decide(bool(allowed), float(tokens), limit)
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(f"{self.prefix}:*"):
+            self.client.delete(key)
+
+
+def make_backend(url: Optional[str], max_entries: int):
+    if not url:
+        return InMemoryBackend(max_entries)
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("RATE_LIMIT_URL requires the redis package (pip install redis)") from None
+    return RedisBackend(redis.Redis.from_url(url))
+
+
+def parse_limits(limits: Mapping[str, str]) -> Dict[str, RateLimit]:
+    """Validate the RATE_LIMITS setting, keyed like "POST /api/auth/login" """
+    parsed = {}
+    for route, value in limits.items():
+        method, _, path = route.strip().partition(" ")
+        if not path.startswith("/"):
+            raise RuntimeError(f"Invalid rate limit route {route!r} (use \"METHOD /path\")")
+        parsed[f"{method.upper()} {path.strip()}"] = RateLimit.parse(value)
+    return parsed
+
+
+class RateLimiter:
+    """Finds the limit of a request and takes a token from its client's bucket"""
+
+    def __init__(self, backend, limits: Dict[str, RateLimit]):
+        self.backend = backend
+        self.limits = limits
+        self.allowed = 0
+        self.limited = 0
+        self.backend_errors = 0
+
+    def limit_for(self, scope: Scope) -> Tuple[Optional[str], Optional[RateLimit]]:
+        route = f"{scope['method']} {scope['path']}"
+        return route, self.limits.get(route)
+
+    def check(self, route: str, client: str, limit: RateLimit) -> Decision:
+        try:
+            decision = self.backend.take(f"{route}:{client}", limit)
+        except Exception:
+            # Fail open: an outage of the shared store must not take the API down with it
+            self.backend_errors += 1
+            logger.warning("Rate limit backend failed, letting %s through", route, exc_info=True)
+            return Decision(True, limit.capacity)
+        if decision.allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+        return decision
+
+    def metrics(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "routes": {route: f"{limit.capacity}/{limit.period_seconds:g}s" for route, limit in self.limits.items()},
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "backend_errors": self.backend_errors,
+        }
+
+
+# Login and register are what the limits protect; a token of one's own must not buy a fresh bucket there
+IP_ONLY_PREFIX = "/api/auth/"
+
+
+@lru_cache(maxsize=10000)
+def decode_token_user(token: str) -> Tuple[Optional[str], float]:
+    """The user id (or, for old tokens, username) of a token with a valid signature, and its expiry
+
+    Cached because clients send the same token with every request and
+    decoding one costs far more than the rest of the check.
+    """
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        return None, 0.0
+    user = payload.get("uid") or payload.get("sub")
+    return (None if user is None else str(user)), float(payload.get("exp", 0))
+
+
+def token_user(token: str) -> Optional[str]:
+    """The user of a token that has not expired yet
+
+    The expiry is checked on every call, so a cached token stops counting
+    against its user once it expires. A revoked token keeps its user's bucket
+    until then; authentication still rejects it.
+    """
+    user, expires_at = decode_token_user(token)
+    if user is None or expires_at <= time.time():
+        return None
+    return user
+
+
+def client_key(scope: Scope) -> str:
+    """`user:<id>` for a valid access token outside /api/auth/, else `ip:<address>`"""
+    scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token and not scope["path"].startswith(IP_ONLY_PREFIX):
+        user = token_user(token)
+        if user is not None:
+            return f"user:{user}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+class RateLimitMiddleware:
+    """Answer 429 to clients over their route's limit and add rate limit headers to the rest"""
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route, limit = self.limiter.limit_for(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        with timed("rate_limit"):
+            decision = self.limiter.check(route, client_key(scope), limit)
+        headers = {"X-RateLimit-Limit": str(limit.capacity), "X-RateLimit-Remaining": str(decision.remaining)}
+        if not decision.allowed:
+            headers["Retry-After"] = str(math.ceil(decision.retry_after))
+            response = JSONResponse({"detail": "Too many requests, please retry later"}, status_code=429, headers=headers)
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                raw = list(message.get("headers", []))
+                raw.extend((name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items())
+                message = {**message, "headers": raw}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+rate_limiter = RateLimiter(
+    make_backend(settings.rate_limit_url, settings.rate_limit_max_entries),
+    parse_limits(settings.rate_limits),
+)
@@ -0,0 +1,219 @@
+"""Per-user cache of rendered JSON responses for the read endpoints
+
+Responses carry a weak ETag built from the user's history version (see
+app.history), so a matching If-None-Match is answered with 304 straight from
+the authenticated user snapshot, before the cache or the database is read.
+A single calculation's ETag also names its id, so the tag of one calculation
+never revalidates another, and deleting one bumps the version its tag
+was built from. `If-None-Match: *` is not a match: the read has not checked
+yet that the calculation exists.
+
+Cached bodies are grouped into scopes: `calculations` for everything derived
+from a user's whole history (list pages, statistics) and `calculation:<id>`
+for a single calculation. Each scope has a generation token that is part of
+every entry key. Write handlers replace the token of the scopes they touch,
+which orphans the old entries at once, even if a slow read stores a stale
+response after the write committed. Keys in the `calculations` scope also
+include the user's history version, so a page is never served under the
+ETag of a newer version, even when the write that bumped it invalidated
+another process's cache.
+
+The backend only needs the `get` / `set(ex=)` / `delete` subset of the
+redis-py client, so `redis.Redis` can be used directly by setting
+RESPONSE_CACHE_URL. Without it an in-process LRU is used.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from app.config import get_settings
+
+settings = get_settings()
+
+CALCULATIONS_SCOPE = "calculations"
+# Let browsers keep the body but revalidate with If-None-Match every time
+CACHE_CONTROL = "private, no-cache"
+
+
+def calculation_scope(calculation_id: int) -> str:
+    return f"calculation:{calculation_id}"
+
+
+def history_etag(user, scope: str = CALCULATIONS_SCOPE) -> str:
+    # The user id keeps a shared browser from revalidating one user's page as another's
+    tag = f"{user.id}.{user.history_version}"
+    if scope != CALCULATIONS_SCOPE:
+        tag += "." + scope.partition(":")[2]
+    return f'W/"{tag}"'
+
+class InMemoryBackend:
+    """Thread-safe LRU implementing the redis-py methods the cache uses"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Optional[float], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ex if ex else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._entries.pop(key, None) is not None for key in keys)
+
+    def flushdb(self) -> bool:
+        with self._lock:
+            self._entries.clear()
+        return True
+
+
+def make_backend(url: Optional[str], max_entries: int):
+    if not url:
+        return InMemoryBackend(max_entries)
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("RESPONSE_CACHE_URL requires the redis package (pip install redis)") from None
+    return redis.Redis.from_url(url)
+
+
+class ResponseCache:
+    """Serve repeated reads from the backend, with ETag / If-None-Match support"""
+
+    def __init__(self, backend, ttl_seconds: int, prefix: str = "rc"):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _generation_key(self, user_id: int, scope: str) -> str:
+        return f"{self.prefix}:{user_id}:{scope}:gen"
+
+    def _generation(self, user_id: int, scope: str) -> str:
+        key = self._generation_key(user_id, scope)
+        generation = self.backend.get(key)
+        if generation is None:
+            # A fresh random token (never a fixed default), so a lost token
+            # cannot bring back entries stored under an older one
+            generation = uuid.uuid4().hex
+            self.backend.set(key, generation, ex=self.ttl_seconds)
+            return generation
+        return generation.decode() if isinstance(generation, bytes) else generation
+
+    def entry_key(self, request: Request, user, scope: str) -> str:
+        query = urlencode(sorted(request.query_params.multi_items()))
+        generation = self._generation(user.id, scope)
+        # A single calculation only changes with its own scope's generation, so creates elsewhere keep it cached
+        version = user.history_version if scope == CALCULATIONS_SCOPE else ""
+        return f"{self.prefix}:{user.id}:{scope}:{generation}:{version}:{request.url.path}?{query}"
+
+    def lookup(self, request: Request, user, scope: str) -> Tuple[Optional[str], Optional[Response]]:
+        """Return the entry key and, on a 304 or a hit, the response to send"""
+        etag = history_etag(user, scope)
+        tags = _parse_if_none_match(request.headers.get("if-none-match"))
+        if etag[2:] in tags:
+            self.not_modified += 1
+            return None, Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_cache_headers(etag))
+        if not self.enabled:
+            return None, None
+        key = self.entry_key(request, user, scope)
+        stored = self.backend.get(key)
+        if stored is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        header, body = stored.split(b"\n", 1)
+        return key, _json_response(body, {**json.loads(header), **_cache_headers(etag)})
+
+    def store(
+        self, user, key: Optional[str], content: Any, headers: Optional[Dict[str, str]] = None,
+        scope: str = CALCULATIONS_SCOPE
+    ) -> Response:
+        """Render content as FastAPI would (unless it is already bytes), cache it under key and respond"""
+        headers = headers or {}
+        body = content if isinstance(content, bytes) else JSONResponse(content).body
+        if key is not None:
+            self.backend.set(key, json.dumps(headers).encode() + b"\n" + body, ex=self.ttl_seconds)
+        return _json_response(body, {**headers, **_cache_headers(history_etag(user, scope))})
+
+    def invalidate(self, user_id: int, *scopes: str) -> None:
+        """Orphan every cached response in the given scopes of a user"""
+        if not self.enabled:
+            return
+        self.invalidations += 1
+        for scope in scopes:
+            self.backend.set(self._generation_key(user_id, scope), uuid.uuid4().hex, ex=self.ttl_seconds)
+
+    def invalidate_calculations(self, user_id: int, calculation_id: Optional[int] = None) -> None:
+        """Invalidate after a write to the user's calculations (and to one calculation)"""
+        scopes = [CALCULATIONS_SCOPE]
+        if calculation_id is not None:
+            scopes.append(calculation_scope(calculation_id))
+        self.invalidate(user_id, *scopes)
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+        }
+
+
+def _cache_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def _json_response(body: bytes, headers: Dict[str, str]) -> Response:
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _parse_if_none_match(value: Optional[str]) -> set:
+    if not value:
+        return set()
+    tags = set()
+    for tag in value.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tags.add(tag)
+    return tags
+
+
+response_cache = ResponseCache(
+    make_backend(settings.response_cache_url, settings.response_cache_max_entries),
+    settings.response_cache_ttl_seconds
+)
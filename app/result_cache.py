@@ -0,0 +1,92 @@
+"""Memoization of calculation results
+
+Keys use the operands' IEEE 754 bit patterns rather than float equality, so
+0.0 and -0.0 are cached separately (their results can differ in sign) and
+NaN operands can still be found again even though NaN != NaN.
+"""
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from app.config import get_settings
+from app.models import OperationType
+
+settings = get_settings()
+
+_FLOAT = struct.Struct("<d")
+
+
+def cache_key(operation: OperationType, operand1: float, operand2: float) -> tuple:
+    return operation, _FLOAT.pack(operand1), _FLOAT.pack(operand2)
+
+
+class CalculationCache:
+    """Bounded LRU cache of calculation results with an optional TTL
+
+    Only successful results are stored: inputs the calculation rejects
+    raise on every call and never take up a slot.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_compute(
+        self,
+        operation: OperationType,
+        operand1: float,
+        operand2: float,
+        compute: Callable[[OperationType, float, float], float]
+    ) -> float:
+        if self.max_size <= 0:
+            return compute(operation, operand1, operand2)
+        key = cache_key(operation, operand1, operand2)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        result = compute(operation, operand1, operand2)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (expires_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+calculation_cache = CalculationCache(settings.calculation_cache_size, settings.calculation_cache_ttl_seconds)
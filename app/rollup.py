@@ -0,0 +1,252 @@
+"""Maintenance of the user_calculation_stats rollup table
+
+The rollup holds one row per (user, operation) with the number of
+calculations and the sum of their results. Write handlers call
+`record_calculation` / `discard_calculation` before committing so the rollup
+changes in the same transaction as the calculations table.
+
+Run `python -m app.rollup check` to compare the rollup with a full recompute,
+and `python -m app.rollup check --repair` to rebuild any rows that drifted.
+"""
+import argparse
+import math
+import sys
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.models import Calculation, OperationType, UserCalculationStats
+
+StatsKey = Tuple[int, OperationType]
+StatsValue = Tuple[int, float]
+
+_UPSERT_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def _record_statement(dialect_name: str, user_id: int, operation: OperationType, result: float, count: int = 1):
+    """Build an upsert adding calculations, or None if the dialect has no upsert"""
+    upsert = _UPSERT_DIALECTS.get(dialect_name)
+    if upsert is None:
+        return None
+    stmt = upsert(UserCalculationStats).values(
+        user_id=user_id, operation=operation, count=count, result_sum=result
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[UserCalculationStats.user_id, UserCalculationStats.operation],
+        set_={
+            "count": UserCalculationStats.count + count,
+            "result_sum": UserCalculationStats.result_sum + result,
+        },
+    )
+
+
+def _record_many_statement(dialect_name: str, user_id: int, deltas: Dict[OperationType, StatsValue]):
+    """Build one multi-row upsert adding per-operation totals, or None if the dialect has no upsert"""
+    upsert = _UPSERT_DIALECTS.get(dialect_name)
+    if upsert is None:
+        return None
+    stmt = upsert(UserCalculationStats).values([
+        {"user_id": user_id, "operation": operation, "count": count, "result_sum": result_sum}
+        for operation, (count, result_sum) in deltas.items()
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[UserCalculationStats.user_id, UserCalculationStats.operation],
+        set_={
+            "count": UserCalculationStats.count + stmt.excluded.count,
+            "result_sum": UserCalculationStats.result_sum + stmt.excluded.result_sum,
+        },
+    )
+
+
+def _delta_statement(user_id: int, operation: OperationType, count: int, result: float):
+    return update(UserCalculationStats).where(
+        UserCalculationStats.user_id == user_id,
+        UserCalculationStats.operation == operation,
+    ).values(
+        count=UserCalculationStats.count + count,
+        result_sum=UserCalculationStats.result_sum + result,
+    ).execution_options(synchronize_session=False)
+
+
+def _rollup_statement(user_id: Optional[int]):
+    stmt = select(
+        UserCalculationStats.user_id,
+        UserCalculationStats.operation,
+        UserCalculationStats.count,
+        UserCalculationStats.result_sum
+    ).where(UserCalculationStats.count > 0)
+    if user_id is not None:
+        stmt = stmt.where(UserCalculationStats.user_id == user_id)
+    return stmt
+
+
+def record_calculation(db: Session, user_id: int, operation: OperationType, result: float, count: int = 1) -> None:
+    """Add a calculation (or `count` calculations summing to `result`) to the user's rollup"""
+    stmt = _record_statement(db.get_bind().dialect.name, user_id, operation, result, count)
+    if stmt is not None:
+        db.execute(stmt)
+    # Generic fallback: try to bump an existing row, otherwise create one
+    elif db.execute(_delta_statement(user_id, operation, count, result)).rowcount == 0:
+        db.add(UserCalculationStats(user_id=user_id, operation=operation, count=count, result_sum=result))
+        db.flush()
+
+
+def record_calculations(db: Session, user_id: int, deltas: Dict[OperationType, StatsValue]) -> None:
+    """Add per-operation (count, result_sum) totals to the user's rollup, in one statement where possible"""
+    if not deltas:
+        return
+    stmt = _record_many_statement(db.get_bind().dialect.name, user_id, deltas)
+    if stmt is not None:
+        db.execute(stmt)
+    else:
+        for operation, (count, result_sum) in deltas.items():
+            record_calculation(db, user_id, operation, result_sum, count)
+
+
+def discard_calculation(db: Session, user_id: int, operation: OperationType, result: float) -> None:
+    """Remove a calculation from the user's rollup"""
+    db.execute(_delta_statement(user_id, operation, -1, -result))
+
+
+def move_calculation(db: Session, user_id: int, previous_operation: OperationType, previous_result: float,
+                     operation: OperationType, result: float) -> None:
+    """Replace an edited calculation in the rollup, with one statement when its operation is unchanged"""
+    if operation == previous_operation:
+        db.execute(_delta_statement(user_id, operation, 0, result - previous_result))
+    else:
+        discard_calculation(db, user_id, previous_operation, previous_result)
+        record_calculation(db, user_id, operation, result)
+
+
+def get_rollup(db: Session, user_id: Optional[int] = None) -> Dict[StatsKey, StatsValue]:
+    """Read the rollup, skipping operations whose count dropped to zero"""
+    rows = db.execute(_rollup_statement(user_id))
+    return {(uid, op): (count, result_sum) for uid, op, count, result_sum in rows}
+
+
+async def record_calculation_async(db: AsyncSession, user_id: int, operation: OperationType, result: float, count: int = 1) -> None:
+    """Async version of record_calculation"""
+    stmt = _record_statement(db.get_bind().dialect.name, user_id, operation, result, count)
+    if stmt is not None:
+        await db.execute(stmt)
+    elif (await db.execute(_delta_statement(user_id, operation, count, result))).rowcount == 0:
+        db.add(UserCalculationStats(user_id=user_id, operation=operation, count=count, result_sum=result))
+        await db.flush()
+
+
+async def record_calculations_async(db: AsyncSession, user_id: int, deltas: Dict[OperationType, StatsValue]) -> None:
+    """Async version of record_calculations"""
+    if not deltas:
+        return
+    stmt = _record_many_statement(db.get_bind().dialect.name, user_id, deltas)
+    if stmt is not None:
+        await db.execute(stmt)
+    else:
+        for operation, (count, result_sum) in deltas.items():
+            await record_calculation_async(db, user_id, operation, result_sum, count)
+
+
+async def discard_calculation_async(db: AsyncSession, user_id: int, operation: OperationType, result: float) -> None:
+    """Async version of discard_calculation"""
+    await db.execute(_delta_statement(user_id, operation, -1, -result))
+
+
+async def move_calculation_async(db: AsyncSession, user_id: int, previous_operation: OperationType, previous_result: float,
+                                 operation: OperationType, result: float) -> None:
+    """Async version of move_calculation"""
+    if operation == previous_operation:
+        await db.execute(_delta_statement(user_id, operation, 0, result - previous_result))
+    else:
+        await discard_calculation_async(db, user_id, previous_operation, previous_result)
+        await record_calculation_async(db, user_id, operation, result)
+
+
+async def get_rollup_async(db: AsyncSession, user_id: Optional[int] = None) -> Dict[StatsKey, StatsValue]:
+    """Async version of get_rollup"""
+    rows = await db.execute(_rollup_statement(user_id))
+    return {(uid, op): (count, result_sum) for uid, op, count, result_sum in rows}
+
+
+def recompute(db: Session, user_id: Optional[int] = None) -> Dict[StatsKey, StatsValue]:
+    """Aggregate the calculations table from scratch"""
+    query = db.query(
+        Calculation.user_id,
+        Calculation.operation,
+        func.count(Calculation.id),
+        func.sum(Calculation.result)
+    )
+    if user_id is not None:
+        query = query.filter(Calculation.user_id == user_id)
+    query = query.group_by(Calculation.user_id, Calculation.operation)
+    return {(uid, op): (count, result_sum or 0.0) for uid, op, count, result_sum in query}
+
+
+def _sums_match(a: float, b: float) -> bool:
+    return a == b or math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+
+
+def find_inconsistencies(db: Session, user_id: Optional[int] = None) -> List[dict]:
+    """Compare the rollup with a full recompute and describe every mismatch"""
+    stored = get_rollup(db, user_id)
+    expected = recompute(db, user_id)
+    problems = []
+    for key in sorted(set(stored) | set(expected), key=lambda k: (k[0], k[1].value)):
+        stored_count, stored_sum = stored.get(key, (0, 0.0))
+        expected_count, expected_sum = expected.get(key, (0, 0.0))
+        if stored_count != expected_count or not _sums_match(stored_sum, expected_sum):
+            problems.append({
+                "user_id": key[0],
+                "operation": key[1].value,
+                "stored": {"count": stored_count, "result_sum": stored_sum},
+                "expected": {"count": expected_count, "result_sum": expected_sum},
+            })
+    return problems
+
+
+def rebuild(db: Session, user_id: Optional[int] = None) -> None:
+    """Replace the rollup rows with a fresh recompute (does not commit)"""
+    query = db.query(UserCalculationStats)
+    if user_id is not None:
+        query = query.filter(UserCalculationStats.user_id == user_id)
+    query.delete(synchronize_session=False)
+    for (uid, op), (count, result_sum) in recompute(db, user_id).items():
+        db.add(UserCalculationStats(user_id=uid, operation=op, count=count, result_sum=result_sum))
+    db.flush()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check the user_calculation_stats rollup")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("--user-id", type=int, default=None, help="Only check a single user")
+    parser.add_argument("--repair", action="store_true", help="Rebuild the rollup if it has drifted")
+    args = parser.parse_args(argv)
+
+    from app.database import SessionLocal, get_engine
+
+    db = SessionLocal(bind=get_engine())
+    try:
+        problems = find_inconsistencies(db, args.user_id)
+        for problem in problems:
+            print(
+                f"user {problem['user_id']} {problem['operation']}: "
+                f"stored {problem['stored']} expected {problem['expected']}"
+            )
+        if not problems:
+            print("Rollup is consistent")
+            return 0
+        if args.repair:
+            rebuild(db, args.user_id)
+            db.commit()
+            print(f"Rebuilt rollup after {len(problems)} mismatch(es)")
+            return 0
+        return 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
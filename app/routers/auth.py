@@ -7,9 +7,11 @@ from app.schemas import UserCreate, UserResponse, Token, LoginRequest, Message
 from app.auth import (
     get_password_hash,
     authenticate_user,
-    create_access_token,
+    create_user_token,
     get_user_by_username,
-    get_user_by_email
+    get_user_by_email,
+    user_cache,
+    CachedUser
 )
 from app.config import get_settings
 
@@ -61,7 +63,7 @@ def login(login_data: LoginRequest, db: Session = Depends(get_db)):
         )
     
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    access_token = create_user_token(user, expires_delta=access_token_expires)
+    # Prime the cache so the client's first authenticated request skips the user lookup
+    user_cache.put(CachedUser.from_user(user))
     return {"access_token": access_token, "token_type": "bearer"}
@@ -0,0 +1,68 @@
+"""Async versions of the authentication endpoints (used when DATABASE_ASYNC is set)"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import timedelta
+from app.database import get_async_db
+from app.models import User
+from app.schemas import UserCreate, UserResponse, Token, LoginRequest
+from app.auth import (
+    get_password_hash_async,
+    authenticate_user_async,
+    create_user_token,
+    get_user_by_username_async,
+    get_user_by_email_async,
+    user_cache,
+    CachedUser
+)
+from app.config import get_settings
+
+router = APIRouter(prefix="/api/auth", tags=["Authentication"])
+settings = get_settings()
+
+
+@router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    """Register a new user"""
+    # Check if username exists
+    if await get_user_by_username_async(db, user.username):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
+
+    # Check if email exists
+    if await get_user_by_email_async(db, user.email):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+
+    # Create new user
+    hashed_password = await get_password_hash_async(user.password)
+    db_user = User(
+        username=user.username,
+        email=user.email,
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+@router.post("/login", response_model=Token)
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    """Login and get access token"""
+    user = await authenticate_user_async(db, login_data.username, login_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
+    access_token = create_user_token(user, expires_delta=access_token_expires)
+    # Prime the cache so the client's first authenticated request skips the user lookup
+    user_cache.put(CachedUser.from_user(user))
+    return {"access_token": access_token, "token_type": "bearer"}
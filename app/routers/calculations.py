@@ -1,18 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, select, tuple_, update
+from sqlalchemy.orm import Session, sessionmaker
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional, Tuple
+from app.config import get_settings
 from app.database import get_db
-from app.models import User, Calculation, OperationType
+from app.models import Calculation, OperationType
 from app.schemas import (
     CalculationCreate,
     CalculationUpdate,
     CalculationResponse,
+    CalculationBatchCreate,
+    CalculationBatchItemResult,
+    CalculationBatchResponse,
+    ImportJobResponse,
     Message
 )
-from app.auth import get_current_user
+from app.auth import get_current_user, CachedUser
+from app.rollup import record_calculation, record_calculations, discard_calculation, move_calculation
+from app.pagination import encode_cursor, decode_cursor
+from app.vectorized import perform_calculations, ERROR_MESSAGES
+from app.export import EXPORT_MEDIA_TYPES, export_statement, export_filename, iter_export
+from app.imports import ImportJob, detect_format, import_job_statement, save_upload
+from app.result_cache import calculation_cache
+from app.fast_json import CALCULATION_COLUMNS, render_calculations
+from app.response_cache import response_cache, CALCULATIONS_SCOPE, calculation_scope
+from app.history import bump_history_version, history_changed
+from app.events import Event, calculations_event, statistics_delta
 
 router = APIRouter(prefix="/api/calculations", tags=["Calculations"])
 
+settings = get_settings()
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def guarded_power(base: float, exponent: float) -> float:
+    """Raise base to exponent, rejecting inputs without a finite real result"""
+    # Integer operands would switch ** to unbounded big-int arithmetic
+    base, exponent = float(base), float(exponent)
+    finite = math.isfinite(base) and math.isfinite(exponent)
+    if finite and base == 0 and exponent < 0:
+        raise ValueError("0.0 cannot be raised to a negative power")
+    if finite and base < 0 and not exponent.is_integer():
+        raise ValueError("Result is not a real number")
+    try:
+        return base ** exponent
+    except OverflowError:
+        raise ValueError("Result is out of range") from None
+
 
 def perform_calculation(operation: OperationType, operand1: float, operand2: float) -> float:
     """Perform the calculation based on operation type"""
@@ -27,7 +66,7 @@ def perform_calculation(operation: OperationType, operand1: float, operand2: flo
             raise ValueError("Cannot divide by zero")
         return operand1 / operand2
     elif operation == OperationType.POWER:
-        return operand1 ** operand2
+        return guarded_power(operand1, operand2)
     elif operation == OperationType.MODULO:
         if operand2 == 0:
             raise ValueError("Cannot perform modulo by zero")
@@ -36,70 +75,374 @@ def perform_calculation(operation: OperationType, operand1: float, operand2: flo
         raise ValueError(f"Unknown operation: {operation}")
 
 
+def cached_calculation(operation: OperationType, operand1: float, operand2: float) -> float:
+    """perform_calculation behind the result cache"""
+    return calculation_cache.get_or_compute(operation, operand1, operand2, perform_calculation)
+
+
+class CalculationBatch:
+    """Validated and evaluated rows of a batch request, ready for a bulk insert"""
+
+    def __init__(self, items: List[Any], user_id: int):
+        self.size = len(items)
+        self.rows: List[Dict] = []
+        self.row_indexes: List[int] = []
+        self.errors: Dict[int, str] = {}
+        self.sort_inserted = False
+        valid: List[Tuple[int, CalculationCreate]] = []
+        for index, item in enumerate(items):
+            try:
+                valid.append((index, CalculationCreate.model_validate(item)))
+            except ValidationError as e:
+                self.errors[index] = "; ".join(error["msg"] for error in e.errors())
+
+        # Evaluate every valid item in one vectorized pass
+        results, error_codes = perform_calculations(
+            [calculation.operation for _, calculation in valid],
+            [calculation.operand1 for _, calculation in valid],
+            [calculation.operand2 for _, calculation in valid]
+        )
+        for (index, calculation), result, error_code in zip(valid, results.tolist(), error_codes.tolist()):
+            if error_code:
+                self.errors[index] = ERROR_MESSAGES[error_code]
+                continue
+            self.rows.append({
+                "user_id": user_id,
+                "operation": calculation.operation,
+                "operand1": calculation.operand1,
+                "operand2": calculation.operand2,
+                "result": result,
+            })
+            self.row_indexes.append(index)
+
+    def check(self, all_or_nothing: bool) -> None:
+        """Reject the whole batch if it must succeed atomically and a row failed"""
+        if all_or_nothing and self.errors:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=[{"index": index, "error": error} for index, error in sorted(self.errors.items())]
+            )
+
+    def insert_statement(self, dialect_name: str):
+        """Bulk INSERT ... RETURNING (id, created_at) of `rows`; pass what it returns to `response`"""
+        # SQLite hands out rowids in VALUES order, so sorting the returned rows
+        # by id restores the row order and the rows go in multi-row INSERTs.
+        # Elsewhere SQLAlchemy keeps the order, with one INSERT per row if needed.
+        self.sort_inserted = dialect_name == "sqlite"
+        return insert(Calculation).returning(
+            Calculation.id, Calculation.created_at, sort_by_parameter_order=not self.sort_inserted
+        )
+
+    def rollup_deltas(self) -> Dict[OperationType, Tuple[int, float]]:
+        deltas: Dict[OperationType, Tuple[int, float]] = {}
+        for row in self.rows:
+            count, result_sum = deltas.get(row["operation"], (0, 0.0))
+            deltas[row["operation"]] = (count + 1, result_sum + row["result"])
+        return deltas
+
+    def response(self, inserted: List[Tuple[int, Any]]) -> CalculationBatchResponse:
+        if self.sort_inserted:
+            inserted = sorted(inserted, key=lambda row: row[0])
+        results = [
+            CalculationBatchItemResult(index=index, error=error)
+            for index, error in self.errors.items()
+        ]
+        for index, row, (calculation_id, created_at) in zip(self.row_indexes, self.rows, inserted):
+            results.append(CalculationBatchItemResult(
+                index=index,
+                calculation=CalculationResponse(id=calculation_id, created_at=created_at, **row)
+            ))
+        results.sort(key=lambda item: item.index)
+        return CalculationBatchResponse(created=len(inserted), failed=len(self.errors), results=results)
+
+    def created_event(self, version: int, response: CalculationBatchResponse) -> Event:
+        return calculations_event("created", version, self.rollup_deltas(), calculations=[
+            item.calculation.model_dump(mode="json") for item in response.results if item.calculation is not None
+        ])
+
+
+def export_response(body, export_format: str, compress: bool) -> StreamingResponse:
+    media_type = "application/gzip" if compress else EXPORT_MEDIA_TYPES[export_format]
+    filename = export_filename(export_format, compress)
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def resolve_import_format(requested: Optional[str], filename: Optional[str]) -> str:
+    import_format = requested or detect_format(filename)
+    if import_format is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not tell the file format from its name, pass format=csv or format=ndjson"
+        )
+    return import_format
+
+
+def import_job_not_found() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import job not found")
+
+
+def calculation_content(calculation: Calculation) -> dict:
+    return CalculationResponse.model_validate(calculation).model_dump(mode="json")
+
+
+def insert_calculation_statement(user_id: int, calculation: CalculationCreate, result: float):
+    """INSERT ... RETURNING the response columns, so the new row needs no re-SELECT"""
+    return insert(Calculation).values(
+        user_id=user_id,
+        operation=calculation.operation,
+        operand1=calculation.operand1,
+        operand2=calculation.operand2,
+        result=result
+    ).returning(*CALCULATION_COLUMNS)
+
+
+def previous_calculation_statement(calculation_id: int, user_id: int):
+    """The columns an edit needs: the operands it may keep and the rollup entry it replaces"""
+    return select(
+        Calculation.operation, Calculation.operand1, Calculation.operand2, Calculation.result
+    ).where(Calculation.id == calculation_id, Calculation.user_id == user_id)
+
+
+def edited_values(previous, calculation_update: CalculationUpdate) -> dict:
+    """The edited columns with the result recomputed, or a 400 if it cannot be calculated"""
+    values = {
+        "operation": calculation_update.operation if calculation_update.operation is not None else previous.operation,
+        "operand1": calculation_update.operand1 if calculation_update.operand1 is not None else previous.operand1,
+        "operand2": calculation_update.operand2 if calculation_update.operand2 is not None else previous.operand2,
+    }
+    try:
+        values["result"] = cached_calculation(values["operation"], values["operand1"], values["operand2"])
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return values
+
+
+def update_calculation_statement(calculation_id: int, user_id: int, values: dict):
+    """UPDATE ... RETURNING the response columns, replacing the ORM flush and refresh"""
+    return update(Calculation).where(
+        Calculation.id == calculation_id, Calculation.user_id == user_id
+    ).values(**values).returning(*CALCULATION_COLUMNS).execution_options(synchronize_session=False)
+
+
+def delete_calculation_statement(calculation_id: int, user_id: int):
+    """DELETE ... RETURNING what the rollup needs, so the row is not loaded first"""
+    return delete(Calculation).where(
+        Calculation.id == calculation_id, Calculation.user_id == user_id
+    ).returning(Calculation.operation, Calculation.result).execution_options(synchronize_session=False)
+
+
+def calculation_not_found() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Calculation not found")
+
+
+def calculation_entities() -> tuple:
+    """What the read endpoints select: column tuples on the fast JSON path, ORM objects otherwise"""
+    return CALCULATION_COLUMNS if settings.fast_json_responses else (Calculation,)
+
+
+def calculation_rows(result) -> list:
+    """The rows of an executed select(*calculation_entities())"""
+    return result.all() if settings.fast_json_responses else result.scalars().all()
+
+
+def calculation_page(calculations: list, limit: int) -> Tuple[Any, Dict[str, str]]:
+    """Serialized page plus the cursor header when more rows may follow"""
+    headers = {}
+    if calculations and len(calculations) == limit:
+        last = calculations[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    if settings.fast_json_responses:
+        return render_calculations(calculations), headers
+    return [calculation_content(calculation) for calculation in calculations], headers
+
+
+def check_batch_size(batch: CalculationBatchCreate) -> None:
+    if len(batch.items) > settings.calculation_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch exceeds the maximum of {settings.calculation_batch_max_size} items"
+        )
+
+
 # CREATE - Add a new calculation
 @router.post("/", response_model=CalculationResponse, status_code=status.HTTP_201_CREATED)
 def create_calculation(
     calculation: CalculationCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """Create a new calculation"""
     try:
-        result = perform_calculation(
+        result = cached_calculation(
             calculation.operation,
             calculation.operand1,
             calculation.operand2
         )
-        
-        db_calculation = Calculation(
-            user_id=current_user.id,
-            operation=calculation.operation,
-            operand1=calculation.operand1,
-            operand2=calculation.operand2,
-            result=result
-        )
-        db.add(db_calculation)
-        db.commit()
-        db.refresh(db_calculation)
-        return db_calculation
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+    created = db.execute(insert_calculation_statement(current_user.id, calculation, result)).one()
+    record_calculation(db, current_user.id, calculation.operation, result)
+    version = bump_history_version(db, current_user.id)
+    db.commit()
+    content = calculation_content(created)
+    history_changed(current_user.id, event=calculations_event(
+        "created", version, statistics_delta((calculation.operation, 1, result)), calculations=[content]
+    ))
+    return content
+
+
+# CREATE - Add many calculations in one transaction
+@router.post("/batch", response_model=CalculationBatchResponse)
+def create_calculation_batch(
+    batch: CalculationBatchCreate,
+    db: Session = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """Create many calculations with a single bulk insert
+
+    Each item is validated and evaluated independently. By default valid
+    items are stored and invalid ones are reported; with `all_or_nothing`
+    any invalid item rejects the whole batch.
+    """
+    check_batch_size(batch)
+    evaluated = CalculationBatch(batch.items, current_user.id)
+    evaluated.check(batch.all_or_nothing)
+
+    if not evaluated.rows:
+        return evaluated.response([])
+    inserted = db.execute(evaluated.insert_statement(db.get_bind().dialect.name), evaluated.rows).all()
+    record_calculations(db, current_user.id, evaluated.rollup_deltas())
+    version = bump_history_version(db, current_user.id)
+    db.commit()
+    response = evaluated.response(inserted)
+    history_changed(current_user.id, event=evaluated.created_event(version, response))
+    return response
+
+
+# READ - Stream the full history as a file
+@router.get("/export")
+def export_calculations(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False,
+    db: Session = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """Export the current user's calculations, oldest first
+
+    Rows are streamed from a server-side cursor, so memory use does not grow
+    with the size of the history. `since` (inclusive) and `until` (exclusive)
+    limit the export to a time range; `gzip=true` compresses the file.
+    """
+    rows = db.execute(export_statement(current_user.id, since, until))
+    return export_response(iter_export(rows, export_format, gzip), export_format, gzip)
+
+
+# CREATE - Import a CSV or NDJSON file in the background
+@router.post("/import", response_model=ImportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+def import_calculations(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    import_format: Optional[Literal["ndjson", "csv"]] = Query(None, alias="format"),
+    db: Session = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """Start importing calculations from an uploaded file
+
+    The format comes from `format` or the file name (.csv, .ndjson, .jsonl,
+    optionally gzipped). Rows are validated like batch items and committed
+    in chunks. Poll GET /import/{job_id} for progress and per-line errors.
+    """
+    import_format = resolve_import_format(import_format, file.filename)
+    path, size = save_upload(file.file)
+    job = ImportJob(current_user.id, import_format, path, size)
+    db.execute(job.insert_statement())
+    db.commit()
+    background_tasks.add_task(job.run, sessionmaker(bind=db.get_bind()))
+    return job.snapshot()
+
+
+# READ - Progress of an import
+@router.get("/import/{job_id}", response_model=ImportJobResponse)
+def get_import_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """Get the progress and error report of an import"""
+    job = db.execute(import_job_statement(job_id, current_user.id)).scalar_one_or_none()
+    if job is None:
+        raise import_job_not_found()
+    return job
+
 
 # READ - Browse all calculations for current user
 @router.get("/", response_model=List[CalculationResponse])
 def list_calculations(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    """Get all calculations for the current user"""
-    calculations = db.query(Calculation).filter(
+    """Get all calculations for the current user
+
+    Pages with `skip`/`limit` by default. Passing the `X-Next-Cursor` header
+    of a previous page as `cursor` continues from that page without making
+    the database walk over the skipped rows.
+    """
+    cache_key, cached = response_cache.lookup(request, current_user, CALCULATIONS_SCOPE)
+    if cached is not None:
+        return cached
+
+    query = db.query(*calculation_entities()).filter(
         Calculation.user_id == current_user.id
-    ).order_by(Calculation.created_at.desc()).offset(skip).limit(limit).all()
-    return calculations
+    ).order_by(Calculation.created_at.desc(), Calculation.id.desc())
+
+    if cursor is not None:
+        try:
+            created_at, calculation_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        query = query.filter(
+            tuple_(Calculation.created_at, Calculation.id) < tuple_(created_at, calculation_id)
+        )
+    else:
+        query = query.offset(skip)
+
+    calculations = query.limit(limit).all()
+    return response_cache.store(current_user, cache_key, *calculation_page(calculations, limit))
 
 
 # READ - Get a specific calculation by ID
 @router.get("/{calculation_id}", response_model=CalculationResponse)
 def get_calculation(
     calculation_id: int,
+    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """Get a specific calculation by ID"""
+    scope = calculation_scope(calculation_id)
+    cache_key, cached = response_cache.lookup(request, current_user, scope)
+    if cached is not None:
+        return cached
+
     calculation = db.query(Calculation).filter(
         Calculation.id == calculation_id,
         Calculation.user_id == current_user.id
     ).first()
     
     if not calculation:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Calculation not found"
-        )
-    return calculation
+        raise calculation_not_found()
+    return response_cache.store(current_user, cache_key, calculation_content(calculation), scope=scope)
 
 
 # UPDATE - Edit a calculation
@@ -108,40 +451,25 @@ def update_calculation(
     calculation_id: int,
     calculation_update: CalculationUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """Update a calculation"""
-    db_calculation = db.query(Calculation).filter(
-        Calculation.id == calculation_id,
-        Calculation.user_id == current_user.id
-    ).first()
-    
-    if not db_calculation:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Calculation not found"
-        )
-    
-    # Update fields if provided
-    if calculation_update.operation is not None:
-        db_calculation.operation = calculation_update.operation
-    if calculation_update.operand1 is not None:
-        db_calculation.operand1 = calculation_update.operand1
-    if calculation_update.operand2 is not None:
-        db_calculation.operand2 = calculation_update.operand2
-    
-    # Recalculate result
-    try:
-        db_calculation.result = perform_calculation(
-            db_calculation.operation,
-            db_calculation.operand1,
-            db_calculation.operand2
-        )
-        db.commit()
-        db.refresh(db_calculation)
-        return db_calculation
-    except ValueError as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    previous = db.execute(previous_calculation_statement(calculation_id, current_user.id)).first()
+    if previous is None:
+        raise calculation_not_found()
+
+    values = edited_values(previous, calculation_update)
+    updated = db.execute(update_calculation_statement(calculation_id, current_user.id, values)).one()
+    move_calculation(db, current_user.id, previous.operation, previous.result, updated.operation, updated.result)
+    version = bump_history_version(db, current_user.id)
+    db.commit()
+    content = calculation_content(updated)
+    history_changed(current_user.id, calculation_id, calculations_event(
+        "updated", version,
+        statistics_delta((previous.operation, -1, -previous.result), (updated.operation, 1, updated.result)),
+        calculations=[content]
+    ))
+    return content
 
 
 # DELETE - Delete a calculation
@@ -149,20 +477,17 @@ def update_calculation(
 def delete_calculation(
     calculation_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """Delete a calculation"""
-    db_calculation = db.query(Calculation).filter(
-        Calculation.id == calculation_id,
-        Calculation.user_id == current_user.id
-    ).first()
-    
-    if not db_calculation:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Calculation not found"
-        )
-    
-    db.delete(db_calculation)
+    deleted = db.execute(delete_calculation_statement(calculation_id, current_user.id)).first()
+    if deleted is None:
+        raise calculation_not_found()
+
+    discard_calculation(db, current_user.id, deleted.operation, deleted.result)
+    version = bump_history_version(db, current_user.id)
     db.commit()
+    history_changed(current_user.id, calculation_id, calculations_event(
+        "deleted", version, statistics_delta((deleted.operation, -1, -deleted.result)), ids=[calculation_id]
+    ))
     return {"message": "Calculation deleted successfully"}
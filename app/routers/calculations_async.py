@@ -0,0 +1,257 @@
+"""Async versions of the calculation endpoints (used when DATABASE_ASYNC is set)"""
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Request, UploadFile, status
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from datetime import datetime
+from typing import List, Literal, Optional
+from app.database import get_async_db
+from app.models import Calculation
+from app.schemas import (
+    CalculationCreate,
+    CalculationUpdate,
+    CalculationResponse,
+    CalculationBatchCreate,
+    CalculationBatchResponse,
+    ImportJobResponse,
+    Message
+)
+from app.auth import get_current_user_async, CachedUser
+from app.rollup import record_calculation_async, record_calculations_async, discard_calculation_async, move_calculation_async
+from app.pagination import decode_cursor
+from app.routers.calculations import (
+    cached_calculation,
+    CalculationBatch,
+    check_batch_size,
+    calculation_content,
+    calculation_not_found,
+    insert_calculation_statement,
+    previous_calculation_statement,
+    edited_values,
+    update_calculation_statement,
+    delete_calculation_statement,
+    calculation_entities,
+    calculation_rows,
+    calculation_page,
+    export_response,
+    resolve_import_format,
+    import_job_not_found
+)
+from app.export import export_statement, aiter_export
+from app.imports import ImportJob, import_job_statement, save_upload_async
+from app.response_cache import response_cache, CALCULATIONS_SCOPE, calculation_scope
+from app.history import bump_history_version_async, history_changed
+from app.events import calculations_event, statistics_delta
+
+router = APIRouter(prefix="/api/calculations", tags=["Calculations"])
+
+
+async def get_user_calculation(db: AsyncSession, calculation_id: int, user_id: int) -> Calculation:
+    """Load one of the user's calculations or raise 404"""
+    calculation = (await db.execute(
+        select(Calculation).where(
+            Calculation.id == calculation_id,
+            Calculation.user_id == user_id
+        )
+    )).scalars().first()
+
+    if not calculation:
+        raise calculation_not_found()
+    return calculation
+
+
+# CREATE - Add a new calculation
+@router.post("/", response_model=CalculationResponse, status_code=status.HTTP_201_CREATED)
+async def create_calculation(
+    calculation: CalculationCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Create a new calculation"""
+    try:
+        result = cached_calculation(
+            calculation.operation,
+            calculation.operand1,
+            calculation.operand2
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    created = (await db.execute(insert_calculation_statement(current_user.id, calculation, result))).one()
+    await record_calculation_async(db, current_user.id, calculation.operation, result)
+    version = await bump_history_version_async(db, current_user.id)
+    await db.commit()
+    content = calculation_content(created)
+    history_changed(current_user.id, event=calculations_event(
+        "created", version, statistics_delta((calculation.operation, 1, result)), calculations=[content]
+    ))
+    return content
+
+
+# CREATE - Add many calculations in one transaction
+@router.post("/batch", response_model=CalculationBatchResponse)
+async def create_calculation_batch(
+    batch: CalculationBatchCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Create many calculations with a single bulk insert"""
+    check_batch_size(batch)
+    evaluated = CalculationBatch(batch.items, current_user.id)
+    evaluated.check(batch.all_or_nothing)
+
+    if not evaluated.rows:
+        return evaluated.response([])
+    inserted = (await db.execute(evaluated.insert_statement(db.get_bind().dialect.name), evaluated.rows)).all()
+    await record_calculations_async(db, current_user.id, evaluated.rollup_deltas())
+    version = await bump_history_version_async(db, current_user.id)
+    await db.commit()
+    response = evaluated.response(inserted)
+    history_changed(current_user.id, event=evaluated.created_event(version, response))
+    return response
+
+
+# READ - Stream the full history as a file
+@router.get("/export")
+async def export_calculations(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Export the current user's calculations, oldest first"""
+    rows = await db.stream(export_statement(current_user.id, since, until))
+    return export_response(aiter_export(rows, export_format, gzip), export_format, gzip)
+
+
+# CREATE - Import a CSV or NDJSON file in the background
+@router.post("/import", response_model=ImportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def import_calculations(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    import_format: Optional[Literal["ndjson", "csv"]] = Query(None, alias="format"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Start importing calculations from an uploaded file"""
+    import_format = resolve_import_format(import_format, file.filename)
+    path, size = await save_upload_async(file)
+    job = ImportJob(current_user.id, import_format, path, size)
+    await db.execute(job.insert_statement())
+    await db.commit()
+    background_tasks.add_task(job.run_async, async_sessionmaker(bind=db.bind, expire_on_commit=False))
+    return job.snapshot()
+
+
+# READ - Progress of an import
+@router.get("/import/{job_id}", response_model=ImportJobResponse)
+async def get_import_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Get the progress and error report of an import"""
+    job = (await db.execute(import_job_statement(job_id, current_user.id))).scalar_one_or_none()
+    if job is None:
+        raise import_job_not_found()
+    return job
+
+
+# READ - Browse all calculations for current user
+@router.get("/", response_model=List[CalculationResponse])
+async def list_calculations(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Get all calculations for the current user"""
+    cache_key, cached = response_cache.lookup(request, current_user, CALCULATIONS_SCOPE)
+    if cached is not None:
+        return cached
+
+    stmt = select(*calculation_entities()).where(
+        Calculation.user_id == current_user.id
+    ).order_by(Calculation.created_at.desc(), Calculation.id.desc())
+
+    if cursor is not None:
+        try:
+            created_at, calculation_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        stmt = stmt.where(
+            tuple_(Calculation.created_at, Calculation.id) < tuple_(created_at, calculation_id)
+        )
+    else:
+        stmt = stmt.offset(skip)
+
+    calculations = calculation_rows(await db.execute(stmt.limit(limit)))
+    return response_cache.store(current_user, cache_key, *calculation_page(calculations, limit))
+
+
+# READ - Get a specific calculation by ID
+@router.get("/{calculation_id}", response_model=CalculationResponse)
+async def get_calculation(
+    calculation_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Get a specific calculation by ID"""
+    scope = calculation_scope(calculation_id)
+    cache_key, cached = response_cache.lookup(request, current_user, scope)
+    if cached is not None:
+        return cached
+    calculation = await get_user_calculation(db, calculation_id, current_user.id)
+    return response_cache.store(current_user, cache_key, calculation_content(calculation), scope=scope)
+
+
+# UPDATE - Edit a calculation
+@router.put("/{calculation_id}", response_model=CalculationResponse)
+async def update_calculation(
+    calculation_id: int,
+    calculation_update: CalculationUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Update a calculation"""
+    previous = (await db.execute(previous_calculation_statement(calculation_id, current_user.id))).first()
+    if previous is None:
+        raise calculation_not_found()
+
+    values = edited_values(previous, calculation_update)
+    updated = (await db.execute(update_calculation_statement(calculation_id, current_user.id, values))).one()
+    await move_calculation_async(db, current_user.id, previous.operation, previous.result, updated.operation, updated.result)
+    version = await bump_history_version_async(db, current_user.id)
+    await db.commit()
+    content = calculation_content(updated)
+    history_changed(current_user.id, calculation_id, calculations_event(
+        "updated", version,
+        statistics_delta((previous.operation, -1, -previous.result), (updated.operation, 1, updated.result)),
+        calculations=[content]
+    ))
+    return content
+
+
+# DELETE - Delete a calculation
+@router.delete("/{calculation_id}", response_model=Message)
+async def delete_calculation(
+    calculation_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Delete a calculation"""
+    deleted = (await db.execute(delete_calculation_statement(calculation_id, current_user.id))).first()
+    if deleted is None:
+        raise calculation_not_found()
+
+    await discard_calculation_async(db, current_user.id, deleted.operation, deleted.result)
+    version = await bump_history_version_async(db, current_user.id)
+    await db.commit()
+    history_changed(current_user.id, calculation_id, calculations_event(
+        "deleted", version, statistics_delta((deleted.operation, -1, -deleted.result)), ids=[calculation_id]
+    ))
+    return {"message": "Calculation deleted successfully"}
@@ -0,0 +1,40 @@
+"""Server-sent event stream of the current user's calculation changes"""
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db
+from app.auth import get_current_user, CachedUser
+from app.events import event_hub, event_response, snapshot, snapshot_statement, subscribe
+
+router = APIRouter(prefix="/api/events", tags=["Events"])
+
+
+def load_snapshot(db: Session, user_id: int):
+    try:
+        return snapshot(db.execute(snapshot_statement(user_id)))
+    finally:
+        # Give the connection back now, the stream can stay open for hours
+        db.close()
+
+
+@router.get("")
+async def stream_events(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """Stream the current user's calculation changes as server-sent events
+
+    The first event is a `snapshot` of the per-operation statistics. It is
+    followed by `created`, `updated` and `deleted` events with the affected
+    calculations and statistics deltas, and by `resync` when the client
+    should reload and reconnect.
+    """
+    # Subscribe before reading the snapshot so no change can fall in between
+    subscription = subscribe(current_user.id)
+    try:
+        version, statistics = await run_in_threadpool(load_snapshot, db, current_user.id)
+    except BaseException:
+        event_hub.unsubscribe(subscription)
+        raise
+    return event_response(request, subscription, version, statistics, current_user.token_version)
@@ -0,0 +1,27 @@
+"""Async version of the event stream (used when DATABASE_ASYNC is set)"""
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
+from app.auth import get_current_user_async, CachedUser
+from app.events import event_hub, event_response, snapshot, snapshot_statement, subscribe
+
+router = APIRouter(prefix="/api/events", tags=["Events"])
+
+
+@router.get("")
+async def stream_events(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Stream the current user's calculation changes as server-sent events"""
+    subscription = subscribe(current_user.id)
+    try:
+        version, statistics = snapshot(await db.execute(snapshot_statement(current_user.id)))
+    except BaseException:
+        event_hub.unsubscribe(subscription)
+        raise
+    finally:
+        # Give the connection back now, the stream can stay open for hours
+        await db.close()
+    return event_response(request, subscription, version, statistics, current_user.token_version)
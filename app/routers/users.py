@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
+from itertools import chain
+from app.config import get_settings
 from app.database import get_db
 from app.models import User, Calculation
 from app.schemas import (
@@ -9,16 +9,30 @@ from app.schemas import (
     UserUpdate,
     PasswordChange,
     UserStatistics,
-    CalculationResponse,
     Message
 )
-from app.auth import get_current_user, get_password_hash, verify_password
+from app.auth import (
+    get_current_user,
+    get_current_db_user,
+    get_password_hash,
+    verify_password,
+    revoke_user_tokens,
+    user_cache,
+    CachedUser
+)
+from app.rollup import get_rollup
+from app.response_cache import response_cache, CALCULATIONS_SCOPE
+from app.events import publish, revoked_event
+from app.fast_json import calculation_dicts, calculation_floats, dumps
+from app.routers.calculations import calculation_entities
+
+settings = get_settings()
 
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
 
 @router.get("/me", response_model=UserResponse)
-def get_current_user_profile(current_user: User = Depends(get_current_user)):
+def get_current_user_profile(current_user: CachedUser = Depends(get_current_user)):
     """Get current user's profile"""
     return current_user
 
@@ -27,7 +41,7 @@ def get_current_user_profile(current_user: User = Depends(get_current_user)):
 def update_user_profile(
     user_update: UserUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_db_user)
 ):
     """Update current user's profile"""
     # Update username if provided
@@ -59,6 +73,7 @@ def update_user_profile(
         current_user.email = user_update.email
     
     db.commit()
+    user_cache.invalidate(current_user.id)
     db.refresh(current_user)
     return current_user
 
@@ -67,7 +82,7 @@ def update_user_profile(
 def change_password(
     password_data: PasswordChange,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_db_user)
 ):
     """Change user's password"""
     # Verify current password
@@ -79,22 +94,19 @@ def change_password(
     
     # Hash and update new password
     current_user.hashed_password = get_password_hash(password_data.new_password)
+    # Sign out every existing session, including the one making this request
+    revoke_user_tokens(current_user)
+    user_id, token_version = current_user.id, current_user.token_version
     db.commit()
+    user_cache.invalidate(user_id)
+    # Open event streams outlive the token check they passed; end them too
+    publish(user_id, revoked_event(token_version))
     return {"message": "Password changed successfully"}
 
 
-@router.get("/me/statistics", response_model=UserStatistics)
-def get_user_statistics(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Get statistics for current user's calculations"""
-    # Get all calculations for user
-    calculations = db.query(Calculation).filter(
-        Calculation.user_id == current_user.id
-    ).all()
-    
-    if not calculations:
+def build_user_statistics(rollup: dict, recent_calculations: list) -> UserStatistics:
+    """Assemble the statistics response from the per-operation rollup"""
+    if not rollup:
         return UserStatistics(
             total_calculations=0,
             calculations_by_operation={},
@@ -102,31 +114,23 @@ def get_user_statistics(
             most_used_operation=None,
             recent_calculations=[]
         )
-    
-    # Calculate statistics
-    total_calculations = len(calculations)
-    
+
     # Count calculations by operation
-    calculations_by_operation = {}
-    for calc in calculations:
-        op = calc.operation.value
-        calculations_by_operation[op] = calculations_by_operation.get(op, 0) + 1
-    
+    calculations_by_operation = {
+        operation.value: count for (_, operation), (count, _) in rollup.items()
+    }
+    total_calculations = sum(calculations_by_operation.values())
+
     # Calculate average result
-    total_result = sum(calc.result for calc in calculations)
+    total_result = sum(result_sum or 0.0 for _, result_sum in rollup.values())
     average_result = total_result / total_calculations if total_calculations > 0 else 0.0
-    
+
     # Find most used operation
     most_used_operation = max(
         calculations_by_operation,
         key=calculations_by_operation.get
     ) if calculations_by_operation else None
-    
-    # Get recent calculations (last 10)
-    recent_calculations = db.query(Calculation).filter(
-        Calculation.user_id == current_user.id
-    ).order_by(Calculation.created_at.desc()).limit(10).all()
-    
+
     return UserStatistics(
         total_calculations=total_calculations,
         calculations_by_operation=calculations_by_operation,
@@ -136,12 +140,47 @@ def get_user_statistics(
     )
 
 
+def statistics_content(rollup: dict, recent_calculations: list):
+    """Serialized statistics, pre-rendered on the fast JSON path"""
+    if not settings.fast_json_responses:
+        return build_user_statistics(rollup, recent_calculations).model_dump(mode="json")
+    content = build_user_statistics(rollup, []).model_dump(mode="json")
+    content["recent_calculations"] = calculation_dicts(recent_calculations)
+    return dumps(content, chain([content["average_result"]], calculation_floats(recent_calculations)))
+
+
+@router.get("/me/statistics", response_model=UserStatistics)
+def get_user_statistics(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """Get statistics for current user's calculations"""
+    cache_key, cached = response_cache.lookup(request, current_user, CALCULATIONS_SCOPE)
+    if cached is not None:
+        return cached
+
+    # Read the per-operation rollup instead of scanning the user's history
+    rollup = get_rollup(db, current_user.id)
+
+    # Get recent calculations (last 10)
+    recent_calculations = []
+    if rollup:
+        recent_calculations = db.query(*calculation_entities()).filter(
+            Calculation.user_id == current_user.id
+        ).order_by(Calculation.created_at.desc()).limit(10).all()
+
+    return response_cache.store(current_user, cache_key, statistics_content(rollup, recent_calculations))
+
+
 @router.delete("/me", response_model=Message)
 def delete_user_account(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_db_user)
 ):
     """Delete current user's account and all associated data"""
     db.delete(current_user)
     db.commit()
+    user_cache.invalidate(current_user.id)
+    response_cache.invalidate_calculations(current_user.id)
     return {"message": "Account deleted successfully"}
@@ -0,0 +1,137 @@
+"""Async versions of the user profile endpoints (used when DATABASE_ASYNC is set)"""
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
+from app.models import User, Calculation
+from app.schemas import (
+    UserResponse,
+    UserUpdate,
+    PasswordChange,
+    UserStatistics,
+    Message
+)
+from app.auth import (
+    get_current_user_async,
+    get_current_db_user_async,
+    get_password_hash_async,
+    verify_password_async,
+    revoke_user_tokens,
+    user_cache,
+    CachedUser
+)
+from app.rollup import get_rollup_async
+from app.routers.users import statistics_content
+from app.routers.calculations import calculation_entities, calculation_rows
+from app.response_cache import response_cache, CALCULATIONS_SCOPE
+from app.events import publish, revoked_event
+
+router = APIRouter(prefix="/api/users", tags=["Users"])
+
+
+@router.get("/me", response_model=UserResponse)
+async def get_current_user_profile(current_user: CachedUser = Depends(get_current_user_async)):
+    """Get current user's profile"""
+    return current_user
+
+
+@router.put("/me", response_model=UserResponse)
+async def update_user_profile(
+    user_update: UserUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_db_user_async)
+):
+    """Update current user's profile"""
+    # Update username if provided
+    if user_update.username is not None:
+        # Check if username is already taken
+        existing_user = (await db.execute(select(User.id).where(
+            User.username == user_update.username,
+            User.id != current_user.id
+        ))).first()
+        if existing_user:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Username already taken"
+            )
+        current_user.username = user_update.username
+
+    # Update email if provided
+    if user_update.email is not None:
+        # Check if email is already taken
+        existing_user = (await db.execute(select(User.id).where(
+            User.email == user_update.email,
+            User.id != current_user.id
+        ))).first()
+        if existing_user:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already taken"
+            )
+        current_user.email = user_update.email
+
+    await db.commit()
+    user_cache.invalidate(current_user.id)
+    await db.refresh(current_user)
+    return current_user
+
+
+@router.post("/me/change-password", response_model=Message)
+async def change_password(
+    password_data: PasswordChange,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_db_user_async)
+):
+    """Change user's password"""
+    # Verify current password
+    if not await verify_password_async(password_data.current_password, current_user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Incorrect current password"
+        )
+
+    # Hash and update new password
+    current_user.hashed_password = await get_password_hash_async(password_data.new_password)
+    # Sign out every existing session, including the one making this request
+    revoke_user_tokens(current_user)
+    user_id, token_version = current_user.id, current_user.token_version
+    await db.commit()
+    user_cache.invalidate(user_id)
+    # Open event streams outlive the token check they passed; end them too
+    publish(user_id, revoked_event(token_version))
+    return {"message": "Password changed successfully"}
+
+
+@router.get("/me/statistics", response_model=UserStatistics)
+async def get_user_statistics(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
+):
+    """Get statistics for current user's calculations"""
+    cache_key, cached = response_cache.lookup(request, current_user, CALCULATIONS_SCOPE)
+    if cached is not None:
+        return cached
+
+    rollup = await get_rollup_async(db, current_user.id)
+    recent_calculations = []
+    if rollup:
+        recent_calculations = calculation_rows(await db.execute(
+            select(*calculation_entities()).where(
+                Calculation.user_id == current_user.id
+            ).order_by(Calculation.created_at.desc()).limit(10)
+        ))
+    return response_cache.store(current_user, cache_key, statistics_content(rollup, recent_calculations))
+
+
+@router.delete("/me", response_model=Message)
+async def delete_user_account(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_db_user_async)
+):
+    """Delete current user's account and all associated data"""
+    await db.delete(current_user)
+    await db.commit()
+    user_cache.invalidate(current_user.id)
+    response_cache.invalidate_calculations(current_user.id)
+    return {"message": "Account deleted successfully"}
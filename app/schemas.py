@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, validator
-from typing import Optional, List
+from typing import Optional, List, Any
 from datetime import datetime
 from app.models import OperationType
 
@@ -81,6 +81,48 @@ class CalculationResponse(CalculationBase):
         from_attributes = True
 
 
+class CalculationBatchCreate(BaseModel):
+    # Items are validated one by one so a bad row is reported instead of failing the request
+    items: List[Any] = Field(..., min_length=1)
+    all_or_nothing: bool = False
+
+
+class CalculationBatchItemResult(BaseModel):
+    index: int
+    calculation: Optional[CalculationResponse] = None
+    error: Optional[str] = None
+
+
+class CalculationBatchResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[CalculationBatchItemResult]
+
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportJobResponse(BaseModel):
+    id: str
+    status: str
+    format: str
+    total_bytes: int
+    bytes_read: int
+    lines_processed: int
+    created: int
+    failed: int
+    # Capped at IMPORT_MAX_ERRORS; `failed` counts every rejected line
+    errors: List[ImportLineError]
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 # History and Statistics Schemas
 class CalculationHistory(BaseModel):
     calculations: List[CalculationResponse]
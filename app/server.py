@@ -0,0 +1,209 @@
+"""Pre-forking production server
+
+The parent process imports the app once (so workers share its pages
+copy-on-write), binds the listening socket and forks one uvicorn worker per
+available CPU. Database engines, the password pool and the event broker are
+all built on first use, and app.database drops any engine inherited across
+a fork, so no worker ever shares a connection with another.
+
+With more than one worker, state that only lives in one process would make
+workers disagree, so it is turned off before the app is imported. The
+response cache is off unless RESPONSE_CACHE_URL shares it. User snapshots
+are not cached, so revoked tokens and deleted accounts are rejected by
+every worker at once. Features that stay per worker (rate limits without
+RATE_LIMIT_URL, live updates without EVENT_BROKER_URL) are logged as
+warnings at startup.
+
+On SIGTERM or SIGINT the parent forwards SIGTERM to the workers. Each one
+stops accepting connections, finishes its in-flight requests and runs the
+lifespan shutdown. Workers still running after SERVER_GRACEFUL_TIMEOUT_SECONDS
+(plus a short grace period) are killed. A worker that dies on its own is
+replaced, unless it dies straight after starting, which points at a
+configuration error rather than a crash.
+
+Run with: python -m app.server [--host 0.0.0.0] [--port 8000] [--workers N]
+"""
+import argparse
+import logging
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Workers that exit sooner than this after forking are not restarted
+MIN_WORKER_UPTIME = 2.0
+# Time on top of uvicorn's graceful timeout for the lifespan shutdown
+SHUTDOWN_GRACE = 5.0
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: its affinity mask, capped by a cgroup v2 quota (docker --cpus)"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    try:
+        with open(CGROUP_CPU_MAX) as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            count = min(count, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, count)
+
+
+def configure_workers(settings, workers: int) -> None:
+    """Turn off per-process caches that several workers would disagree on; call before importing the app"""
+    if workers <= 1:
+        return
+    if settings.response_cache_ttl_seconds > 0 and not settings.response_cache_url:
+        logger.warning("Response cache disabled: %d workers need RESPONSE_CACHE_URL to share it", workers)
+        settings.response_cache_ttl_seconds = 0
+    # Each worker would trust its own snapshot's token version for up to the TTL after a revocation
+    settings.user_cache_ttl_seconds = 0
+    if settings.rate_limits and not settings.rate_limit_url:
+        logger.warning("Each of the %d workers applies RATE_LIMITS on its own; set RATE_LIMIT_URL to share them", workers)
+    if not settings.event_broker_url:
+        logger.warning("Live updates only reach streams on the worker that made the change; set EVENT_BROKER_URL")
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Forks the workers, replaces crashed ones and drains them on shutdown"""
+
+    def __init__(self, app, sock: socket.socket, workers: int, graceful_timeout: float, log_level: str = "info"):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+        self.deadline: Optional[float] = None
+        self.exit_code = 0
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.children[pid] = time.monotonic()
+
+    def _run_worker(self) -> None:
+        import uvicorn
+
+        # The parent's handlers only forward signals; uvicorn installs its own
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            config = uvicorn.Config(
+                self.app,
+                lifespan="on",
+                log_level=self.log_level,
+                timeout_graceful_shutdown=self.graceful_timeout,
+            )
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except BaseException:
+            logger.exception("Worker %s failed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop(self, signum=None, frame=None) -> None:
+        if not self.stopping:
+            self.stopping = True
+            self.deadline = time.monotonic() + self.graceful_timeout + SHUTDOWN_GRACE
+            logger.info("Draining %d workers", len(self.children))
+        self._signal_children(signal.SIGTERM)
+
+    def _signal_children(self, signum: int) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.warning("Worker %s exited with status %s", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                logger.error("Worker %s failed during startup, shutting down", pid)
+                self.exit_code = 1
+                self.stop()
+            else:
+                self.spawn()
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        logger.info("Serving with %d workers", self.workers)
+        while self.children:
+            self._reap()
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                logger.error("Killing %d workers that did not drain in time", len(self.children))
+                self._signal_children(signal.SIGKILL)
+                self.deadline = None
+            time.sleep(0.1)
+        self.sock.close()
+        return self.exit_code
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.server_workers,
+                        help="defaults to SERVER_WORKERS, or the number of available CPUs")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    logging.basicConfig(format="%(asctime)s %(name)s %(message)s")
+    logger.setLevel(options.log_level.upper())
+    workers = options.workers or available_cpus()
+    configure_workers(settings, workers)
+    # Preload: import once here so the workers only fork
+    from app import database
+    from app.main import app
+
+    if settings.create_tables:
+        # Once here; the workers inherit the setting turned off, so their lifespans do not race to create them
+        database.Base.metadata.create_all(bind=database.get_engine())
+        database.get_engine().dispose()
+        settings.create_tables = False
+    sock = bind_socket(options.host, options.port)
+    return Supervisor(app, sock, workers, settings.server_graceful_timeout_seconds, options.log_level).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
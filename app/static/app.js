@@ -5,6 +5,18 @@ const API_BASE = '';
 let token = localStorage.getItem('token');
 let currentUser = null;
 
+// Live updates: the server pushes changes over /api/events and the page
+// applies them to its copy of the history and statistics
+const HISTORY_LIMIT = 100;
+const RECONNECT_DELAY = 1000;
+const MAX_RECONNECT_DELAY = 30000;
+let calculations = [];
+let statistics = {};
+let eventsController = null;
+let eventsConnected = false;
+let reconnectDelay = RECONNECT_DELAY;
+let reconnectTimer = null;
+
 // Utility Functions
 function showMessage(message, type = 'info') {
     const toast = document.getElementById('message-toast');
@@ -55,6 +67,7 @@ async function login(username, password) {
     token = data.access_token;
     localStorage.setItem('token', token);
     await loadUserProfile();
+    startEvents();
     showPage('calculator-page');
     showMessage('Login successful!', 'success');
 }
@@ -70,6 +83,7 @@ async function register(username, email, password) {
 }
 
 function logout() {
+    stopEvents();
     token = null;
     currentUser = null;
     localStorage.removeItem('token');
@@ -137,63 +151,218 @@ function getOperationName(operation) {
 }
 
 // History Functions
+function renderHistory() {
+    const tbody = document.getElementById('history-tbody');
+    tbody.innerHTML = '';
+
+    if (calculations.length === 0) {
+        tbody.innerHTML = '<tr><td colspan="5" style="text-align: center;">No calculations yet</td></tr>';
+        return;
+    }
+
+    calculations.forEach(calc => {
+        const row = document.createElement('tr');
+        const date = new Date(calc.created_at).toLocaleString();
+        row.innerHTML = `
+            <td>${date}</td>
+            <td>${getOperationName(calc.operation)}</td>
+            <td>${calc.operand1} ${getOperationSymbol(calc.operation)} ${calc.operand2}</td>
+            <td><strong>${calc.result}</strong></td>
+            <td>
+                <button class="btn btn-danger" onclick="deleteCalculation(${calc.id})">Delete</button>
+            </td>
+        `;
+        tbody.appendChild(row);
+    });
+}
+
 async function loadHistory() {
     try {
-        const calculations = await apiRequest('/api/calculations/');
-        const tbody = document.getElementById('history-tbody');
-        tbody.innerHTML = '';
+        calculations = await apiRequest(`/api/calculations/?limit=${HISTORY_LIMIT}`);
+        renderHistory();
+    } catch (error) {
+        showMessage(error.message, 'error');
+    }
+}
 
-        if (calculations.length === 0) {
-            tbody.innerHTML = '<tr><td colspan="5" style="text-align: center;">No calculations yet</td></tr>';
-            return;
-        }
+function renderStatistics(stats) {
+    document.getElementById('stat-total').textContent = stats.total_calculations;
+    document.getElementById('stat-avg').textContent = stats.average_result.toFixed(2);
+    document.getElementById('stat-most').textContent =
+        stats.most_used_operation ? getOperationName(stats.most_used_operation) : '-';
 
-        calculations.forEach(calc => {
-            const row = document.createElement('tr');
-            const date = new Date(calc.created_at).toLocaleString();
-            row.innerHTML = `
-                <td>${date}</td>
-                <td>${getOperationName(calc.operation)}</td>
-                <td>${calc.operand1} ${getOperationSymbol(calc.operation)} ${calc.operand2}</td>
-                <td><strong>${calc.result}</strong></td>
-                <td>
-                    <button class="btn btn-danger" onclick="deleteCalculation(${calc.id})">Delete</button>
-                </td>
+    const breakdown = document.getElementById('operations-breakdown');
+    breakdown.innerHTML = '<h4>Operations Breakdown:</h4>';
+
+    if (Object.keys(stats.calculations_by_operation).length === 0) {
+        breakdown.innerHTML += '<p>No calculations yet</p>';
+    } else {
+        Object.entries(stats.calculations_by_operation).forEach(([op, count]) => {
+            breakdown.innerHTML += `
+                <div class="operation-item">
+                    <span>${getOperationName(op)}</span>
+                    <span><strong>${count}</strong></span>
+                </div>
             `;
-            tbody.appendChild(row);
         });
-    } catch (error) {
-        showMessage(error.message, 'error');
     }
 }
 
 async function loadStatistics() {
     try {
-        const stats = await apiRequest('/api/users/me/statistics');
-        
-        document.getElementById('stat-total').textContent = stats.total_calculations;
-        document.getElementById('stat-avg').textContent = stats.average_result.toFixed(2);
-        document.getElementById('stat-most').textContent = 
-            stats.most_used_operation ? getOperationName(stats.most_used_operation) : '-';
-
-        const breakdown = document.getElementById('operations-breakdown');
-        breakdown.innerHTML = '<h4>Operations Breakdown:</h4>';
-        
-        if (Object.keys(stats.calculations_by_operation).length === 0) {
-            breakdown.innerHTML += '<p>No calculations yet</p>';
+        renderStatistics(await apiRequest('/api/users/me/statistics'));
+    } catch (error) {
+        showMessage(error.message, 'error');
+    }
+}
+
+// The statistics response, computed from the per-operation counts and sums
+function summarizeStatistics() {
+    const calculationsByOperation = {};
+    let total = 0;
+    let resultSum = 0;
+    let mostUsed = null;
+    Object.entries(statistics).forEach(([op, { count, result_sum }]) => {
+        calculationsByOperation[op] = count;
+        total += count;
+        resultSum += result_sum;
+        if (mostUsed === null || count > calculationsByOperation[mostUsed]) {
+            mostUsed = op;
+        }
+    });
+    return {
+        total_calculations: total,
+        calculations_by_operation: calculationsByOperation,
+        average_result: total > 0 ? resultSum / total : 0,
+        most_used_operation: mostUsed,
+    };
+}
+
+// Live Updates
+function applyStatisticsDelta(delta) {
+    Object.entries(delta).forEach(([op, { count, result_sum }]) => {
+        const current = statistics[op] || { count: 0, result_sum: 0 };
+        const updated = { count: current.count + count, result_sum: current.result_sum + result_sum };
+        if (updated.count > 0) {
+            statistics[op] = updated;
         } else {
-            Object.entries(stats.calculations_by_operation).forEach(([op, count]) => {
-                breakdown.innerHTML += `
-                    <div class="operation-item">
-                        <span>${getOperationName(op)}</span>
-                        <span><strong>${count}</strong></span>
-                    </div>
-                `;
-            });
+            delete statistics[op];
+        }
+    });
+}
+
+function applyCalculations(changed, insertMissing) {
+    changed.forEach(calc => {
+        const index = calculations.findIndex(existing => existing.id === calc.id);
+        if (index !== -1) {
+            calculations[index] = calc;
+        } else if (insertMissing) {
+            calculations.push(calc);
         }
+    });
+    // Newest first, as GET /api/calculations/ returns them
+    calculations.sort((a, b) => b.created_at.localeCompare(a.created_at) || b.id - a.id);
+    calculations = calculations.slice(0, HISTORY_LIMIT);
+}
+
+function handleEvent(kind, data) {
+    switch (kind) {
+        case 'snapshot':
+            statistics = data.statistics;
+            eventsConnected = true;
+            reconnectDelay = RECONNECT_DELAY;
+            renderStatistics(summarizeStatistics());
+            loadHistory();
+            return;
+        case 'created':
+        case 'updated':
+            applyCalculations(data.calculations, kind === 'created');
+            break;
+        case 'deleted':
+            calculations = calculations.filter(calc => !data.ids.includes(calc.id));
+            break;
+        default:
+            // resync: the server closes the stream and we reconnect for a new snapshot.
+            // revoked: the password changed elsewhere; the reconnect gets a 401 and logs out
+            return;
+    }
+    applyStatisticsDelta(data.statistics);
+    renderHistory();
+    renderStatistics(summarizeStatistics());
+}
+
+function parseEvent(message) {
+    let kind = 'message';
+    const data = [];
+    message.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) {
+            kind = line.slice(7);
+        } else if (line.startsWith('data: ')) {
+            data.push(line.slice(6));
+        }
+    });
+    // Keep-alive comments carry no data
+    if (data.length > 0) {
+        handleEvent(kind, JSON.parse(data.join('\n')));
+    }
+}
+
+// EventSource cannot send the Authorization header, so read the stream with fetch
+async function readEvents(signal) {
+    const response = await fetch(API_BASE + '/api/events', {
+        headers: { 'Authorization': `Bearer ${token}` },
+        signal,
+    });
+    if (response.status === 401) {
+        logout();
+        return;
+    }
+    if (!response.ok) {
+        return;
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) {
+            return;
+        }
+        buffer += value;
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            parseEvent(buffer.slice(0, end));
+            buffer = buffer.slice(end + 2);
+        }
+    }
+}
+
+async function startEvents() {
+    stopEvents();
+    const controller = new AbortController();
+    eventsController = controller;
+    try {
+        await readEvents(controller.signal);
     } catch (error) {
-        showMessage(error.message, 'error');
+        // A dropped connection is retried like a resync
+    }
+    if (eventsController !== controller) {
+        // Stopped or restarted meanwhile
+        return;
     }
+    eventsController = null;
+    eventsConnected = false;
+    reconnectTimer = setTimeout(startEvents, reconnectDelay);
+    reconnectDelay = Math.min(reconnectDelay * 2, MAX_RECONNECT_DELAY);
+}
+
+function stopEvents() {
+    clearTimeout(reconnectTimer);
+    if (eventsController) {
+        eventsController.abort();
+        eventsController = null;
+    }
+    eventsConnected = false;
 }
 
 async function deleteCalculation(id) {
@@ -206,8 +375,11 @@ async function deleteCalculation(id) {
             method: 'DELETE',
         });
         showMessage('Calculation deleted successfully', 'success');
-        await loadHistory();
-        await loadStatistics();
+        // The deleted event updates the page while the stream is connected
+        if (!eventsConnected) {
+            await loadHistory();
+            await loadStatistics();
+        }
     } catch (error) {
         showMessage(error.message, 'error');
     }
@@ -228,6 +400,8 @@ async function updateProfile(username, email) {
 }
 
 async function changePassword(currentPassword, newPassword) {
+    // The stream is authenticated with the token this change revokes
+    stopEvents();
     try {
         await apiRequest('/api/users/me/change-password', {
             method: 'POST',
@@ -236,11 +410,22 @@ async function changePassword(currentPassword, newPassword) {
                 new_password: newPassword,
             }),
         });
+        // Changing the password revokes existing tokens, so sign in again
+        const data = await apiRequest('/api/auth/login', {
+            method: 'POST',
+            body: JSON.stringify({ username: currentUser.username, password: newPassword }),
+        });
+        token = data.access_token;
+        localStorage.setItem('token', token);
         showMessage('Password changed successfully!', 'success');
         document.getElementById('password-form').reset();
     } catch (error) {
         showMessage(error.message, 'error');
     }
+    // Reconnect with the new token (or the old one, if the change failed)
+    if (token) {
+        startEvents();
+    }
 }
 
 // Event Listeners
@@ -248,6 +433,9 @@ document.addEventListener('DOMContentLoaded', () => {
     // Show appropriate page based on token
     if (token) {
         loadUserProfile().then(() => {
+            if (token) {
+                startEvents();
+            }
             showPage('calculator-page');
         });
     } else {
@@ -324,7 +512,7 @@ document.addEventListener('DOMContentLoaded', () => {
         document.getElementById(linkId).addEventListener('click', (e) => {
             e.preventDefault();
             showPage(pageId);
-            if (pageId === 'history-page') {
+            if (pageId === 'history-page' && !eventsConnected) {
                 loadHistory();
                 loadStatistics();
             }
@@ -0,0 +1,99 @@
+"""Load test the sync and async request paths at high concurrency
+
+Both apps are driven in-process over httpx's ASGI transport against the same
+SQLite file (sync: pysqlite, async: aiosqlite). Pass a PostgreSQL URL as the
+first argument to compare psycopg2 with asyncpg instead.
+
+Run with: python -m benchmarks.bench_async [database_url]
+"""
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from benchmarks.common import make_session_factory, make_client, seed_user, seed_calculations
+from app.auth import create_user_token
+from app.database import get_async_db, to_async_url
+from app.main import app as sync_app
+from app.routers import auth_async, calculations_async, users_async
+
+CONCURRENCY = [10, 100, 500]
+REQUESTS_PER_LEVEL = 2000
+# One connection per in-flight request for both paths. With a smaller pool the
+# sync path can deadlock: sessions hold connections until their cleanup gets
+# a turn on the (saturated) threadpool.
+POOL = {"pool_size": max(CONCURRENCY), "max_overflow": 0, "pool_timeout": 120}
+
+
+def build_async_app(url):
+    engine = create_async_engine(to_async_url(url), poolclass=AsyncAdaptedQueuePool, **POOL)
+    session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    async_app = FastAPI()
+    for module in (auth_async, calculations_async, users_async):
+        async_app.include_router(module.router)
+    async_app.dependency_overrides[get_async_db] = override_get_async_db
+    return async_app, engine
+
+
+async def drive(app, token, concurrency):
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = []
+    remaining = iter(range(REQUESTS_PER_LEVEL))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get("/api/calculations/?limit=20", headers=headers)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+async def run(url, token):
+    async_app, async_engine = build_async_app(url)
+    results = []
+    for concurrency in CONCURRENCY:
+        results.append({
+            "concurrency": concurrency,
+            "sync": await drive(sync_app, token, concurrency),
+            "async": await drive(async_app, token, concurrency),
+        })
+    await async_engine.dispose()
+    return results
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else "sqlite:///./bench_async.db"
+    session_factory = make_session_factory(url, **POOL)
+    db = session_factory()
+    user = seed_user(db)
+    seed_calculations(db, user.id, 1000)
+    db.refresh(user)
+    token = create_user_token(user)
+    make_client(session_factory)
+
+    print(json.dumps({"database_url": url, "results": asyncio.run(run(url, token))}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
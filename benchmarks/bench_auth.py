@@ -0,0 +1,45 @@
+"""Benchmark authentication overhead on GET /api/calculations/{id}
+
+Compares id/version tokens served from the user cache with legacy
+username-only tokens, which need a user lookup on every request.
+
+Run with: python -m benchmarks.bench_auth
+"""
+import json
+
+from benchmarks.common import make_session_factory, make_client, seed_user, seed_calculations, time_call, QueryCounter
+from app.auth import create_access_token, create_user_token
+
+REQUESTS = 500
+
+
+def main():
+    session_factory = make_session_factory()
+    db = session_factory()
+    user = seed_user(db)
+    seed_calculations(db, user.id, 100)
+    db.refresh(user)
+    counter = QueryCounter(session_factory.kw["bind"])
+    client = make_client(session_factory)
+
+    tokens = {
+        "cached_id_token": create_user_token(user),
+        "legacy_username_token": create_access_token(data={"sub": user.username}),
+    }
+    results = {}
+    for name, token in tokens.items():
+        headers = {"Authorization": f"Bearer {token}"}
+
+        def fetch():
+            assert client.get("/api/calculations/1", headers=headers).status_code == 200
+
+        fetch()
+        counter.count = 0
+        timings = time_call(fetch, repeat=REQUESTS)
+        results[name] = {**timings, "queries_per_request": counter.count / REQUESTS}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Bytes on the wire and CPU per request for each compression encoding and level
+
+Serves a list page of 100 calculations, the statistics and a full NDJSON
+export of 1000 calculations in-process, once per configuration: no
+compression, gzip at levels 1, 6 and 9, and brotli and zstd at a few levels
+when their packages are installed. Reports the body size, the ratio to the
+uncompressed body and the process CPU time per request, so the level can be
+chosen by what a byte saved costs.
+
+Run with: python -m benchmarks.bench_compression [--requests 200]
+"""
+import os
+
+# The benchmark wraps the app itself, one encoding and level at a time
+os.environ["COMPRESSION_ENCODINGS"] = ""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import make_session_factory, use_session_factory, seed_user, seed_calculations, asgi_get
+from app.auth import create_user_token
+from app.compression import REQUIRED_PACKAGES, CompressionMiddleware
+
+PATHS = {
+    "list_limit_100": "/api/calculations/?limit=100",
+    "statistics": "/api/users/me/statistics",
+    "export_ndjson": "/api/calculations/export",
+}
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 11), "zstd": (1, 3, 19)}
+
+
+def installed(encoding: str) -> bool:
+    try:
+        __import__(REQUIRED_PACKAGES.get(encoding, "zlib"))
+    except ImportError:
+        return False
+    return True
+
+
+async def cpu_per_request_ms(app, path: str, headers: dict, requests: int) -> float:
+    started = time.process_time()
+    for _ in range(requests):
+        await asgi_get(app, path, headers)
+    return (time.process_time() - started) * 1000 / requests
+
+
+async def run(app, headers: dict, requests: int) -> dict:
+    configurations = [("identity", None)]
+    configurations += [(encoding, level) for encoding, levels in LEVELS.items() if installed(encoding) for level in levels]
+    results = {}
+    for name, path in PATHS.items():
+        status, body = await asgi_get(app, path, headers)
+        assert status == 200
+        plain_bytes = len(body)
+        rows = []
+        for encoding, level in configurations:
+            wrapped = app if level is None else CompressionMiddleware(app, encodings=(encoding,), level=level, minimum_size=0)
+            request_headers = {**headers, "Accept-Encoding": encoding}
+            _, body = await asgi_get(wrapped, path, request_headers)
+            rows.append({
+                "encoding": encoding,
+                "level": level,
+                "bytes": len(body),
+                "ratio": round(len(body) / plain_bytes, 3),
+                "cpu_ms_per_request": round(await cpu_per_request_ms(wrapped, path, request_headers, requests), 3),
+            })
+        results[name] = rows
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="requests per path and configuration")
+    options = parser.parse_args(argv)
+
+    session_factory = make_session_factory()
+    db = session_factory()
+    user = seed_user(db)
+    seed_calculations(db, user.id, 1000)
+    app = use_session_factory(session_factory)
+    headers = {"Authorization": f"Bearer {create_user_token(user)}"}
+    print(json.dumps(asyncio.run(run(app, headers, options.requests)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
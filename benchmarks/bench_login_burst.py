@@ -0,0 +1,86 @@
+"""Benchmark calculation latency while a login storm is in progress
+
+Runs the app in-process over httpx's ASGI transport. A burst of logins runs
+alongside a steady stream of GET /api/calculations/{id} requests, once
+with the bounded password pool and once with an effectively unbounded one.
+
+Run with: python -m benchmarks.bench_login_burst
+"""
+import asyncio
+import json
+import time
+
+import httpx
+
+from benchmarks.common import make_session_factory, make_client, seed_user, seed_calculations
+from app import auth
+from app.auth import create_user_token, get_password_hash
+from app.hashing import PasswordHasher
+from app.main import app
+
+LOGINS = 120
+READS = 300
+PASSWORD = "benchmark-password"
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000, 3)
+
+
+async def run_burst(token):
+    statuses = {}
+    read_latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def login():
+            response = await client.post("/api/auth/login", json={"username": "bench_user", "password": PASSWORD})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def read():
+            started = time.perf_counter()
+            response = await client.get("/api/calculations/1", headers={"Authorization": f"Bearer {token}"})
+            read_latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+
+        async def reads():
+            for _ in range(READS):
+                await read()
+                await asyncio.sleep(0.002)
+
+        await asyncio.gather(reads(), *(login() for _ in range(LOGINS)))
+    return {
+        "login_statuses": statuses,
+        "read_p50_ms": percentile(read_latencies, 0.50),
+        "read_p99_ms": percentile(read_latencies, 0.99),
+    }
+
+
+def main():
+    session_factory = make_session_factory()
+    db = session_factory()
+    user = seed_user(db)
+    user.hashed_password = get_password_hash(PASSWORD)
+    db.commit()
+    seed_calculations(db, user.id, 10)
+    db.refresh(user)
+    token = create_user_token(user)
+    make_client(session_factory)
+
+    configurations = {
+        "bounded_pool": {"workers": 2, "max_queue": 4},
+        "unbounded_pool": {"workers": 40, "max_queue": 1000},
+    }
+    results = {}
+    original = auth.password_hasher
+    for name, config in configurations.items():
+        auth.password_hasher = PasswordHasher(original.context, **config)
+        results[name] = {"config": config, **asyncio.run(run_burst(token))}
+        auth.password_hasher.shutdown()
+    auth.password_hasher = original
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Benchmark deep history pages in offset vs keyset (cursor) mode
+
+Run with: python -m benchmarks.bench_pagination
+"""
+import json
+from urllib.parse import urlencode
+
+from benchmarks.common import make_session_factory, make_request, seed_user, seed_calculations, time_call
+from app.routers.calculations import list_calculations, NEXT_CURSOR_HEADER
+
+HISTORY_SIZE = 200_000
+PAGE_SIZE = 100
+TARGET_PAGES = [1, 100, 1000]
+
+
+def main():
+    db = make_session_factory()()
+    user = seed_user(db)
+    seed_calculations(db, user.id, HISTORY_SIZE)
+    db.refresh(user)
+    db.expunge(user)
+
+    def fetch(skip=0, cursor=None):
+        db.expunge_all()
+        params = {"limit": PAGE_SIZE, **({"cursor": cursor} if cursor else {"skip": skip})}
+        response = list_calculations(
+            request=make_request("/api/calculations/", urlencode(params)),
+            skip=skip, limit=PAGE_SIZE, cursor=cursor, db=db, current_user=user
+        )
+        return json.loads(response.body), response.headers.get(NEXT_CURSOR_HEADER)
+
+    # Walk the history once to collect the cursor that starts each target page
+    cursors = {1: None}
+    cursor = None
+    for page_number in range(2, max(TARGET_PAGES) + 1):
+        _, cursor = fetch(cursor=cursor)
+        cursors[page_number] = cursor
+
+    results = []
+    for page_number in TARGET_PAGES:
+        skip = (page_number - 1) * PAGE_SIZE
+        offset_page, _ = fetch(skip=skip)
+        cursor_page, _ = fetch(cursor=cursors[page_number])
+        assert [c["id"] for c in offset_page] == [c["id"] for c in cursor_page]
+        results.append({
+            "page": page_number,
+            "offset": time_call(lambda: fetch(skip=skip)),
+            "cursor": time_call(lambda: fetch(cursor=cursors[page_number])),
+        })
+
+    print(json.dumps({"history_size": HISTORY_SIZE, "page_size": PAGE_SIZE, "pages": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
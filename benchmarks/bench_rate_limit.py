@@ -0,0 +1,77 @@
+"""Cost of the rate limiter per request, and its independence from the number of clients
+
+First, the in-memory backend's `take` on its own, with 1 to 100,000 buckets
+already in use: the time per check stays flat as the number of clients grows.
+Then GET /health served in-process without a limit, with a per-IP limit
+and with a per-user limit (which reads the user from the access token). The
+limits are too high to be hit, so every request pays for the check and
+nothing else.
+
+Run with: python -m benchmarks.bench_rate_limit
+"""
+import asyncio
+import json
+import time
+
+from benchmarks.common import asgi_get, use_session_factory, make_session_factory, seed_user
+from app.auth import create_user_token
+from app.rate_limit import InMemoryBackend, RateLimit, RateLimiter, RateLimitMiddleware
+
+DURATION_SECONDS = 2.0
+BUCKET_COUNTS = (1, 1000, 100000)
+CHECKS = 200000
+UNREACHABLE = RateLimit(10 ** 9, 1)
+
+
+def take_microseconds(buckets: int) -> float:
+    backend = InMemoryBackend(max_entries=buckets)
+    keys = [f"POST /api/calculations/:user:{index}" for index in range(buckets)]
+    for key in keys:
+        backend.take(key, UNREACHABLE)
+    started = time.perf_counter()
+    for index in range(CHECKS):
+        backend.take(keys[index % buckets], UNREACHABLE)
+    return (time.perf_counter() - started) * 1e6 / CHECKS
+
+
+async def requests_per_second(app, headers: dict) -> float:
+    count = 0
+    started = time.perf_counter()
+    deadline = started + DURATION_SECONDS
+    while time.perf_counter() < deadline:
+        await asgi_get(app, "/health", headers)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+async def run(app, token: str) -> dict:
+    limited = RateLimitMiddleware(app, RateLimiter(InMemoryBackend(1000), {"GET /health": UNREACHABLE}))
+    configurations = {
+        "no_limit": (app, {}),
+        "per_ip": (limited, {}),
+        "per_user": (limited, {"Authorization": f"Bearer {token}"}),
+    }
+    rates = {}
+    for name, (wrapped, headers) in configurations.items():
+        status, _ = await asgi_get(wrapped, "/health", headers)
+        assert status == 200
+        rates[name] = await requests_per_second(wrapped, headers)
+    baseline_us = 1e6 / rates["no_limit"]
+    return {
+        name: {"rps": round(rate, 1), "overhead_us": round(1e6 / rate - baseline_us, 1)}
+        for name, rate in rates.items()
+    }
+
+
+def main():
+    session_factory = make_session_factory()
+    user = seed_user(session_factory())
+    app = use_session_factory(session_factory)
+    print(json.dumps({
+        "take_us_by_buckets": {str(buckets): round(take_microseconds(buckets), 2) for buckets in BUCKET_COUNTS},
+        "health": asyncio.run(run(app, create_user_token(user))),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
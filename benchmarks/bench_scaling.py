@@ -0,0 +1,119 @@
+"""Throughput of the preforking server (app.server) from 1 to N workers
+
+Seeds a database once. Then, for each worker count, starts
+`python -m app.server --workers N` on it and runs the same load against it
+for --duration seconds. The load is --clients client processes, each with
+--concurrency connections, fetching list pages as the seeded users. Reports
+req/s, the speedup over one worker and the scaling efficiency
+(speedup / workers).
+
+The load generator needs CPU too. By default it tests up to half the
+available CPUs and uses as many client processes as the largest worker
+count, so the clients are not the bottleneck. Near-linear scaling shows up
+as an efficiency close to 1.0. With SQLite every worker reads the same
+file; pass a PostgreSQL URL as --database-url to include a real server.
+
+Run with: python -m benchmarks.bench_scaling [--max-workers N] [--duration 10]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+from typing import List, Tuple
+
+import httpx
+
+from benchmarks.common import make_session_factory
+from benchmarks.run import PAGE_SIZE, seed, start_server
+from app.server import available_cpus
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite:///./bench_scaling.db",
+                        help="database to seed; its tables are dropped and recreated")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--calculations", type=int, default=1000, help="calculations per user")
+    parser.add_argument("--max-workers", type=int, default=max(1, available_cpus() // 2))
+    parser.add_argument("--clients", type=int, help="load generator processes (default: --max-workers)")
+    parser.add_argument("--concurrency", type=int, default=8, help="connections per client process")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per worker count")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of load before measuring")
+    return parser.parse_args(argv)
+
+
+async def _load(base_url: str, tokens: List[str], duration: float, concurrency: int) -> Tuple[int, int]:
+    deadline = time.monotonic() + duration
+    completed = errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker(index: int):
+            nonlocal completed, errors
+            headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"}
+            while time.monotonic() < deadline:
+                response = await client.get("/api/calculations/", params={"limit": PAGE_SIZE}, headers=headers)
+                completed += 1
+                if response.status_code >= 400:
+                    errors += 1
+
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    return completed, errors
+
+
+def load(base_url: str, tokens: List[str], duration: float, concurrency: int) -> Tuple[int, int]:
+    """One client process: (completed requests, errors) over `duration` seconds"""
+    return asyncio.run(_load(base_url, tokens, duration, concurrency))
+
+
+def measure(options, tokens: List[str], workers: int, clients: int) -> dict:
+    connections = clients * options.concurrency
+    process, base_url = start_server(
+        ["app.server", "--workers", str(workers)], options.database_url, connections
+    )
+    try:
+        with multiprocessing.Pool(clients) as pool:
+            pool.starmap(load, [(base_url, tokens, options.warmup, options.concurrency)] * clients)
+            results = pool.starmap(load, [(base_url, tokens, options.duration, options.concurrency)] * clients)
+    finally:
+        process.terminate()
+        process.wait()
+    completed = sum(count for count, _ in results)
+    return {
+        "workers": workers,
+        "requests": completed,
+        "errors": sum(errors for _, errors in results),
+        "req_per_s": round(completed / options.duration, 1),
+    }
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    clients = options.clients or options.max_workers
+    session_factory = make_session_factory(options.database_url)
+    tokens = [user.token for user in seed(session_factory, options.users, options.calculations)]
+
+    levels = []
+    for workers in range(1, options.max_workers + 1):
+        level = measure(options, tokens, workers, clients)
+        baseline = levels[0]["req_per_s"] if levels else level["req_per_s"]
+        level["speedup"] = round(level["req_per_s"] / baseline, 2) if baseline else None
+        level["efficiency"] = round(level["speedup"] / workers, 2) if baseline else None
+        levels.append(level)
+
+    print(json.dumps({
+        "available_cpus": available_cpus(),
+        "config": {
+            "database_url": options.database_url,
+            "users": options.users,
+            "calculations": options.calculations,
+            "clients": clients,
+            "concurrency": options.concurrency,
+            "duration": options.duration,
+        },
+        "levels": levels,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
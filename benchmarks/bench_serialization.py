@@ -0,0 +1,65 @@
+"""Benchmark the default vs fast JSON path for list and statistics responses
+
+Requests are sent to the ASGI app in-process, one at a time on one event
+loop, so the rates are requests per second per core without client or
+socket overhead. The response cache is off (see common.py), so every
+request queries and serializes.
+
+Run with: python -m benchmarks.bench_serialization
+"""
+import asyncio
+import json
+import time
+
+from benchmarks.common import make_session_factory, use_session_factory, seed_user, seed_calculations, asgi_get
+from app.auth import create_user_token
+from app.config import get_settings
+
+DURATION_SECONDS = 3.0
+PATHS = {
+    "list_limit_100": "/api/calculations/?limit=100",
+    "statistics": "/api/users/me/statistics",
+}
+
+
+async def requests_per_second(app, path: str, headers: dict) -> float:
+    count = 0
+    started = time.perf_counter()
+    deadline = started + DURATION_SECONDS
+    while time.perf_counter() < deadline:
+        await asgi_get(app, path, headers)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+async def run(app, headers: dict) -> dict:
+    settings = get_settings()
+    results = {}
+    for name, path in PATHS.items():
+        rates, bodies = {}, {}
+        for fast in (False, True):
+            settings.fast_json_responses = fast
+            status, bodies[fast] = await asgi_get(app, path, headers)
+            assert status == 200
+            rates[fast] = await requests_per_second(app, path, headers)
+        assert bodies[False] == bodies[True]
+        results[name] = {
+            "default_rps": round(rates[False], 1),
+            "fast_rps": round(rates[True], 1),
+            "speedup": round(rates[True] / rates[False], 2),
+        }
+    return results
+
+
+def main():
+    session_factory = make_session_factory()
+    db = session_factory()
+    user = seed_user(db)
+    seed_calculations(db, user.id, 1000)
+    app = use_session_factory(session_factory)
+    headers = {"Authorization": f"Bearer {create_user_token(user)}"}
+    print(json.dumps(asyncio.run(run(app, headers)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
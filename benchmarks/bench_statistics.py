@@ -0,0 +1,66 @@
+"""Benchmark GET /api/users/me/statistics as a user's history grows
+
+Run with: python -m benchmarks.bench_statistics
+"""
+import json
+import tracemalloc
+
+from benchmarks.common import make_session_factory, make_request, seed_user, seed_calculations, time_call
+from app.models import Calculation
+from app.routers.users import get_user_statistics
+from app.rollup import recompute
+
+HISTORY_SIZES = [1_000, 10_000, 100_000]
+
+
+def load_all_statistics(db, user):
+    """The previous implementation: materialize every row and aggregate in Python"""
+    calculations = db.query(Calculation).filter(Calculation.user_id == user.id).all()
+    counts = {}
+    for calc in calculations:
+        counts[calc.operation.value] = counts.get(calc.operation.value, 0) + 1
+    return counts, sum(calc.result for calc in calculations) / len(calculations)
+
+
+def peak_memory_kib(func) -> float:
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def main():
+    results = []
+    for size in HISTORY_SIZES:
+        session_factory = make_session_factory()
+        db = session_factory()
+        user = seed_user(db)
+        seed_calculations(db, user.id, size)
+        db.refresh(user)
+        db.expunge(user)
+
+        def rollup_endpoint():
+            db.expunge_all()
+            get_user_statistics(request=make_request("/api/users/me/statistics"), db=db, current_user=user)
+
+        def sql_aggregate():
+            recompute(db, user.id)
+
+        def python_aggregate():
+            db.expunge_all()
+            load_all_statistics(db, user)
+
+        results.append({
+            "history_size": size,
+            "rollup_endpoint": {**time_call(rollup_endpoint, repeat=5), "peak_kib": peak_memory_kib(rollup_endpoint)},
+            "sql_aggregate": {**time_call(sql_aggregate, repeat=5), "peak_kib": peak_memory_kib(sql_aggregate)},
+            "python_aggregate": {**time_call(python_aggregate, repeat=5), "peak_kib": peak_memory_kib(python_aggregate)},
+        })
+        db.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
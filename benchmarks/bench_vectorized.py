@@ -0,0 +1,56 @@
+"""Benchmark the vectorized calculation engine against the scalar loop
+
+Run with: python -m benchmarks.bench_vectorized [--max-size N]
+"""
+import argparse
+import json
+
+import numpy as np
+
+from benchmarks.common import OPERATIONS, time_call
+from app.routers.calculations import perform_calculation
+from app.vectorized import perform_calculations, OPERATION_CODES
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def make_inputs(size: int, seed: int = 0):
+    """Random operations with operands that never hit an error row"""
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, len(OPERATIONS), size, dtype=np.int8)
+    operand1 = rng.uniform(0, 1000, size)
+    operand2 = rng.uniform(1, 10, size)
+    return codes, operand1, operand2
+
+
+def scalar_loop(operations, operand1, operand2):
+    """The per-item path used before: one perform_calculation call per row"""
+    return [perform_calculation(*row) for row in zip(operations, operand1, operand2)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-size", type=int, default=SIZES[-1])
+    args = parser.parse_args()
+
+    assert list(OPERATION_CODES) == OPERATIONS
+    results = []
+    for size in [size for size in SIZES if size <= args.max_size]:
+        codes, operand1, operand2 = make_inputs(size)
+        operations = [OPERATIONS[code] for code in codes.tolist()]
+        operand1_list, operand2_list = operand1.tolist(), operand2.tolist()
+        # Time the scalar loop once at the largest sizes, it takes seconds
+        repeat = 5 if size <= 100_000 else 1
+
+        results.append({
+            "size": size,
+            "scalar_loop": time_call(lambda: scalar_loop(operations, operand1_list, operand2_list), repeat=repeat),
+            "vectorized_codes": time_call(lambda: perform_calculations(codes, operand1, operand2), repeat=5),
+            "vectorized_enums": time_call(lambda: perform_calculations(operations, operand1_list, operand2_list), repeat=repeat),
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
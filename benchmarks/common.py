@@ -0,0 +1,174 @@
+"""Shared helpers for the benchmark scripts"""
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# The app reads its settings at import time, so give it something to work with
+os.environ.setdefault("DATABASE_URL", "sqlite:///./bench.db")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+# Measure the database path unless a benchmark opts into the response cache
+os.environ.setdefault("RESPONSE_CACHE_TTL_SECONDS", "0")
+# Load comes from one address and logs in many times; bench_rate_limit measures the limiter itself
+os.environ.setdefault("RATE_LIMITS", "{}")
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import User, Calculation, OperationType
+from app import rollup
+
+OPERATIONS = list(OperationType)
+
+
+def make_session_factory(url: str = "sqlite://", **engine_kwargs):
+    """Create a fresh schema and return a session factory bound to it"""
+    if url == "sqlite://":
+        engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    elif url.startswith("sqlite"):
+        engine = create_engine(url, connect_args={"check_same_thread": False}, **engine_kwargs)
+    else:
+        engine = create_engine(url, **engine_kwargs)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def seed_user(db, username: str = "bench_user") -> User:
+    """Insert a user with a throwaway password hash"""
+    user = User(
+        username=username,
+        email=f"{username}@example.com",
+        hashed_password="not-a-real-hash"
+    )
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def seed_calculations(db, user_id: int, count: int, batch_size: int = 10000) -> None:
+    """Bulk insert `count` calculations with increasing timestamps"""
+    rng = random.Random(user_id)
+    start = datetime(2024, 1, 1)
+    for offset in range(0, count, batch_size):
+        rows = []
+        for i in range(offset, min(offset + batch_size, count)):
+            operand1 = rng.uniform(-1000, 1000)
+            operand2 = rng.uniform(1, 100)
+            rows.append({
+                "user_id": user_id,
+                "operation": OPERATIONS[i % len(OPERATIONS)],
+                "operand1": operand1,
+                "operand2": operand2,
+                "result": operand1 + operand2,
+                "created_at": start + timedelta(seconds=i),
+            })
+        db.execute(insert(Calculation), rows)
+    rollup.rebuild(db, user_id)
+    db.commit()
+
+
+def time_call(func, repeat: int = 20) -> dict:
+    """Run `func` repeatedly and return latency percentiles in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "min_ms": round(samples[0], 3),
+        "p50_ms": round(statistics.median(samples), 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def make_request(path: str, query: str = ""):
+    """A bare Request for calling route handlers directly"""
+    from starlette.requests import Request
+
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": query.encode(),
+        "headers": [],
+    })
+
+
+def use_session_factory(session_factory):
+    """Point the app's get_db dependency at the given session factory and return the app"""
+    from app.database import get_db
+    from app.main import app
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    return app
+
+
+def make_client(session_factory):
+    """Return a TestClient for the app that uses the given session factory"""
+    from fastapi.testclient import TestClient
+
+    return TestClient(use_session_factory(session_factory))
+
+
+async def asgi_get(app, path: str, headers: dict) -> tuple:
+    """Call an ASGI app in-process, without a client or sockets; returns (status, body)"""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench")] + [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    response = {"status": None, "body": b""}
+    received = asyncio.Event()
+
+    async def receive():
+        if received.is_set():
+            # Like a connected client: nothing more until the response ends (streaming responses wait here)
+            await asyncio.Event().wait()
+        received.set()
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+class QueryCounter:
+    """Count SQL statements executed on an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._record)
+
+    def _record(self, *args):
+        self.count += 1
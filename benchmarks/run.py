@@ -0,0 +1,334 @@
+"""Throughput and latency suite for the main API endpoints
+
+Seeds --users users with --calculations calculations each, then runs each
+scenario (login, create, shallow and deep list pages, statistics, delete)
+from --concurrency concurrent clients and reports req/s and p50/p95/p99
+latency. By default the app is driven in-process over httpx's ASGI
+transport. With --target uvicorn the runner starts a uvicorn server on the
+seeded database and drives it over HTTP, which adds sockets, the HTTP
+parser and the server's event loop.
+
+Before the scenarios, a fresh interpreter imports the app, starts it and
+serves one request (benchmarks.startup), --startup-runs times. The runner
+exits with status 1 if the median import or first request is over
+--max-import-seconds or --max-first-request-seconds.
+
+Results are printed, and written to --output, as JSON. Pass an earlier
+results file as --compare to add the relative change of every scenario.
+
+Run with: python -m benchmarks.run [--target uvicorn] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import httpx
+from sqlalchemy import select
+
+from benchmarks.common import make_session_factory, seed_user, seed_calculations, use_session_factory
+from app.auth import create_user_token, get_password_hash
+from app.models import Calculation, OperationType
+from app.pagination import encode_cursor
+
+PASSWORD = "bench-password"
+PAGE_SIZE = 20
+OPERATIONS = [operation.value for operation in OperationType if operation != OperationType.DIVIDE]
+
+# (method, url, httpx keyword arguments)
+Call = Tuple[str, str, dict]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--database-url", default="sqlite:///./bench_suite.db",
+                        help="database to seed; its tables are dropped and recreated")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--calculations", type=int, default=10000, help="calculations per user")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=100, help="logins run bcrypt, so fewer of them")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    parser.add_argument("--startup-runs", type=int, default=3, help="cold starts to take the median of")
+    parser.add_argument("--max-import-seconds", type=float, default=3.0)
+    parser.add_argument("--max-first-request-seconds", type=float, default=0.5)
+    return parser.parse_args(argv)
+
+
+class SeededUser:
+    def __init__(self, username: str, token: str, deep_cursor: Optional[str]):
+        self.username = username
+        self.token = token
+        self.deep_cursor = deep_cursor
+        self.headers: dict = {}
+
+
+def seed(session_factory, users: int, calculations: int) -> List[SeededUser]:
+    """Create the users and their histories; each gets a cursor to its last page"""
+    db = session_factory()
+    password_hash = get_password_hash(PASSWORD)
+    seeded = []
+    try:
+        for index in range(users):
+            user = seed_user(db, f"bench_user_{index}")
+            user.hashed_password = password_hash
+            seed_calculations(db, user.id, calculations)
+            deep_cursor = None
+            if calculations > PAGE_SIZE:
+                created_at, calculation_id = db.execute(
+                    select(Calculation.created_at, Calculation.id)
+                    .where(Calculation.user_id == user.id)
+                    .order_by(Calculation.created_at.desc(), Calculation.id.desc())
+                    .offset(calculations - PAGE_SIZE - 1)
+                    .limit(1)
+                ).one()
+                deep_cursor = encode_cursor(created_at, calculation_id)
+            seeded.append(SeededUser(user.username, create_user_token(user), deep_cursor))
+    finally:
+        db.close()
+    return seeded
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def drive(client: httpx.AsyncClient, calls: List[Call], concurrency: int) -> Tuple[dict, list]:
+    """Send the calls from `concurrency` workers; returns the summary and (call index, response) pairs"""
+    latencies, responses = [], []
+    errors = 0
+    pending = iter(enumerate(calls))
+
+    async def worker():
+        nonlocal errors
+        for index, (method, url, kwargs) in pending:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            responses.append((index, response))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started), responses
+
+
+def spread(users: List[SeededUser], count: int) -> List[SeededUser]:
+    """Round-robin `count` requests over the users"""
+    return [users[i % len(users)] for i in range(count)]
+
+
+async def run_scenarios(client: httpx.AsyncClient, users: List[SeededUser], options) -> dict:
+    results = {}
+
+    calls = [
+        ("POST", "/api/auth/login", {"json": {"username": user.username, "password": PASSWORD}})
+        for user in spread(users, max(options.login_requests, len(users)))
+    ]
+    results["login"], responses = await drive(client, calls, options.concurrency)
+    for index, response in responses:
+        if response.status_code == 200:
+            user = users[index % len(users)]
+            user.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    owners = spread(users, options.requests)
+    calls = [
+        ("POST", "/api/calculations/", {"headers": user.headers, "json": {
+            "operation": OPERATIONS[i % len(OPERATIONS)], "operand1": i % 1000, "operand2": 7
+        }})
+        for i, user in enumerate(owners)
+    ]
+    results["create"], responses = await drive(client, calls, options.concurrency)
+    created = [(owners[index], response.json()["id"]) for index, response in responses if response.status_code == 201]
+
+    requested = spread(users, options.requests)
+    results["list_shallow"], _ = await drive(client, [
+        ("GET", "/api/calculations/", {"headers": user.headers, "params": {"limit": PAGE_SIZE}})
+        for user in requested
+    ], options.concurrency)
+    if options.calculations > PAGE_SIZE:
+        skip = options.calculations - PAGE_SIZE
+        results["list_deep_offset"], _ = await drive(client, [
+            ("GET", "/api/calculations/", {"headers": user.headers, "params": {"skip": skip, "limit": PAGE_SIZE}})
+            for user in requested
+        ], options.concurrency)
+        results["list_deep_cursor"], _ = await drive(client, [
+            ("GET", "/api/calculations/", {"headers": user.headers, "params": {"cursor": user.deep_cursor, "limit": PAGE_SIZE}})
+            for user in requested
+        ], options.concurrency)
+    results["statistics"], _ = await drive(client, [
+        ("GET", "/api/users/me/statistics", {"headers": user.headers}) for user in requested
+    ], options.concurrency)
+
+    # Delete what the create scenario added, so repeated runs see the same history
+    results["delete"], _ = await drive(client, [
+        ("DELETE", f"/api/calculations/{calculation_id}", {"headers": user.headers})
+        for user, calculation_id in created
+    ], options.concurrency)
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command: List[str], database_url: str, concurrency: int) -> Tuple[subprocess.Popen, str]:
+    """Run a server command (given --host/--port) on a free port and wait until /health answers"""
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, DB_POOL_SIZE=str(concurrency), DB_MAX_OVERFLOW=str(concurrency))
+    process = subprocess.Popen(
+        [sys.executable, "-m", *command, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{command[0]} exited during startup")
+        try:
+            httpx.get(f"{base_url}/health")
+            return process, base_url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{command[0]} did not start within 30 seconds")
+
+
+def start_uvicorn(database_url: str, concurrency: int) -> Tuple[subprocess.Popen, str]:
+    """Serve app.main with a single uvicorn process"""
+    return start_server(["uvicorn", "app.main:app"], database_url, concurrency)
+
+
+async def run(options, users: List[SeededUser], session_factory) -> dict:
+    if options.target == "asgi":
+        transport = httpx.ASGITransport(app=use_session_factory(session_factory))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_scenarios(client, users, options)
+
+    process, base_url = start_uvicorn(options.database_url, options.concurrency)
+    try:
+        limits = httpx.Limits(max_connections=options.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+            return await run_scenarios(client, users, options)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def measure_startup(options, token: str) -> dict:
+    """Median cold-start timings over --startup-runs fresh interpreters, checked against the budget"""
+    env = dict(os.environ, DATABASE_URL=options.database_url)
+    runs = []
+    for _ in range(options.startup_runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--token", token],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    result = {
+        metric: statistics.median(run[metric] for run in runs)
+        for metric in ("import_s", "lifespan_s", "first_request_s")
+    }
+    result["first_request_status"] = runs[-1]["first_request_status"]
+    result["budget"] = {"import_s": options.max_import_seconds, "first_request_s": options.max_first_request_seconds}
+    result["within_budget"] = (
+        result["import_s"] <= options.max_import_seconds
+        and result["first_request_s"] <= options.max_first_request_seconds
+    )
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, results: dict) -> dict:
+    """Relative change of each scenario's throughput and latency against an earlier run"""
+    changes = {}
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            metric: f"{current[metric] / previous[metric] - 1:+.1%}" if previous[metric] else None
+            for metric in ("req_per_s", "p50_ms", "p95_ms", "p99_ms")
+        }
+    return {
+        "baseline_commit": baseline.get("commit"),
+        # Numbers from a different target or workload are not comparable
+        "same_setup": baseline.get("target") == results["target"] and baseline.get("config") == results["config"],
+        "scenarios": changes,
+    }
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    baseline = None
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    pool = {"pool_size": options.concurrency, "max_overflow": options.concurrency}
+    session_factory = make_session_factory(options.database_url, **pool)
+    users = seed(session_factory, options.users, options.calculations)
+
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "target": options.target,
+        "config": {
+            "database_url": options.database_url,
+            "users": options.users,
+            "calculations": options.calculations,
+            "requests": options.requests,
+            "login_requests": options.login_requests,
+            "concurrency": options.concurrency,
+        },
+    }
+    results["startup"] = measure_startup(options, users[0].token)
+    results["scenarios"] = asyncio.run(run(options, users, session_factory))
+    if baseline is not None:
+        results["compared"] = compare(baseline, results)
+
+    output = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as target:
+            target.write(output + "\n")
+    print(output)
+    if not results["startup"]["within_budget"]:
+        sys.exit("Cold start is over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Cold-start cost of the app: import, lifespan startup and the first request
+
+Must run in a fresh interpreter, so benchmarks.run starts it as a
+subprocess with the environment of the app under test. The first request
+is an authenticated GET /api/users/me/statistics, which builds the engine,
+opens the first connection and runs the first queries. Prints one JSON object.
+
+Run with: python -m benchmarks.startup [--token JWT]
+"""
+import time
+
+started = time.perf_counter()
+
+import argparse
+import json
+
+from app.main import app
+
+imported = time.perf_counter()
+
+from fastapi.testclient import TestClient
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--token", help="access token for the first request; without one it gets a 401")
+    options = parser.parse_args(argv)
+    headers = {"Authorization": f"Bearer {options.token}"} if options.token else {}
+
+    client_ready = time.perf_counter()
+    with TestClient(app) as client:
+        ready = time.perf_counter()
+        response = client.get("/api/users/me/statistics", headers=headers)
+        answered = time.perf_counter()
+
+    print(json.dumps({
+        "import_s": round(imported - started, 3),
+        "lifespan_s": round(ready - client_ready, 3),
+        "first_request_s": round(answered - ready, 3),
+        "first_request_status": response.status_code,
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,34 @@
+import json
+from pathlib import Path
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from app.main import app
-from app.database import Base, get_db
+from app.database import Base, get_db, get_async_db
+from app.routers import auth_async, calculations_async, events_async, users_async
+from app.auth import user_cache
+from app.response_cache import response_cache
+from app.rate_limit import rate_limiter
+from app import instrumentation
+from app.instrumentation import InstrumentationMiddleware
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine on the same file; NullPool keeps connections off the client's event loop between requests
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+# Most SQL statements each /api route may run, with a cold user cache
+QUERY_BUDGETS = json.loads((Path(__file__).parent / "query_budgets.json").read_text())
+
 
 def override_get_db():
     """Override database dependency for testing"""
@@ -20,6 +39,19 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    """Override async database dependency for testing"""
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(autouse=True)
+def query_budgets(monkeypatch):
+    """Fail any request that runs more statements than its route's budget"""
+    monkeypatch.setattr(instrumentation, "query_limits", dict(QUERY_BUDGETS))
+    return QUERY_BUDGETS
+
+
 @pytest.fixture(scope="function")
 def db():
     """Create a fresh database for each test"""
@@ -32,11 +64,56 @@ def db():
 def client(db):
     """Create a test client"""
     app.dependency_overrides[get_db] = override_get_db
+    user_cache.clear()
+    response_cache.backend.flushdb()
+    rate_limiter.backend.clear()
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
 
 
+@pytest.fixture(scope="function")
+def async_client(db):
+    """Create a test client for the async (DATABASE_ASYNC) request path"""
+    async_app = FastAPI()
+    for module in (auth_async, calculations_async, users_async, events_async):
+        async_app.include_router(module.router)
+    async_app.dependency_overrides[get_async_db] = override_get_async_db
+    async_app.add_middleware(InstrumentationMiddleware)
+    user_cache.clear()
+    response_cache.backend.flushdb()
+    rate_limiter.backend.clear()
+    with TestClient(async_app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def authenticated_async_client(async_client, test_user_data):
+    """Create an authenticated test client for the async request path"""
+    async_client.post("/api/auth/register", json=test_user_data)
+    response = async_client.post("/api/auth/login", json={
+        "username": test_user_data["username"],
+        "password": test_user_data["password"]
+    })
+    token = response.json()["access_token"]
+    async_client.headers = {"Authorization": f"Bearer {token}"}
+    return async_client
+
+
+@pytest.fixture
+def sql_statements():
+    """Record every SQL statement (and its parameters) sent to the test database"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record)
+
+
 @pytest.fixture
 def test_user_data():
     """Sample user data for testing"""
@@ -1,6 +1,41 @@
 """Integration tests for API endpoints"""
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import httpx
 import pytest
 from fastapi import status
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect, text
+from app.models import User, UserCalculationStats, Calculation, ImportJobState
+from app.rollup import find_inconsistencies, rebuild, recompute
+from app.auth import create_access_token, password_hasher, user_cache
+from app.history import bump_history_version
+from app.hashing import PasswordPoolSaturated
+from app.routers import calculations as calculations_router
+from app.export import export_statement, iter_export
+from app import imports
+from app.result_cache import calculation_cache
+from app.response_cache import response_cache
+from app.config import get_settings
+from app.events import event_hub, publish, resync_event
+from app.rate_limit import RateLimit, rate_limiter
+from app import database, instrumentation
+from app import main as app_main
+from app.main import app
 
 
 class TestAuthEndpoints:
@@ -51,6 +86,36 @@ class TestAuthEndpoints:
         })
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
+    def test_login_when_password_pool_saturated(self, client, test_user_data, monkeypatch):
+        """Test login sheds load with 503 and Retry-After"""
+        client.post("/api/auth/register", json=test_user_data)
+
+        def saturated(*args):
+            raise PasswordPoolSaturated(retry_after=2)
+
+        monkeypatch.setattr(password_hasher, "verify", saturated)
+        response = client.post("/api/auth/login", json={
+            "username": test_user_data["username"],
+            "password": test_user_data["password"]
+        })
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == "2"
+
+    def test_password_hashing_metrics(self, client, test_user_data):
+        """Test hashing latency is reported"""
+        client.post("/api/auth/register", json=test_user_data)
+        response = client.get("/metrics/password-hashing")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["latency"]["hash"]["count"] >= 1
+
+    def test_db_pool_metrics(self, client):
+        """Test pool telemetry is exposed"""
+        response = client.get("/metrics/db-pool")
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()["sync"]
+        assert "checkout_wait" in data
+        assert "timeouts" in data
+
     def test_login_nonexistent_user(self, client):
         """Test login with nonexistent user"""
         response = client.post("/api/auth/login", json={
@@ -63,6 +128,27 @@ class TestAuthEndpoints:
 class TestCalculationEndpoints:
     """Test calculation endpoints"""
 
+    def test_repeated_calculation_uses_cache(self, authenticated_client, monkeypatch):
+        """Test identical inputs are computed once and counted as cache hits"""
+        monkeypatch.setattr(calculation_cache, "max_size", 100)
+        calculation_cache.clear()
+        before = authenticated_client.get("/metrics/calculation-cache").json()
+        payload = {"operation": "power", "operand1": 1.0001, "operand2": 12345}
+        first = authenticated_client.post("/api/calculations/", json=payload).json()
+        second = authenticated_client.post("/api/calculations/", json=payload).json()
+        assert first["result"] == second["result"]
+        after = authenticated_client.get("/metrics/calculation-cache").json()
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
+
+    def test_power_out_of_range(self, authenticated_client):
+        """Test an overflowing power is rejected with 400"""
+        response = authenticated_client.post("/api/calculations/", json={
+            "operation": "power", "operand1": 10, "operand2": 400
+        })
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"] == "Result is out of range"
+
     def test_create_calculation(self, authenticated_client):
         """Test creating a calculation"""
         response = authenticated_client.post("/api/calculations/", json={
@@ -114,6 +200,34 @@ class TestCalculationEndpoints:
         data = response.json()
         assert len(data) == 2
 
+    def test_list_calculations_cursor_pagination(self, authenticated_client):
+        """Test paging through history with the next cursor"""
+        for i in range(5):
+            authenticated_client.post("/api/calculations/", json={
+                "operation": "add",
+                "operand1": i,
+                "operand2": 0
+            })
+
+        first_page = authenticated_client.get("/api/calculations/?limit=2")
+        assert [c["operand1"] for c in first_page.json()] == [4, 3]
+        cursor = first_page.headers["X-Next-Cursor"]
+
+        second_page = authenticated_client.get(f"/api/calculations/?limit=2&cursor={cursor}")
+        assert [c["operand1"] for c in second_page.json()] == [2, 1]
+        assert second_page.json() == authenticated_client.get("/api/calculations/?skip=2&limit=2").json()
+
+        last_page = authenticated_client.get(
+            f"/api/calculations/?limit=2&cursor={second_page.headers['X-Next-Cursor']}"
+        )
+        assert [c["operand1"] for c in last_page.json()] == [0]
+        assert "X-Next-Cursor" not in last_page.headers
+
+    def test_list_calculations_invalid_cursor(self, authenticated_client):
+        """Test a malformed cursor is rejected"""
+        response = authenticated_client.get("/api/calculations/?cursor=not-a-cursor")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
     def test_get_calculation_by_id(self, authenticated_client):
         """Test getting specific calculation"""
         create_response = authenticated_client.post("/api/calculations/", json={
@@ -170,6 +284,69 @@ class TestCalculationEndpoints:
         assert get_response.status_code == status.HTTP_404_NOT_FOUND
 
 
+class TestCalculationBatch:
+    """Test the batch calculation endpoint"""
+
+    def test_batch_partial_success(self, authenticated_client, db):
+        """Test valid items are stored and invalid items are reported"""
+        response = authenticated_client.post("/api/calculations/batch", json={"items": [
+            {"operation": "add", "operand1": 1, "operand2": 2},
+            {"operation": "divide", "operand1": 1, "operand2": 0},
+            {"operation": "unknown", "operand1": 1, "operand2": 2},
+            {"operation": "power", "operand1": 2, "operand2": 10}
+        ]})
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["created"] == 2
+        assert data["failed"] == 2
+        assert [item["index"] for item in data["results"]] == [0, 1, 2, 3]
+        assert data["results"][0]["calculation"]["result"] == 3
+        assert "Cannot divide by zero" in data["results"][1]["error"]
+        assert data["results"][2]["calculation"] is None
+        assert data["results"][3]["calculation"]["result"] == 1024
+
+        stored = authenticated_client.get("/api/calculations/").json()
+        assert sorted(c["id"] for c in stored) == sorted(
+            item["calculation"]["id"] for item in data["results"] if item["calculation"]
+        )
+        assert find_inconsistencies(db) == []
+
+    def test_batch_power_errors(self, authenticated_client):
+        """Test power rows the scalar path cannot represent are reported per item"""
+        response = authenticated_client.post("/api/calculations/batch", json={"items": [
+            {"operation": "power", "operand1": 0, "operand2": -1},
+            {"operation": "power", "operand1": -8, "operand2": 0.5},
+            {"operation": "power", "operand1": 10, "operand2": 400},
+            {"operation": "modulo", "operand1": -7, "operand2": 3}
+        ]})
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["created"] == 1
+        assert [item["error"] is not None for item in data["results"]] == [True, True, True, False]
+        assert data["results"][3]["calculation"]["result"] == 2
+
+    def test_batch_all_or_nothing(self, authenticated_client):
+        """Test one invalid item rejects the whole batch"""
+        response = authenticated_client.post("/api/calculations/batch", json={
+            "all_or_nothing": True,
+            "items": [
+                {"operation": "add", "operand1": 1, "operand2": 2},
+                {"operation": "modulo", "operand1": 1, "operand2": 0}
+            ]
+        })
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"][0]["index"] == 1
+        assert authenticated_client.get("/api/calculations/").json() == []
+
+    def test_batch_size_limit(self, authenticated_client, monkeypatch):
+        """Test batches above the configured size are rejected"""
+        monkeypatch.setattr(calculations_router.settings, "calculation_batch_max_size", 2)
+        response = authenticated_client.post("/api/calculations/batch", json={"items": [
+            {"operation": "add", "operand1": i, "operand2": 1} for i in range(3)
+        ]})
+        assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
 class TestUserEndpoints:
     """Test user profile endpoints"""
 
@@ -235,3 +412,1190 @@ class TestUserEndpoints:
         assert data["calculations_by_operation"]["add"] == 2
         assert data["calculations_by_operation"]["multiply"] == 1
         assert data["most_used_operation"] == "add"
+        assert data["average_result"] == round((8 + 30 + 20) / 3, 2)
+        assert len(data["recent_calculations"]) == 3
+
+    def test_get_user_statistics_empty(self, authenticated_client):
+        """Test statistics for a user without calculations"""
+        response = authenticated_client.get("/api/users/me/statistics")
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["total_calculations"] == 0
+        assert data["calculations_by_operation"] == {}
+        assert data["average_result"] == 0.0
+        assert data["most_used_operation"] is None
+        assert data["recent_calculations"] == []
+
+
+class TestCalculationExport:
+    """Test the streaming history export"""
+
+    def create_history(self, client, count=3):
+        items = [{"operation": "multiply", "operand1": i, "operand2": 1.5} for i in range(count)]
+        client.post("/api/calculations/batch", json={"items": items})
+        # The list endpoint is newest first, exports are oldest first
+        return list(reversed(client.get("/api/calculations/").json()))
+
+    def test_export_ndjson(self, authenticated_client):
+        """Test NDJSON rows match the list endpoint's representation"""
+        listed = self.create_history(authenticated_client)
+        response = authenticated_client.get("/api/calculations/export")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert 'filename="calculations.ndjson"' in response.headers["content-disposition"]
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert rows == listed
+
+    def test_export_csv_gzip(self, authenticated_client):
+        """Test the CSV export, compressed"""
+        listed = self.create_history(authenticated_client)
+        response = authenticated_client.get("/api/calculations/export?format=csv&gzip=true")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"] == "application/gzip"
+        assert 'filename="calculations.csv.gz"' in response.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode())))
+        assert [int(row["id"]) for row in rows] == [c["id"] for c in listed]
+        assert [float(row["result"]) for row in rows] == [c["result"] for c in listed]
+        assert rows[0]["operation"] == "multiply"
+
+    def test_export_time_range(self, authenticated_client, db):
+        """Test since is inclusive and until is exclusive"""
+        listed = self.create_history(authenticated_client)
+        for day, calculation in enumerate(listed, start=1):
+            db.query(Calculation).filter(Calculation.id == calculation["id"]).update(
+                {"created_at": datetime(2024, 1, day)}
+            )
+        db.commit()
+        response = authenticated_client.get(
+            "/api/calculations/export?since=2024-01-02T00:00:00&until=2024-01-03T00:00:00Z"
+        )
+        assert [json.loads(line)["id"] for line in response.text.splitlines()] == [listed[1]["id"]]
+
+    def test_export_rejects_unknown_format(self, authenticated_client):
+        """Test formats other than ndjson and csv are rejected"""
+        response = authenticated_client.get("/api/calculations/export?format=xml")
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc to read RSS")
+    def test_export_memory_is_flat(self, db):
+        """Test peak RSS stays flat while streaming a million-row export"""
+        user = User(username="bulk", email="bulk@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        # Generate the rows inside SQLite, building a million dicts in Python takes far longer
+        db.execute(text(
+            "INSERT INTO calculations (user_id, operation, operand1, operand2, result, created_at) "
+            "WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < 999999) "
+            "SELECT :user_id, 'ADD', i, 1.0, i + 1.0, datetime('2024-01-01', '+' || i || ' seconds') FROM seq"
+        ), {"user_id": user.id})
+        db.commit()
+
+        page_size = resource.getpagesize()
+
+        def rss():
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * page_size
+
+        baseline = None
+        peak = 0
+        exported = 0
+        for chunk in iter_export(db.execute(export_statement(user.id)), "ndjson"):
+            exported += chunk.count(b"\n")
+            # Measure growth after the first cursor batch has been allocated
+            if baseline is None and exported >= 10_000:
+                baseline = rss()
+            elif baseline is not None:
+                peak = max(peak, rss())
+        assert exported == 1_000_000
+        assert peak - baseline < 16 * 1024 * 1024
+
+
+class TestCalculationImport:
+    """Test bulk imports from uploaded files"""
+
+    def import_file(self, client, filename, content, **params):
+        response = client.post("/api/calculations/import", params=params, files={"file": (filename, content)})
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        # Background tasks finish before the test client returns
+        return client.get(f"/api/calculations/import/{response.json()['id']}").json()
+
+    def test_import_ndjson_reports_bad_lines(self, authenticated_client, db):
+        """Test valid lines are stored and bad lines are reported by line number"""
+        content = "\n".join([
+            json.dumps({"operation": "add", "operand1": 1, "operand2": 2}),
+            "{not json",
+            "",
+            json.dumps({"operation": "divide", "operand1": 1, "operand2": 0}),
+            json.dumps({"operation": "power", "operand1": 2, "operand2": 3}),
+        ])
+        job = self.import_file(authenticated_client, "history.ndjson", content)
+        assert job["status"] == "completed"
+        assert job["created"] == 2
+        assert job["failed"] == 2
+        assert [error["line"] for error in job["errors"]] == [2, 4]
+        assert job["errors"][0]["error"] == "Invalid JSON"
+        assert job["bytes_read"] == job["total_bytes"] == len(content)
+        results = sorted(c["result"] for c in authenticated_client.get("/api/calculations/").json())
+        assert results == [3, 8]
+        assert find_inconsistencies(db) == []
+
+    def test_import_csv_in_chunks(self, authenticated_client, db, monkeypatch):
+        """Test a CSV import spanning several chunks, with a capped error report"""
+        monkeypatch.setattr(imports.settings, "import_chunk_size", 2)
+        monkeypatch.setattr(imports.settings, "import_max_errors", 1)
+        lines = ["operation,operand1,operand2"]
+        lines += [f"multiply,{i},2" for i in range(5)]
+        lines += ["modulo,1,0", "unknown,1,2"]
+        job = self.import_file(authenticated_client, "history.csv", "\n".join(lines))
+        assert job["status"] == "completed"
+        assert job["lines_processed"] == 7
+        assert job["created"] == 5
+        assert job["failed"] == 2
+        assert job["errors"] == [{"line": 7, "error": "Value error, Cannot perform modulo by zero"}]
+        assert find_inconsistencies(db) == []
+
+    def test_import_gzipped_export(self, authenticated_client):
+        """Test a compressed export can be imported back"""
+        authenticated_client.post("/api/calculations/batch", json={"items": [
+            {"operation": "subtract", "operand1": i, "operand2": 1} for i in range(4)
+        ]})
+        exported = authenticated_client.get("/api/calculations/export?format=csv&gzip=true").content
+        job = self.import_file(authenticated_client, "calculations.csv.gz", exported)
+        assert job["created"] == 4
+        assert len(authenticated_client.get("/api/calculations/").json()) == 8
+
+    def test_import_format_and_job_lookup(self, authenticated_client):
+        """Test unknown file types and job ids are rejected"""
+        response = authenticated_client.post(
+            "/api/calculations/import", files={"file": ("history.txt", "operation,operand1,operand2")}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        job = self.import_file(authenticated_client, "history.txt", "operation,operand1,operand2\nadd,1,1", format="csv")
+        assert job["created"] == 1
+        response = authenticated_client.get("/api/calculations/import/does-not-exist")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_import_job_is_stored_for_every_worker(self, authenticated_client, client, db):
+        """Test job progress is read from the database and only by its owner"""
+        job = self.import_file(authenticated_client, "history.csv", "operation,operand1,operand2\nadd,1,1\nadd,x,1")
+        row = db.get(ImportJobState, job["id"])
+        assert (row.status, row.created, row.failed, row.lines_processed) == ("completed", 1, 1, 2)
+        assert row.errors == job["errors"]
+        # Another worker has nothing in memory; the row is all it needs
+        db.query(ImportJobState).filter_by(id=job["id"]).update({"status": "running", "created": 0})
+        db.commit()
+        polled = authenticated_client.get(f"/api/calculations/import/{job['id']}").json()
+        assert (polled["status"], polled["created"]) == ("running", 0)
+
+        client.post("/api/auth/register", json={"username": "other", "email": "other@example.com", "password": "Password123!"})
+        token = client.post("/api/auth/login", json={"username": "other", "password": "Password123!"}).json()["access_token"]
+        response = client.get(f"/api/calculations/import/{job['id']}", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestStatisticsRollup:
+    """Test that the statistics rollup tracks every write"""
+
+    def test_rollup_follows_create_update_delete(self, authenticated_client, db):
+        """Test rollup stays consistent through the calculation lifecycle"""
+        first = authenticated_client.post("/api/calculations/", json={
+            "operation": "add",
+            "operand1": 5,
+            "operand2": 3
+        }).json()
+        second = authenticated_client.post("/api/calculations/", json={
+            "operation": "add",
+            "operand1": 1,
+            "operand2": 1
+        }).json()
+        authenticated_client.put(f"/api/calculations/{first['id']}", json={
+            "operation": "multiply"
+        })
+        authenticated_client.delete(f"/api/calculations/{second['id']}")
+
+        assert find_inconsistencies(db) == []
+        data = authenticated_client.get("/api/users/me/statistics").json()
+        assert data["total_calculations"] == 1
+        assert data["calculations_by_operation"] == {"multiply": 1}
+        assert data["average_result"] == 15
+
+    def test_rollup_follows_batches_and_edits(self, authenticated_client, db):
+        """Test batch upserts and same-operation edits keep the rollup consistent"""
+        items = [{"operation": operation, "operand1": i, "operand2": 2} for i, operation in enumerate(["add", "multiply", "add"] * 2)]
+        for _ in range(2):
+            response = authenticated_client.post("/api/calculations/batch", json={"items": items})
+            results = response.json()["results"]
+            assert [result["calculation"]["operand1"] for result in results] == list(range(6))
+        calculation_id = results[0]["calculation"]["id"]
+        authenticated_client.put(f"/api/calculations/{calculation_id}", json={"operand2": 10})
+
+        assert find_inconsistencies(db) == []
+        data = authenticated_client.get("/api/users/me/statistics").json()
+        assert data["calculations_by_operation"] == {"add": 8, "multiply": 4}
+
+    def test_rollup_removed_with_account(self, authenticated_client, db):
+        """Test deleting an account removes its rollup rows"""
+        authenticated_client.post("/api/calculations/", json={
+            "operation": "add",
+            "operand1": 5,
+            "operand2": 3
+        })
+        response = authenticated_client.delete("/api/users/me")
+        assert response.status_code == status.HTTP_200_OK
+        assert db.query(UserCalculationStats).count() == 0
+
+    def test_consistency_check_detects_and_repairs_drift(self, authenticated_client, db):
+        """Test the consistency check reports drift and rebuild fixes it"""
+        authenticated_client.post("/api/calculations/", json={
+            "operation": "add",
+            "operand1": 5,
+            "operand2": 3
+        })
+        db.query(UserCalculationStats).update({"count": 7})
+        db.commit()
+
+        problems = find_inconsistencies(db)
+        assert len(problems) == 1
+        assert problems[0]["stored"]["count"] == 7
+        assert problems[0]["expected"]["count"] == 1
+
+        rebuild(db)
+        db.commit()
+        assert find_inconsistencies(db) == []
+
+
+def full_scans(connection, statement, parameters):
+    """Return the query plan lines that read a whole table"""
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("SET enable_seqscan = off")
+        plan = [row[0] for row in connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)]
+        return [line for line in plan if "Seq Scan" in line]
+    plan = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+    # "SCAN <table>" without an index is a full table scan in SQLite's planner output
+    return [line for line in plan if line.startswith("SCAN") and "INDEX" not in line]
+
+
+class FakeRedis:
+    """The subset of redis.Redis the response cache uses, storing bytes like the real client"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def flushdb(self):
+        self.data.clear()
+        return True
+
+
+class TestResponseCache:
+    """Test cached read responses, ETag revalidation and invalidation on writes"""
+
+    def create(self, client, operand1=5):
+        return client.post("/api/calculations/", json={
+            "operation": "add",
+            "operand1": operand1,
+            "operand2": 3
+        }).json()
+
+    def calculation_selects(self, statements):
+        return [statement for statement, _ in statements if "FROM calculations" in statement]
+
+    def test_repeated_reads_skip_database(self, authenticated_client, sql_statements):
+        """Test repeated list, item and statistics reads are served from the cache"""
+        calc = self.create(authenticated_client)
+        paths = ["/api/calculations/?limit=10", f"/api/calculations/{calc['id']}", "/api/users/me/statistics"]
+        first = [authenticated_client.get(path) for path in paths]
+
+        sql_statements.clear()
+        second = [authenticated_client.get(path) for path in paths]
+        assert sql_statements == []
+        for before, after in zip(first, second):
+            assert after.status_code == status.HTTP_200_OK
+            assert after.content == before.content
+            assert after.headers["ETag"] == before.headers["ETag"]
+            assert after.headers["Cache-Control"] == "private, no-cache"
+
+    def test_cursor_header_is_cached(self, authenticated_client):
+        """Test a cached page still carries its X-Next-Cursor header"""
+        for i in range(3):
+            self.create(authenticated_client, i)
+        first = authenticated_client.get("/api/calculations/?limit=2")
+        second = authenticated_client.get("/api/calculations/?limit=2")
+        assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+
+    def test_if_none_match(self, authenticated_client):
+        """Test a matching If-None-Match gets an empty 304"""
+        self.create(authenticated_client)
+        response = authenticated_client.get("/api/calculations/")
+        etag = response.headers["ETag"]
+
+        revalidated = authenticated_client.get("/api/calculations/", headers={"If-None-Match": etag})
+        assert revalidated.status_code == status.HTTP_304_NOT_MODIFIED
+        assert revalidated.content == b""
+        assert revalidated.headers["ETag"] == etag
+
+        stale = authenticated_client.get("/api/calculations/", headers={"If-None-Match": '"stale"'})
+        assert stale.status_code == status.HTTP_200_OK
+
+    def test_writes_invalidate(self, authenticated_client):
+        """Test create, update and delete are visible on the next read"""
+        calc = self.create(authenticated_client)
+        assert len(authenticated_client.get("/api/calculations/").json()) == 1
+
+        self.create(authenticated_client)
+        assert len(authenticated_client.get("/api/calculations/").json()) == 2
+        assert authenticated_client.get("/api/users/me/statistics").json()["total_calculations"] == 2
+
+        authenticated_client.get(f"/api/calculations/{calc['id']}")
+        authenticated_client.put(f"/api/calculations/{calc['id']}", json={"operand1": 10})
+        assert authenticated_client.get(f"/api/calculations/{calc['id']}").json()["result"] == 13.0
+
+        authenticated_client.delete(f"/api/calculations/{calc['id']}")
+        response = authenticated_client.get(f"/api/calculations/{calc['id']}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert len(authenticated_client.get("/api/calculations/").json()) == 1
+
+    def test_create_keeps_cached_items(self, authenticated_client, sql_statements):
+        """Test adding a calculation does not evict other cached calculations"""
+        calc = self.create(authenticated_client)
+        authenticated_client.get(f"/api/calculations/{calc['id']}")
+        self.create(authenticated_client)
+
+        sql_statements.clear()
+        authenticated_client.get(f"/api/calculations/{calc['id']}")
+        assert self.calculation_selects(sql_statements) == []
+
+    def test_cache_is_per_user(self, authenticated_client, client):
+        """Test one user's cached responses are never served to another"""
+        calc = self.create(authenticated_client)
+        authenticated_client.get(f"/api/calculations/{calc['id']}")
+        authenticated_client.get("/api/calculations/")
+
+        client.post("/api/auth/register", json={
+            "username": "otheruser",
+            "email": "other@example.com",
+            "password": "otherpassword123"
+        })
+        token = client.post("/api/auth/login", json={
+            "username": "otheruser",
+            "password": "otherpassword123"
+        }).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get(f"/api/calculations/{calc['id']}", headers=headers).status_code == status.HTTP_404_NOT_FOUND
+        assert client.get("/api/calculations/", headers=headers).json() == []
+
+    def test_write_elsewhere_is_not_served_stale(self, authenticated_client, db):
+        """Test a version bumped by another process (its cache untouched) is a miss once the snapshot expires"""
+        first = authenticated_client.get("/api/calculations/")
+        assert first.json() == []
+        user = db.query(User).one()
+        db.add(Calculation(user_id=user.id, operation="add", operand1=1, operand2=2, result=3))
+        bump_history_version(db, user.id)
+        db.commit()
+        user_cache.clear()
+
+        second = authenticated_client.get("/api/calculations/")
+        assert len(second.json()) == 1
+        assert second.headers["ETag"] != first.headers["ETag"]
+        again = authenticated_client.get("/api/calculations/", headers={"If-None-Match": second.headers["ETag"]})
+        assert again.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_redis_backend(self, authenticated_client, monkeypatch):
+        """Test the cache works against a redis-style backend returning bytes"""
+        backend = FakeRedis()
+        monkeypatch.setattr(response_cache, "backend", backend)
+        self.create(authenticated_client)
+        first = authenticated_client.get("/api/calculations/")
+        assert backend.data
+        second = authenticated_client.get("/api/calculations/", headers={"If-None-Match": first.headers["ETag"]})
+        assert second.status_code == status.HTTP_304_NOT_MODIFIED
+        self.create(authenticated_client)
+        assert len(authenticated_client.get("/api/calculations/").json()) == 2
+
+
+class TestHistoryVersion:
+    """Test the per-user history version and conditional GETs derived from it"""
+
+    def history_version(self, db):
+        db.expire_all()
+        return db.query(User.history_version).filter(User.username == "testuser").scalar()
+
+    def test_writes_bump_version(self, authenticated_client, db):
+        """Test every kind of write bumps the version once per commit"""
+        assert self.history_version(db) == 0
+        calc_id = authenticated_client.post("/api/calculations/", json={
+            "operation": "add", "operand1": 1, "operand2": 2
+        }).json()["id"]
+        authenticated_client.post("/api/calculations/batch", json={"items": [
+            {"operation": "add", "operand1": 1, "operand2": 2}
+        ]})
+        authenticated_client.put(f"/api/calculations/{calc_id}", json={"operand1": 5})
+        authenticated_client.delete(f"/api/calculations/{calc_id}")
+        assert self.history_version(db) == 4
+
+        authenticated_client.post("/api/calculations/", json={"operation": "divide", "operand1": 1, "operand2": 0})
+        authenticated_client.get("/api/calculations/")
+        assert self.history_version(db) == 4
+
+    def test_not_modified_runs_no_query(self, authenticated_client, sql_statements, monkeypatch):
+        """Test a matching If-None-Match is answered without the cache or the database"""
+        monkeypatch.setattr(response_cache, "ttl_seconds", 0)
+        authenticated_client.post("/api/calculations/", json={"operation": "add", "operand1": 1, "operand2": 2})
+        etag = authenticated_client.get("/api/calculations/").headers["ETag"]
+        assert etag.startswith('W/"')
+
+        sql_statements.clear()
+        for path in ["/api/calculations/", "/api/calculations/?limit=5", "/api/users/me/statistics"]:
+            response = authenticated_client.get(path, headers={"If-None-Match": etag})
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+            assert response.headers["ETag"] == etag
+        assert sql_statements == []
+
+    def test_not_modified_only_for_that_calculation(self, authenticated_client):
+        """Test a calculation's ETag does not answer 304 for another, a deleted or a wildcard read"""
+        first, second = [authenticated_client.post("/api/calculations/", json={
+            "operation": "add", "operand1": i, "operand2": 2
+        }).json()["id"] for i in range(2)]
+        etag = authenticated_client.get(f"/api/calculations/{first}").headers["ETag"]
+        assert authenticated_client.get(f"/api/calculations/{first}", headers={"If-None-Match": etag}).status_code == 304
+        assert authenticated_client.get(f"/api/calculations/{second}", headers={"If-None-Match": etag}).status_code == 200
+        assert authenticated_client.get("/api/calculations/999999", headers={"If-None-Match": etag}).status_code == 404
+        assert authenticated_client.get("/api/calculations/999999", headers={"If-None-Match": "*"}).status_code == 404
+
+        authenticated_client.delete(f"/api/calculations/{first}")
+        response = authenticated_client.get(f"/api/calculations/{first}", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_write_changes_etag(self, authenticated_client):
+        """Test an ETag from before a write gets the new content"""
+        authenticated_client.post("/api/calculations/", json={"operation": "add", "operand1": 1, "operand2": 2})
+        etag = authenticated_client.get("/api/users/me/statistics").headers["ETag"]
+        authenticated_client.put("/api/users/me", json={"username": "renamed"})
+        response = authenticated_client.get("/api/users/me/statistics", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        authenticated_client.post("/api/calculations/", json={"operation": "add", "operand1": 2, "operand2": 2})
+        response = authenticated_client.get("/api/users/me/statistics", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["total_calculations"] == 2
+        assert response.headers["ETag"] != etag
+
+    def test_import_bumps_version(self, authenticated_client, db):
+        """Test each committed import chunk bumps the version"""
+        authenticated_client.post(
+            "/api/calculations/import",
+            files={"file": ("history.csv", "operation,operand1,operand2\nadd,1,1\nadd,2,2\n")}
+        )
+        assert self.history_version(db) == 1
+
+
+class TestFastJsonResponses:
+    """Test the column-tuple/orjson path renders exactly what the default path does"""
+
+    OPERANDS = [(1e16, 1), (1e-05, 0), (-0.0, 0), (0.1, 0.2), (123.456, 1e-4), (2.5e-300, 0), (9999999999999998.0, 1)]
+
+    def seed(self, client):
+        for operand1, operand2 in self.OPERANDS:
+            for operation in ("add", "multiply"):
+                client.post("/api/calculations/", json={
+                    "operation": operation,
+                    "operand1": operand1,
+                    "operand2": operand2
+                })
+
+    def render_both(self, client, paths, monkeypatch):
+        monkeypatch.setattr(response_cache, "ttl_seconds", 0)
+        rendered = {}
+        for fast in (False, True):
+            monkeypatch.setattr(get_settings(), "fast_json_responses", fast)
+            rendered[fast] = [client.get(path) for path in paths]
+        for default, fast in zip(rendered[False], rendered[True]):
+            assert fast.status_code == default.status_code == status.HTTP_200_OK
+            assert fast.content == default.content
+            assert fast.headers.get("X-Next-Cursor") == default.headers.get("X-Next-Cursor")
+        return rendered[True]
+
+    def test_byte_identical(self, authenticated_client, monkeypatch):
+        """Test lists, cursor pages and statistics match byte for byte, edge floats included"""
+        self.seed(authenticated_client)
+        first_page = authenticated_client.get("/api/calculations/?limit=4")
+        paths = [
+            "/api/calculations/",
+            "/api/calculations/?limit=4",
+            f"/api/calculations/?limit=4&cursor={first_page.headers['X-Next-Cursor']}",
+            "/api/users/me/statistics",
+        ]
+        responses = self.render_both(authenticated_client, paths, monkeypatch)
+        assert b"1e+16" in responses[0].content and b"1e-05" in responses[0].content
+
+    def test_byte_identical_async(self, authenticated_async_client, monkeypatch):
+        """Test the async routers render the same bytes on both paths"""
+        self.seed(authenticated_async_client)
+        self.render_both(authenticated_async_client, ["/api/calculations/", "/api/users/me/statistics"], monkeypatch)
+
+
+class TestEventStream:
+    """Test /api/events pushes a snapshot and then each committed change"""
+
+    def parse(self, body):
+        messages = []
+        for block in body.strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+            if fields:
+                messages.append((fields["event"], json.loads(fields["data"])))
+        return messages
+
+    def stream(self, client, changes):
+        """Open a stream, apply changes while it is open, then end it with a resync"""
+        user_id = client.get("/api/users/me").json()["id"]
+        responses = []
+        reader = threading.Thread(target=lambda: responses.append(client.get("/api/events")), daemon=True)
+        reader.start()
+        deadline = time.monotonic() + 10
+        while event_hub.metrics()["streams"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        changes(client)
+        publish(user_id, resync_event(10 ** 6))
+        reader.join(10)
+        response = responses[0]
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert event_hub.metrics()["streams"] == 0
+        return self.parse(response.text)
+
+    def changes(self, client):
+        calc_id = client.post("/api/calculations/", json={"operation": "add", "operand1": 2, "operand2": 3}).json()["id"]
+        client.put(f"/api/calculations/{calc_id}", json={"operation": "multiply"})
+        client.delete(f"/api/calculations/{calc_id}")
+
+    def check(self, messages):
+        assert [kind for kind, _ in messages] == ["snapshot", "created", "updated", "deleted", "resync"]
+        snapshot, created, updated, deleted, _ = [data for _, data in messages]
+        assert snapshot == {"version": 1, "statistics": {"add": {"count": 1, "result_sum": 2.0}}}
+        assert created["version"] == 2
+        assert created["calculations"][0]["result"] == 5.0
+        assert created["statistics"] == {"add": {"count": 1, "result_sum": 5.0}}
+        assert updated["calculations"][0]["result"] == 6.0
+        assert updated["statistics"] == {
+            "add": {"count": -1, "result_sum": -5.0},
+            "multiply": {"count": 1, "result_sum": 6.0},
+        }
+        assert deleted == {
+            "version": 4,
+            "statistics": {"multiply": {"count": -1, "result_sum": -6.0}},
+            "ids": [created["calculations"][0]["id"]],
+        }
+
+    def test_stream(self, authenticated_client):
+        """Test the snapshot, then created/updated/deleted events with statistics deltas"""
+        authenticated_client.post("/api/calculations/", json={"operation": "add", "operand1": 1, "operand2": 1})
+        self.check(self.stream(authenticated_client, self.changes))
+
+    def test_stream_async(self, authenticated_async_client):
+        """Test the async router streams the same events"""
+        authenticated_async_client.post("/api/calculations/", json={"operation": "add", "operand1": 1, "operand2": 1})
+        self.check(self.stream(authenticated_async_client, self.changes))
+
+    def test_batch_and_import(self, authenticated_client):
+        """Test a batch is one created event and an import chunk is a resync"""
+        def changes(client):
+            client.post("/api/calculations/batch", json={"items": [
+                {"operation": "add", "operand1": 1, "operand2": 2},
+                {"operation": "divide", "operand1": 1, "operand2": 0},
+                {"operation": "add", "operand1": 3, "operand2": 4},
+            ]})
+            client.post(
+                "/api/calculations/import",
+                files={"file": ("history.csv", "operation,operand1,operand2\nadd,1,1\n")}
+            )
+
+        messages = self.stream(authenticated_client, changes)
+        assert [kind for kind, _ in messages] == ["snapshot", "created", "resync"]
+        created = messages[1][1]
+        assert [calculation["result"] for calculation in created["calculations"]] == [3.0, 7.0]
+        assert created["statistics"] == {"add": {"count": 2, "result_sum": 10.0}}
+        assert messages[2][1] == {"version": 2}
+
+    @pytest.mark.parametrize("client_fixture", ["authenticated_client", "authenticated_async_client"])
+    def test_password_change_ends_stream(self, request, client_fixture, test_user_data):
+        """Test a stream opened with a token that a password change revokes is closed"""
+        def changes(client):
+            client.post("/api/users/me/change-password", json={
+                "current_password": test_user_data["password"], "new_password": "newpassword456"
+            })
+
+        messages = self.stream(request.getfixturevalue(client_fixture), changes)
+        assert [kind for kind, _ in messages] == ["snapshot", "revoked"]
+
+    def test_requires_authentication(self, client):
+        """Test the stream rejects anonymous clients"""
+        assert client.get("/api/events").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestInstrumentation:
+    """Test Server-Timing, the Prometheus metrics and the per-request query limit"""
+
+    def server_timing(self, response):
+        return dict(metric.split(";", 1) for metric in response.headers["Server-Timing"].split(", "))
+
+    def test_server_timing(self, authenticated_client):
+        """Test responses report DB time and statement count, JWT time and the total"""
+        response = authenticated_client.get("/api/calculations/")
+        timing = self.server_timing(response)
+        assert set(timing) == {"db", "jwt", "total"}
+        assert timing["db"].endswith('desc="queries=1"')
+
+        response = authenticated_client.post("/api/auth/login", json={"username": "testuser", "password": "testpass123"})
+        assert "bcrypt" in self.server_timing(response)
+
+    def test_prometheus_metrics(self, authenticated_client):
+        """Test /metrics has one series per route template with statuses and query counts"""
+        instrumentation.request_metrics.clear()
+        for calculation_id in (123, 456):
+            authenticated_client.get(f"/api/calculations/{calculation_id}")
+        authenticated_client.get("/api/calculations/")
+
+        response = authenticated_client.get("/metrics")
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        labels = 'method="GET",route="/api/calculations/{calculation_id}"'
+        assert f'http_requests_total{{{labels},status="404"}} 2' in body
+        assert f"http_request_duration_seconds_count{{{labels}}} 2" in body
+        assert 'db_queries_per_request_bucket{method="GET",route="/api/calculations/",le="1"} 1' in body
+        assert "/api/calculations/123" not in body
+
+    def test_query_limit(self, authenticated_client, monkeypatch):
+        """Test a request that runs more statements than allowed fails at the extra one"""
+        monkeypatch.setattr(instrumentation.settings, "max_queries_per_request", 1)
+        assert authenticated_client.get("/api/calculations/").status_code == status.HTTP_200_OK
+
+        monkeypatch.setitem(instrumentation.query_limits, "GET /api/users/me/statistics", 0)
+        with pytest.raises(instrumentation.QueryLimitExceeded, match="GET /api/users/me/statistics"):
+            authenticated_client.get("/api/users/me/statistics")
+
+
+class TestQueryBudgets:
+    """Test the statement budgets in tests/query_budgets.json and the hot endpoints' exact counts"""
+
+    # Statements per request with the user already cached
+    HOT_ENDPOINT_QUERIES = {
+        "create": 3, "batch": 3, "list": 1, "get": 1, "update": 4, "delete": 3, "statistics": 2,
+    }
+
+    def queries(self, client, method, url, **kwargs):
+        # Load the user into the cache first; writes invalidate it
+        client.get("/api/users/me")
+        response = client.request(method, url, **kwargs)
+        assert response.status_code < 400
+        return int(re.search(r'queries=(\d+)', response.headers["Server-Timing"]).group(1))
+
+    def measure(self, client):
+        item = {"operation": "add", "operand1": 1, "operand2": 2}
+        created = client.post("/api/calculations/", json=item).json()["id"]
+        url = f"/api/calculations/{created}"
+        return {
+            "create": self.queries(client, "POST", "/api/calculations/", json=item),
+            "batch": self.queries(client, "POST", "/api/calculations/batch", json={"items": [item] * 5}),
+            "list": self.queries(client, "GET", "/api/calculations/"),
+            "get": self.queries(client, "GET", url),
+            "update": self.queries(client, "PUT", url, json={"operand1": 5}),
+            "statistics": self.queries(client, "GET", "/api/users/me/statistics"),
+            "delete": self.queries(client, "DELETE", url),
+        }
+
+    def test_every_route_has_a_budget(self, query_budgets):
+        """Test each /api route is listed in the budget file"""
+        routes = {
+            f"{method} {route.path}"
+            for route in app.routes if isinstance(route, APIRoute) and route.path.startswith("/api")
+            for method in route.methods
+        }
+        assert routes == set(query_budgets)
+
+    def test_hot_endpoints(self, authenticated_client):
+        """Test the hot endpoints run exactly their expected statements"""
+        assert self.measure(authenticated_client) == self.HOT_ENDPOINT_QUERIES
+
+    def test_hot_endpoints_async(self, authenticated_async_client):
+        """Test the async path runs the same statements as the sync one"""
+        assert self.measure(authenticated_async_client) == self.HOT_ENDPOINT_QUERIES
+
+
+class TestQueryPlans:
+    """Run the SQL issued by the routers through EXPLAIN and reject full scans"""
+
+    def seed_history(self, client, count=30):
+        operations = ["add", "subtract", "multiply", "divide", "power", "modulo"]
+        ids = []
+        for i in range(count):
+            response = client.post("/api/calculations/", json={
+                "operation": operations[i % len(operations)],
+                "operand1": i + 1,
+                "operand2": 2
+            })
+            ids.append(response.json()["id"])
+        return ids
+
+    def test_router_queries_use_indexes(self, authenticated_client, db, sql_statements):
+        """Test every calculations/statistics query is served by an index"""
+        # A second user so per-user filters actually have rows to skip
+        authenticated_client.post("/api/auth/register", json={
+            "username": "otheruser",
+            "email": "other@example.com",
+            "password": "otherpassword123"
+        })
+        ids = self.seed_history(authenticated_client)
+
+        sql_statements.clear()
+        first_page = authenticated_client.get("/api/calculations/?limit=10")
+        authenticated_client.get("/api/calculations/?skip=10&limit=10")
+        authenticated_client.get(f"/api/calculations/?limit=10&cursor={first_page.headers['X-Next-Cursor']}")
+        authenticated_client.get(f"/api/calculations/{ids[0]}")
+        authenticated_client.put(f"/api/calculations/{ids[1]}", json={"operand1": 10})
+        authenticated_client.delete(f"/api/calculations/{ids[2]}")
+        authenticated_client.get("/api/users/me/statistics")
+        authenticated_client.delete("/api/users/me")
+        captured = [
+            (statement, parameters) for statement, parameters in sql_statements
+            if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))
+        ]
+        assert captured
+
+        with db.get_bind().connect() as connection:
+            for statement, parameters in captured:
+                assert full_scans(connection, statement, parameters) == [], statement
+
+    def test_rollup_recompute_uses_index(self, authenticated_client, db, sql_statements):
+        """Test the consistency check's per-user recompute is served by an index"""
+        self.seed_history(authenticated_client)
+        user_id = db.query(User.id).filter(User.username == "testuser").scalar()
+
+        sql_statements.clear()
+        recompute(db, user_id)
+        statement, parameters = sql_statements[-1]
+        with db.get_bind().connect() as connection:
+            assert full_scans(connection, statement, parameters) == []
+
+
+class TestTokenAuthentication:
+    """Test id/version tokens and the cached authentication path"""
+
+    def test_cached_user_skips_user_query(self, authenticated_client, sql_statements):
+        """Test an authenticated read runs no query against the users table"""
+        calc_id = authenticated_client.post("/api/calculations/", json={
+            "operation": "add",
+            "operand1": 5,
+            "operand2": 3
+        }).json()["id"]
+        # Writes drop the snapshot (its history version changed), the next request reloads it
+        authenticated_client.get("/api/users/me")
+
+        sql_statements.clear()
+        response = authenticated_client.get(f"/api/calculations/{calc_id}")
+        assert response.status_code == status.HTTP_200_OK
+        assert len(sql_statements) == 1
+        assert "FROM users" not in sql_statements[0][0]
+
+    def test_legacy_username_token(self, authenticated_client, test_user_data):
+        """Test tokens carrying only the username are still accepted"""
+        token = create_access_token(data={"sub": test_user_data["username"]})
+        authenticated_client.headers = {"Authorization": f"Bearer {token}"}
+        response = authenticated_client.get("/api/users/me")
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_password_change_revokes_tokens(self, authenticated_client, test_user_data):
+        """Test a password change invalidates previously issued tokens"""
+        authenticated_client.get("/api/calculations/")
+        response = authenticated_client.post("/api/users/me/change-password", json={
+            "current_password": test_user_data["password"],
+            "new_password": "newpassword123"
+        })
+        assert response.status_code == status.HTTP_200_OK
+        assert authenticated_client.get("/api/calculations/").status_code == status.HTTP_401_UNAUTHORIZED
+
+        token = authenticated_client.post("/api/auth/login", json={
+            "username": test_user_data["username"],
+            "password": "newpassword123"
+        }).json()["access_token"]
+        authenticated_client.headers = {"Authorization": f"Bearer {token}"}
+        assert authenticated_client.get("/api/calculations/").status_code == status.HTTP_200_OK
+
+    def test_revocation_survives_concurrent_reload(self, authenticated_client, test_user_data, monkeypatch):
+        """Test a request caching the old token version before the commit does not keep the token alive"""
+        from app.auth import CachedUser, revoke_user_tokens
+        from app.routers import users as users_router
+
+        def revoke_then_reload(user):
+            stale = CachedUser.from_user(user)
+            revoke_user_tokens(user)
+            # Another request on this worker loads the still-committed row and caches it
+            user_cache.put(stale)
+
+        monkeypatch.setattr(users_router, "revoke_user_tokens", revoke_then_reload)
+        response = authenticated_client.post("/api/users/me/change-password", json={
+            "current_password": test_user_data["password"],
+            "new_password": "newpassword123"
+        })
+        assert response.status_code == status.HTTP_200_OK
+        assert authenticated_client.get("/api/calculations/").status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_profile_update_refreshes_cached_user(self, authenticated_client):
+        """Test a renamed user keeps their session and sees the new name"""
+        authenticated_client.get("/api/users/me")
+        authenticated_client.put("/api/users/me", json={"username": "renameduser"})
+        response = authenticated_client.get("/api/users/me")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["username"] == "renameduser"
+
+    def test_deleted_account_token_rejected(self, authenticated_client):
+        """Test a deleted account's token no longer authenticates"""
+        authenticated_client.get("/api/users/me")
+        authenticated_client.delete("/api/users/me")
+        assert authenticated_client.get("/api/users/me").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestFrontend:
+    """Test the page and its assets are served from memory with long-lived caching"""
+
+    def test_repeat_load_reads_nothing_from_disk(self, client, monkeypatch):
+        """Test the page revalidates with a 304 and hashed assets are immutable and compressed"""
+        page = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert page.status_code == status.HTTP_200_OK
+        assert page.headers["Content-Encoding"] == "gzip"
+        assert page.headers["Cache-Control"] == "no-cache"
+        script = re.search(r'src="/static/(app\.[0-9a-f]{12}\.js)"', page.text).group(1)
+
+        def no_disk(*args, **kwargs):
+            raise AssertionError("read from disk")
+
+        monkeypatch.setattr(Path, "read_bytes", no_disk)
+        monkeypatch.setattr(Path, "read_text", no_disk)
+        again = client.get("/", headers={"If-None-Match": page.headers["ETag"]})
+        assert again.status_code == status.HTTP_304_NOT_MODIFIED
+        assert again.content == b""
+
+        asset = client.get(f"/static/{script}", headers={"Accept-Encoding": "gzip"})
+        assert asset.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+        assert asset.headers["Content-Encoding"] == "gzip"
+        assert asset.headers["Vary"] == "Accept-Encoding"
+        assert asset.headers["Content-Type"].startswith("text/javascript")
+
+    def test_unhashed_names_revalidate(self, client):
+        """Test the plain names still work but are not cached for good, and unknown files are 404"""
+        response = client.get("/static/styles.css", headers={"Accept-Encoding": "identity"})
+        assert response.status_code == status.HTTP_200_OK
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["Cache-Control"] == "no-cache"
+        assert client.get("/static/missing.css").status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestCompression:
+    """Test API responses are compressed on the wire"""
+
+    def create_history(self, client, count=60):
+        items = [{"operation": "multiply", "operand1": i, "operand2": 1.5} for i in range(count)]
+        client.post("/api/calculations/batch", json={"items": items})
+
+    def test_list_page_is_gzipped(self, authenticated_client):
+        """Test a large JSON page is sent gzipped, smaller on the wire, and timed"""
+        self.create_history(authenticated_client)
+        response = authenticated_client.get("/api/calculations/?limit=100", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert int(response.headers["Content-Length"]) == response.num_bytes_downloaded < len(response.content)
+        assert len(response.json()) == 60
+        assert "compress;dur=" in response.headers["Server-Timing"]
+
+    def test_streamed_export_is_compressed(self, authenticated_client):
+        """Test the NDJSON export decompresses to the same rows as without compression"""
+        self.create_history(authenticated_client)
+        plain = authenticated_client.get("/api/calculations/export", headers={"Accept-Encoding": "identity"})
+        compressed = authenticated_client.get("/api/calculations/export", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in plain.headers
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        assert "Content-Length" not in compressed.headers
+        assert compressed.content == plain.content
+        assert compressed.num_bytes_downloaded < plain.num_bytes_downloaded
+
+    def test_small_and_precompressed_responses_untouched(self, authenticated_client):
+        """Test small bodies and gzip=true exports are sent as they are"""
+        self.create_history(authenticated_client, count=3)
+        me = authenticated_client.get("/api/users/me", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in me.headers
+        export = authenticated_client.get("/api/calculations/export?gzip=true", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in export.headers
+        assert len(gzip.decompress(export.content).splitlines()) == 3
+
+
+class TestRateLimit:
+    """Test flooding clients get 429s before the handler runs"""
+
+    def test_login_flood_is_cut_off(self, client, test_user_data, sql_statements, monkeypatch):
+        """Test logins over the limit get 429 with Retry-After and run no query or bcrypt"""
+        monkeypatch.setattr(rate_limiter, "limits", {"POST /api/auth/login": RateLimit(2, 60)})
+        client.post("/api/auth/register", json=test_user_data)
+        credentials = {"username": test_user_data["username"], "password": test_user_data["password"]}
+        first = client.post("/api/auth/login", json=credentials)
+        assert first.status_code == status.HTTP_200_OK
+        assert first.headers["X-RateLimit-Limit"] == "2"
+        assert first.headers["X-RateLimit-Remaining"] == "1"
+        assert client.post("/api/auth/login", json=credentials).status_code == status.HTTP_200_OK
+
+        sql_statements.clear()
+        flooded = client.post("/api/auth/login", json=credentials)
+        assert flooded.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert flooded.headers["Retry-After"] == "30"
+        assert flooded.headers["X-RateLimit-Remaining"] == "0"
+        assert sql_statements == []
+        assert client.get("/metrics/rate-limit").json()["limited"] >= 1
+
+    def test_token_does_not_lift_the_login_limit(self, authenticated_client, test_user_data, monkeypatch):
+        """Test logins sending a valid token still count against the client's address"""
+        monkeypatch.setattr(rate_limiter, "limits", {"POST /api/auth/login": RateLimit(2, 60)})
+        credentials = {"username": test_user_data["username"], "password": "wrongpassword"}
+        responses = [authenticated_client.post("/api/auth/login", json=credentials) for _ in range(2)]
+        assert [response.status_code for response in responses] == [401, 401]
+        del authenticated_client.headers["Authorization"]
+        assert authenticated_client.post("/api/auth/login", json=credentials).status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    def test_calculations_are_limited_per_user(self, authenticated_client, monkeypatch):
+        """Test one user's flood does not use up another user's writes"""
+        monkeypatch.setattr(rate_limiter, "limits", {"POST /api/calculations/": RateLimit(2, 60)})
+        payload = {"operation": "add", "operand1": 1, "operand2": 2}
+        responses = [authenticated_client.post("/api/calculations/", json=payload) for _ in range(3)]
+        assert [response.status_code for response in responses] == [201, 201, 429]
+        assert authenticated_client.get("/api/calculations/").status_code == status.HTTP_200_OK
+
+        authenticated_client.post("/api/auth/register", json={
+            "username": "otheruser", "email": "other@example.com", "password": "otherpassword123"
+        })
+        token = authenticated_client.post("/api/auth/login", json={
+            "username": "otheruser", "password": "otherpassword123"
+        }).json()["access_token"]
+        other = authenticated_client.post("/api/calculations/", json=payload, headers={"Authorization": f"Bearer {token}"})
+        assert other.status_code == status.HTTP_201_CREATED
+
+
+class TestStartup:
+    """Test importing the app does no database work and startup runs in the lifespan"""
+
+    def test_import_builds_no_engine(self):
+        """Test a fresh import of app.main leaves the engine unbuilt and creates no tables"""
+        code = "import app.main; from app import database; print(database._engine is None)"
+        env = dict(os.environ, DATABASE_URL="sqlite:///./never_created.db")
+        output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+        assert output.strip() == "True"
+        assert not os.path.exists("never_created.db")
+
+    def test_lifespan_creates_tables_when_enabled(self, tmp_path, monkeypatch):
+        """Test CREATE_TABLES runs create_all at startup, not at import"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'startup.db'}")
+        monkeypatch.setattr(database, "get_engine", lambda: engine)
+        with TestClient(app):
+            pass
+        assert inspect(engine).get_table_names() == []
+
+        monkeypatch.setattr(app_main.settings, "create_tables", True)
+        with TestClient(app):
+            pass
+        assert "calculations" in inspect(engine).get_table_names()
+
+
+class TestServer:
+    """Test the preforking server drains in-flight requests on SIGTERM and its workers agree"""
+
+    def start(self, tmp_path, workers):
+        """Start app.server on a free port and wait until it answers"""
+        env = dict(
+            os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'server.db'}", CREATE_TABLES="true",
+            SERVER_GRACEFUL_TIMEOUT_SECONDS="10"
+        )
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        process = subprocess.Popen(
+            [sys.executable, "-m", "app.server", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--log-level", "error"],
+            env=env
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/health")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        return process, base_url
+
+    def test_sigterm_drains_in_flight_requests(self, tmp_path, test_user_data):
+        """Test a request in progress when SIGTERM arrives still gets its response"""
+        process, base_url = self.start(tmp_path, workers=2)
+        try:
+            responses = []
+            # Registration hashes the password with bcrypt, so it is still running when SIGTERM arrives
+            request = threading.Thread(target=lambda: responses.append(
+                httpx.post(f"{base_url}/api/auth/register", json=test_user_data, timeout=30)
+            ))
+            request.start()
+            time.sleep(0.05)
+            process.send_signal(signal.SIGTERM)
+            request.join()
+            assert process.wait(timeout=30) == 0
+        finally:
+            if process.poll() is None:
+                process.kill()
+        assert responses[0].status_code == status.HTTP_201_CREATED
+        with pytest.raises(httpx.TransportError):
+            httpx.get(f"{base_url}/health")
+
+    def test_workers_see_writes_and_revocations(self, tmp_path, test_user_data):
+        """Test every worker serves a write and rejects a revoked token right away"""
+        process, base_url = self.start(tmp_path, workers=3)
+        try:
+            httpx.post(f"{base_url}/api/auth/register", json=test_user_data, timeout=30)
+            token = httpx.post(f"{base_url}/api/auth/login", json={
+                "username": test_user_data["username"], "password": test_user_data["password"]
+            }, timeout=30).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            # New connections each time, so the requests spread over the workers
+            for _ in range(6):
+                httpx.get(f"{base_url}/api/calculations/", headers=headers)
+            httpx.post(f"{base_url}/api/calculations/", json={"operation": "add", "operand1": 1, "operand2": 2}, headers=headers)
+            pages = [httpx.get(f"{base_url}/api/calculations/", headers=headers).json() for _ in range(15)]
+            assert all(len(page) == 1 for page in pages)
+
+            changed = httpx.post(f"{base_url}/api/users/me/change-password", json={
+                "current_password": test_user_data["password"], "new_password": "newpassword123"
+            }, headers=headers, timeout=30)
+            assert changed.status_code == status.HTTP_200_OK
+            statuses = {httpx.get(f"{base_url}/api/users/me", headers=headers).status_code for _ in range(15)}
+            assert statuses == {status.HTTP_401_UNAUTHORIZED}
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+class TestAsyncEndpoints:
+    """Test the async request path against the same scenarios"""
+
+    def test_register_and_login(self, async_client, test_user_data):
+        """Test registration, duplicate detection and login"""
+        response = async_client.post("/api/auth/register", json=test_user_data)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()["username"] == test_user_data["username"]
+        duplicate = async_client.post("/api/auth/register", json=test_user_data)
+        assert duplicate.status_code == status.HTTP_400_BAD_REQUEST
+
+        wrong = async_client.post("/api/auth/login", json={
+            "username": test_user_data["username"],
+            "password": "wrongpassword"
+        })
+        assert wrong.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_export(self, authenticated_async_client):
+        """Test the streaming export matches the list endpoint"""
+        client = authenticated_async_client
+        client.post("/api/calculations/batch", json={"items": [
+            {"operation": "subtract", "operand1": i, "operand2": 0.5} for i in range(3)
+        ]})
+        listed = list(reversed(client.get("/api/calculations/").json()))
+        response = client.get("/api/calculations/export")
+        assert response.status_code == status.HTTP_200_OK
+        assert [json.loads(line) for line in response.text.splitlines()] == listed
+        csv_response = client.get("/api/calculations/export?format=csv&gzip=true")
+        assert len(gzip.decompress(csv_response.content).decode().splitlines()) == 4
+
+    def test_import(self, authenticated_async_client, db):
+        """Test a bulk import runs on the async session"""
+        client = authenticated_async_client
+        content = "operation,operand1,operand2\nadd,1,2\ndivide,1,0\n"
+        response = client.post("/api/calculations/import", files={"file": ("history.csv", content)})
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        job = client.get(f"/api/calculations/import/{response.json()['id']}").json()
+        assert job["status"] == "completed"
+        assert (job["created"], job["failed"]) == (1, 1)
+        assert find_inconsistencies(db) == []
+
+    def test_calculation_lifecycle(self, authenticated_async_client, db):
+        """Test create, list, read, update and delete"""
+        client = authenticated_async_client
+        created = [
+            client.post("/api/calculations/", json={"operation": "add", "operand1": i, "operand2": 1}).json()
+            for i in range(3)
+        ]
+        assert created[0]["result"] == 1
+
+        first_page = client.get("/api/calculations/?limit=2")
+        assert [c["operand1"] for c in first_page.json()] == [2, 1]
+        cursor = first_page.headers["X-Next-Cursor"]
+        assert [c["operand1"] for c in client.get(f"/api/calculations/?limit=2&cursor={cursor}").json()] == [0]
+
+        response = client.put(f"/api/calculations/{created[0]['id']}", json={"operation": "multiply", "operand1": 5})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["result"] == 5
+        assert client.get(f"/api/calculations/{created[0]['id']}").json()["operation"] == "multiply"
+
+        assert client.delete(f"/api/calculations/{created[1]['id']}").status_code == status.HTTP_200_OK
+        assert client.get(f"/api/calculations/{created[1]['id']}").status_code == status.HTTP_404_NOT_FOUND
+        assert find_inconsistencies(db) == []
+
+        stats = client.get("/api/users/me/statistics").json()
+        assert stats["total_calculations"] == 2
+        assert stats["calculations_by_operation"] == {"add": 1, "multiply": 1}
+        assert len(stats["recent_calculations"]) == 2
+
+    def test_batch(self, authenticated_async_client, db):
+        """Test the async batch endpoint stores valid items"""
+        response = authenticated_async_client.post("/api/calculations/batch", json={"items": [
+            {"operation": "multiply", "operand1": 3, "operand2": 4},
+            {"operation": "divide", "operand1": 1, "operand2": 0}
+        ]})
+        data = response.json()
+        assert data["created"] == 1
+        assert data["results"][0]["calculation"]["result"] == 12
+        assert find_inconsistencies(db) == []
+
+    def test_profile_password_and_account(self, authenticated_async_client, test_user_data):
+        """Test profile update, password change and account deletion"""
+        client = authenticated_async_client
+        response = client.put("/api/users/me", json={"username": "asyncuser"})
+        assert response.status_code == status.HTTP_200_OK
+        assert client.get("/api/users/me").json()["username"] == "asyncuser"
+
+        response = client.post("/api/users/me/change-password", json={
+            "current_password": test_user_data["password"],
+            "new_password": "newpassword123"
+        })
+        assert response.status_code == status.HTTP_200_OK
+        assert client.get("/api/users/me").status_code == status.HTTP_401_UNAUTHORIZED
+
+        token = client.post("/api/auth/login", json={
+            "username": "asyncuser",
+            "password": "newpassword123"
+        }).json()["access_token"]
+        client.headers = {"Authorization": f"Bearer {token}"}
+        client.post("/api/calculations/", json={"operation": "add", "operand1": 1, "operand2": 1})
+        assert client.delete("/api/users/me").status_code == status.HTTP_200_OK
+        assert client.get("/api/users/me").status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_response_cache(self, authenticated_async_client):
+        """Test async reads are revalidated and invalidated like the sync ones"""
+        client = authenticated_async_client
+        client.post("/api/calculations/", json={"operation": "add", "operand1": 1, "operand2": 1})
+        etag = client.get("/api/calculations/").headers["ETag"]
+
+        response = client.get("/api/calculations/", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        client.post("/api/calculations/", json={"operation": "add", "operand1": 2, "operand2": 2})
+        response = client.get("/api/calculations/", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == 2
@@ -2,7 +2,44 @@
 import pytest
 from app.routers.calculations import perform_calculation
 from app.models import OperationType
-from app.auth import verify_password, get_password_hash
+from app.auth import verify_password, get_password_hash, UserCache, CachedUser, create_user_token
+from app.pagination import encode_cursor, decode_cursor
+from datetime import datetime, timedelta
+import threading
+import gzip
+from app.hashing import PasswordHasher, PasswordPoolSaturated
+from sqlalchemy import create_engine, exc, text
+from app.config import get_settings
+from app.database import PoolMonitor, engine_options
+from app.vectorized import (
+    perform_calculations,
+    ERROR_MESSAGES,
+    DIVIDE_BY_ZERO,
+    MODULO_BY_ZERO,
+    ZERO_TO_NEGATIVE_POWER,
+    OUT_OF_RANGE,
+    NOT_REAL
+)
+from app.result_cache import CalculationCache
+from app.response_cache import InMemoryBackend, ResponseCache, history_etag
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from app import fast_json
+from app import events
+from app.events import EventHub, LocalBroker, PostgresBroker, calculations_event, make_broker, resync_event, statistics_delta
+import asyncio
+import os
+from app.instrumentation import InstrumentationMiddleware, request_metrics, timed
+from app import database, server
+from app import assets
+from app.assets import AssetBundle, StaticAssets, negotiate
+from app.compression import CompressionMiddleware, GzipCompressor, is_compressible, parse_encodings
+import zlib
+from app import rate_limit
+from app.rate_limit import RateLimit, RateLimiter, RateLimitMiddleware, RedisBackend, parse_limits
+import math
+import random
+import time
 
 
 class TestCalculationLogic:
@@ -58,6 +95,68 @@ class TestCalculationLogic:
         result = perform_calculation(OperationType.ADD, 1.5, 2.3)
         assert abs(result - 3.8) < 0.0001
 
+    def test_power_guard(self):
+        """Test power inputs without a finite real result raise ValueError"""
+        with pytest.raises(ValueError, match="negative power"):
+            perform_calculation(OperationType.POWER, 0, -1)
+        with pytest.raises(ValueError, match="not a real number"):
+            perform_calculation(OperationType.POWER, -8, 0.5)
+        with pytest.raises(ValueError, match="out of range"):
+            perform_calculation(OperationType.POWER, 10, 400)
+        # Integer operands stay in float arithmetic instead of building huge ints
+        assert perform_calculation(OperationType.POWER, 10, 300) == 1e300
+        assert perform_calculation(OperationType.POWER, -2, 3) == -8
+
+
+class TestCalculationCache:
+    """Test the calculation result cache"""
+
+    def test_hits_and_misses(self):
+        """Test repeated inputs are served from the cache"""
+        cache = CalculationCache(max_size=10)
+        assert cache.get_or_compute(OperationType.POWER, 2.0, 10.0, perform_calculation) == 1024
+        assert cache.get_or_compute(OperationType.POWER, 2.0, 10.0, perform_calculation) == 1024
+        assert cache.get_or_compute(OperationType.POWER, 10.0, 2.0, perform_calculation) == 100
+        metrics = cache.metrics()
+        assert (metrics["hits"], metrics["misses"], metrics["size"]) == (1, 2, 2)
+
+    def test_float_identity(self):
+        """Test -0.0 and 0.0 are distinct keys and NaN keys can be hit"""
+        cache = CalculationCache(max_size=10)
+        assert math.copysign(1, cache.get_or_compute(OperationType.MULTIPLY, -0.0, 5.0, perform_calculation)) == -1
+        assert math.copysign(1, cache.get_or_compute(OperationType.MULTIPLY, 0.0, 5.0, perform_calculation)) == 1
+        nan = float("nan")
+        assert math.isnan(cache.get_or_compute(OperationType.ADD, nan, 1.0, perform_calculation))
+        assert math.isnan(cache.get_or_compute(OperationType.ADD, nan, 1.0, perform_calculation))
+        assert cache.metrics()["hits"] == 1
+
+    def test_eviction_and_expiry(self, monkeypatch):
+        """Test the least recently used entry is evicted and stale entries expire"""
+        cache = CalculationCache(max_size=2, ttl_seconds=10)
+        for operand in (1.0, 2.0, 3.0):
+            cache.get_or_compute(OperationType.ADD, operand, 1.0, perform_calculation)
+        assert cache.metrics()["evictions"] == 1
+        now = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+        cache.get_or_compute(OperationType.ADD, 3.0, 1.0, perform_calculation)
+        metrics = cache.metrics()
+        assert (metrics["expirations"], metrics["hits"]) == (1, 0)
+
+    def test_errors_are_not_cached(self):
+        """Test rejected inputs raise every time and take no slot"""
+        cache = CalculationCache(max_size=10)
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                cache.get_or_compute(OperationType.POWER, 10.0, 400.0, perform_calculation)
+        assert cache.metrics()["size"] == 0
+
+    def test_disabled(self):
+        """Test a zero-sized cache always computes"""
+        cache = CalculationCache(max_size=0)
+        cache.get_or_compute(OperationType.ADD, 1.0, 1.0, perform_calculation)
+        cache.get_or_compute(OperationType.ADD, 1.0, 1.0, perform_calculation)
+        assert cache.metrics()["hits"] == 0
+
 
 class TestPasswordHashing:
     """Test password hashing functionality"""
@@ -89,3 +188,764 @@ class TestPasswordHashing:
         assert hash1 != hash2
         assert verify_password(password, hash1)
         assert verify_password(password, hash2)
+
+
+class TestCursorEncoding:
+    """Test keyset cursor encoding"""
+
+    def test_round_trip(self):
+        """Test a cursor decodes to the values it was built from"""
+        created_at = datetime(2024, 5, 17, 12, 30, 45, 123456)
+        assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+    def test_invalid_cursor(self):
+        """Test malformed cursors raise ValueError"""
+        for cursor in ["", "not-a-cursor", encode_cursor(datetime(2024, 1, 1), 1)[:-3]]:
+            with pytest.raises(ValueError, match="Invalid cursor"):
+                decode_cursor(cursor)
+
+
+class TestUserCache:
+    """Test the authentication user cache"""
+
+    def make_user(self, user_id, token_version=0):
+        now = datetime(2024, 1, 1)
+        return CachedUser(
+            id=user_id,
+            username=f"user{user_id}",
+            email=f"user{user_id}@example.com",
+            token_version=token_version,
+            history_version=0,
+            created_at=now,
+            updated_at=now
+        )
+
+    def test_get_and_invalidate(self):
+        """Test cached users can be read back and invalidated"""
+        cache = UserCache(ttl_seconds=60, max_size=10)
+        cache.put(self.make_user(1))
+        assert cache.get(1).username == "user1"
+        cache.invalidate(1)
+        assert cache.get(1) is None
+
+    def test_expiry(self, monkeypatch):
+        """Test entries expire after the TTL"""
+        clock = [100.0]
+        monkeypatch.setattr("app.auth.time.monotonic", lambda: clock[0])
+        cache = UserCache(ttl_seconds=5, max_size=10)
+        cache.put(self.make_user(1))
+        clock[0] += 4
+        assert cache.get(1) is not None
+        clock[0] += 2
+        assert cache.get(1) is None
+
+    def test_evicts_least_recently_used(self):
+        """Test the cache stays within its size limit"""
+        cache = UserCache(ttl_seconds=60, max_size=2)
+        cache.put(self.make_user(1))
+        cache.put(self.make_user(2))
+        cache.get(1)
+        cache.put(self.make_user(3))
+        assert cache.get(1) is not None
+        assert cache.get(2) is None
+        assert cache.get(3) is not None
+
+
+class BlockingContext:
+    """Stand-in for a CryptContext whose hash call waits for a signal"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+
+    def hash(self, password):
+        self.started.release()
+        self.release.wait(5)
+        return f"hashed-{password}"
+
+    def verify(self, password, hashed):
+        return hashed == f"hashed-{password}"
+
+
+class TestPasswordHasher:
+    """Test the bounded password hashing pool"""
+
+    def test_hash_and_verify(self):
+        """Test work is executed on the pool and timed"""
+        context = BlockingContext()
+        context.release.set()
+        hasher = PasswordHasher(context, workers=2, max_queue=2)
+        assert hasher.hash("secret") == "hashed-secret"
+        assert hasher.verify("secret", "hashed-secret") is True
+        metrics = hasher.metrics()
+        assert metrics["latency"]["hash"]["count"] == 1
+        assert metrics["latency"]["verify"]["count"] == 1
+        hasher.shutdown()
+
+    def test_rejects_when_saturated(self):
+        """Test callers beyond workers + queue are rejected immediately"""
+        context = BlockingContext()
+        hasher = PasswordHasher(context, workers=1, max_queue=1, retry_after=3)
+        threads = [threading.Thread(target=hasher.hash, args=("pw",)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        assert context.started.acquire(timeout=5)
+        deadline = time.monotonic() + 5
+        while hasher.metrics()["in_flight"] < 2:
+            assert time.monotonic() < deadline, "the second caller never reached the queue"
+            time.sleep(0.001)
+
+        with pytest.raises(PasswordPoolSaturated) as exc_info:
+            hasher.hash("pw")
+        assert exc_info.value.retry_after == 3
+        assert hasher.metrics()["rejected"] == 1
+
+        context.release.set()
+        for thread in threads:
+            thread.join()
+        assert hasher.metrics()["in_flight"] == 0
+        hasher.shutdown()
+
+
+class TestPoolMonitor:
+    """Test connection pool telemetry"""
+
+    def make_engine(self, tmp_path, **overrides):
+        settings = get_settings().model_copy(update={
+            "db_pool_size": 1,
+            "db_max_overflow": 0,
+            "db_pool_timeout": 0.05,
+            **overrides
+        })
+        url = f"sqlite:///{tmp_path / 'pool.db'}"
+        return create_engine(url, **engine_options(url, settings))
+
+    def test_in_memory_sqlite_keeps_default_pool(self):
+        """Test pool sizing is skipped for in-memory SQLite"""
+        assert engine_options("sqlite://", get_settings()) == {}
+        assert engine_options("sqlite+aiosqlite:///:memory:", get_settings(), is_async=True) == {}
+
+    def test_reports_checked_out_connections(self, tmp_path):
+        """Test checkouts and current occupancy are reported"""
+        engine = self.make_engine(tmp_path)
+        monitor = PoolMonitor(engine)
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            snapshot = monitor.snapshot()
+            assert snapshot["checked_out"] == 1
+            assert snapshot["size"] == 1
+        snapshot = monitor.snapshot()
+        assert snapshot["checked_out"] == 0
+        assert snapshot["checkouts"] == 1
+        assert snapshot["checkins"] == 1
+        assert snapshot["max_checked_out"] == 1
+        assert snapshot["checkout_wait"]["count"] == 1
+        engine.dispose()
+
+    def test_records_checkout_timeouts(self, tmp_path):
+        """Test an exhausted pool counts the timed-out checkout"""
+        engine = self.make_engine(tmp_path)
+        monitor = PoolMonitor(engine)
+        with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+        snapshot = monitor.snapshot()
+        assert snapshot["timeouts"] == 1
+        assert snapshot["checkout_wait"]["max_seconds"] >= 0.05
+        engine.dispose()
+
+
+class TestVectorizedCalculations:
+    """Test the vectorized engine against the scalar path"""
+
+    EDGE_VALUES = [0.0, -0.0, 1.0, -1.0, 2.5, -2.5, 3.0, -3.0, 0.5, 1e-300, 1e300, -1e300,
+                   float("inf"), float("-inf"), float("nan")]
+
+    def scalar(self, operation, operand1, operand2):
+        try:
+            result = perform_calculation(operation, operand1, operand2)
+        except ValueError as e:
+            return None, str(e)
+        return result, None
+
+    def assert_matches_scalar(self, operations, operand1, operand2):
+        results, errors = perform_calculations(operations, operand1, operand2)
+        for operation, a, b, result, error in zip(operations, operand1, operand2, results.tolist(), errors.tolist()):
+            expected, expected_error = self.scalar(operation, a, b)
+            if expected_error is not None:
+                assert ERROR_MESSAGES.get(error) == expected_error, (operation, a, b)
+            else:
+                assert error == 0, (operation, a, b)
+                assert result == expected or (math.isnan(result) and math.isnan(expected)), (operation, a, b)
+                assert math.copysign(1, result) == math.copysign(1, expected), (operation, a, b)
+
+    def test_random_inputs_match_scalar(self):
+        """Test bitwise agreement on random operands for every operation"""
+        rng = random.Random(0)
+        operations, operand1, operand2 = [], [], []
+        for _ in range(5000):
+            operations.append(rng.choice(list(OperationType)))
+            operand1.append(rng.uniform(-1000, 1000))
+            # Mix integral and fractional exponents / divisors
+            operand2.append(float(rng.randint(-20, 20)) if rng.random() < 0.5 else rng.uniform(-20, 20))
+        self.assert_matches_scalar(operations, operand1, operand2)
+
+    def test_edge_inputs_match_scalar(self):
+        """Test zeros, signed zeros, infinities and NaN for every operation"""
+        operations, operand1, operand2 = [], [], []
+        for operation in OperationType:
+            for a in self.EDGE_VALUES:
+                for b in self.EDGE_VALUES:
+                    operations.append(operation)
+                    operand1.append(a)
+                    operand2.append(b)
+        self.assert_matches_scalar(operations, operand1, operand2)
+
+    def test_error_masks(self):
+        """Test failing rows are flagged without affecting the others"""
+        results, errors = perform_calculations(
+            ["divide", "modulo", "power", "power", "power", "add"],
+            [1, 1, 0, 10, -8, 1],
+            [0, 0, -1, 400, 0.5, 2]
+        )
+        assert errors.tolist() == [DIVIDE_BY_ZERO, MODULO_BY_ZERO, ZERO_TO_NEGATIVE_POWER, OUT_OF_RANGE, NOT_REAL, 0]
+        assert all(math.isnan(value) for value in results[:5])
+        assert results[5] == 3
+
+    def test_rejects_mismatched_input(self):
+        """Test unknown operations and length mismatches raise ValueError"""
+        with pytest.raises(ValueError):
+            perform_calculations(["add", "root"], [1, 2], [3, 4])
+        with pytest.raises(ValueError):
+            perform_calculations(["add"], [1, 2], [3, 4])
+
+
+class TestResponseCache:
+    """Test the response cache backend and conditional lookups"""
+
+    def make_request(self, if_none_match=None):
+        headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+        return Request({"type": "http", "method": "GET", "path": "/api/calculations/", "query_string": b"", "headers": headers})
+
+    def test_backend_lru_and_expiry(self, monkeypatch):
+        """Test the in-memory backend evicts the oldest entry and honours ex"""
+        clock = [100.0]
+        monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+        backend = InMemoryBackend(max_entries=2)
+        backend.set("a", "1", ex=10)
+        backend.set("b", b"2")
+        backend.get("a")
+        backend.set("c", b"3")
+        assert backend.get("b") is None
+        assert backend.get("a") == b"1"
+        clock[0] += 10
+        assert backend.get("a") is None
+        assert backend.get("c") == b"3"
+
+    def test_if_none_match_uses_history_version(self):
+        """Test weak, strong and listed tags match the current version only, and a wildcard never does"""
+        cache = ResponseCache(InMemoryBackend(10), ttl_seconds=0)
+        user = TestUserCache().make_user(7)
+        assert history_etag(user) == 'W/"7.0"'
+        for header in ['W/"7.0"', '"7.0"', '"1.0", W/"7.0"']:
+            key, response = cache.lookup(self.make_request(header), user, "calculations")
+            assert response.status_code == 304
+        for header in [None, 'W/"7.1"', 'W/"8.0"', "*"]:
+            assert cache.lookup(self.make_request(header), user, "calculations") == (None, None)
+
+    def test_calculation_etag_names_the_calculation(self):
+        """Test one calculation's tag does not revalidate the list or another calculation"""
+        cache = ResponseCache(InMemoryBackend(10), ttl_seconds=0)
+        user = TestUserCache().make_user(7)
+        assert history_etag(user, "calculation:42") == 'W/"7.0.42"'
+        assert cache.lookup(self.make_request('W/"7.0.42"'), user, "calculation:42")[1].status_code == 304
+        for scope in ["calculation:43", "calculations"]:
+            assert cache.lookup(self.make_request('W/"7.0.42"'), user, scope) == (None, None)
+        assert cache.lookup(self.make_request('W/"7.0"'), user, "calculation:42") == (None, None)
+
+
+class TestFastJson:
+    """Test the orjson encoder falls back wherever it would differ from JSONResponse"""
+
+    def test_matches_json_response(self):
+        """Test fixed-notation, exponent and signed-zero floats encode like JSONResponse"""
+        for value in [0.1, -0.0, 1e-4, 5e-5, 1e15, 1e16, 1.5e300, 1 / 3, 12345.678]:
+            content = [{"result": value, "id": 1, "operation": "add", "nested": {"x": None}}]
+            assert fast_json.dumps(content, [value]) == JSONResponse(content).body
+
+    def test_uses_orjson_only_in_fixed_notation(self, monkeypatch):
+        """Test orjson is skipped for floats it formats differently and for non-finite values"""
+        calls = []
+        monkeypatch.setattr(fast_json.orjson, "dumps", lambda content: calls.append(content) or b"[]")
+        fast_json.dumps([0.5], [0.5])
+        fast_json.dumps([1e-05], [1e-05])
+        assert calls == [[0.5]]
+        with pytest.raises(ValueError):
+            fast_json.dumps([math.inf], [math.inf])
+
+
+class TestEvents:
+    """Test event fan-out, overflow handling and the stream's version checks"""
+
+    def created(self, version, calculation_id=1):
+        delta = statistics_delta((OperationType.ADD, 1, 3.0))
+        return calculations_event("created", version, delta, calculations=[{"id": calculation_id}])
+
+    def test_broker_reaches_every_hub(self):
+        """Test one publish reaches the user's streams on every attached hub and no one else's"""
+        async def scenario():
+            broker, hubs = LocalBroker(), [EventHub(10), EventHub(10)]
+            for hub in hubs:
+                broker.attach(hub.dispatch)
+            mine = [hub.subscribe(1) for hub in hubs]
+            other = hubs[0].subscribe(2)
+            broker.publish(1, self.created(1))
+            await asyncio.sleep(0)
+            assert [subscription.queue.qsize() for subscription in mine] == [1, 1]
+            assert other.queue.empty()
+            hubs[0].unsubscribe(mine[0])
+            assert hubs[0].metrics()["streams"] == 1
+
+        asyncio.run(scenario())
+
+    def test_overflow_replaces_queue_with_resync(self):
+        """Test a stream that falls behind gets a single resync instead of a partial history"""
+        async def scenario():
+            hub = EventHub(2)
+            subscription = hub.subscribe(1)
+            for version in (1, 2, 3):
+                hub.dispatch(1, self.created(version, version))
+            await asyncio.sleep(0)
+            assert subscription.queue.qsize() == 1
+            assert subscription.queue.get_nowait() == resync_event(3)
+            hub.unsubscribe(subscription)
+            assert hub.metrics()["overflows"] == 1
+
+        asyncio.run(scenario())
+
+    def test_stream_skips_seen_events_and_resyncs_on_gap(self):
+        """Test the stream drops events in its snapshot and stops at a missing version"""
+        class ConnectedRequest:
+            async def is_disconnected(self):
+                return False
+
+        async def scenario():
+            subscription = events.event_hub.subscribe(1)
+            for version in (1, 2, 4, 5):
+                subscription.deliver(self.created(version, version))
+            messages = [message async for message in events.event_stream(ConnectedRequest(), subscription, 1, {})]
+            assert [message.split("\n")[0] for message in messages] == ["event: snapshot", "event: created", "event: resync"]
+            assert '"version": 2' in messages[1]
+            assert events.event_hub.metrics()["streams"] == 0
+
+        asyncio.run(scenario())
+
+    def test_stream_ends_when_its_token_is_revoked(self):
+        """Test a revocation ends streams opened with an older token and no others"""
+        class ConnectedRequest:
+            async def is_disconnected(self):
+                return False
+
+        async def scenario():
+            subscription = events.event_hub.subscribe(1)
+            for event in (events.revoked_event(2), self.created(1), events.revoked_event(3)):
+                subscription.deliver(event)
+            stream = events.event_stream(ConnectedRequest(), subscription, 0, {}, token_version=2)
+            messages = [message async for message in stream]
+            assert [message.split("\n")[0] for message in messages] == ["event: snapshot", "event: created", "event: revoked"]
+            assert events.event_hub.metrics()["streams"] == 0
+
+        asyncio.run(scenario())
+
+    def test_postgres_payload_limit(self, monkeypatch):
+        """Test NOTIFY payloads round-trip and oversized ones become a resync"""
+        broker = PostgresBroker("postgresql://localhost/calculator")
+        monkeypatch.setattr(broker, "start", lambda: None)
+        broker._wake_read, broker._wake_write = os.pipe()
+        try:
+            small = self.created(3)
+            large = calculations_event("created", 4, {}, calculations=[{"id": i} for i in range(1000)])
+            broker.publish(7, small)
+            broker.publish(7, large)
+            assert events._decode(broker._outbox.get_nowait()) == (7, small)
+            assert events._decode(broker._outbox.get_nowait()) == (7, resync_event(4))
+        finally:
+            os.close(broker._wake_read)
+            os.close(broker._wake_write)
+
+    def test_make_broker(self):
+        """Test the broker URL selects LISTEN/NOTIFY and drops SQLAlchemy's driver suffix"""
+        assert isinstance(make_broker(None), LocalBroker)
+        broker = make_broker("postgresql+psycopg2://user:secret@db:5432/calculator")
+        assert broker.dsn == "postgresql://user:secret@db:5432/calculator"
+        with pytest.raises(RuntimeError):
+            make_broker("sqlite:///./app.db")
+
+
+class TestInstrumentation:
+    """Test the middleware counts a request's statements and phases and nothing after it"""
+
+    def test_counts_until_response_ends(self):
+        """Test statements before the response are counted and those of background work are not"""
+        engine = create_engine("sqlite://")
+
+        async def app(scope, receive, send):
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+            with timed("render"):
+                body = b"ok"
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": body})
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 3"))
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async def receive():
+            return {"type": "http.request"}
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+        request_metrics.clear()
+        asyncio.run(InstrumentationMiddleware(app)(scope, receive, send))
+        header = dict(messages[0]["headers"])[b"server-timing"].decode()
+        assert 'desc="queries=2"' in header
+        assert "render;dur=" in header
+        assert 'db_queries_per_request_sum{method="GET",route="unmatched"} 2' in request_metrics.render()
+
+
+class TestServer:
+    """Test worker sizing and per-worker engines"""
+
+    def test_cpu_quota_caps_workers(self, tmp_path, monkeypatch):
+        """Test a cgroup CPU quota lowers the CPU count, rounding partial CPUs up"""
+        cpu_max = tmp_path / "cpu.max"
+        monkeypatch.setattr(server, "CGROUP_CPU_MAX", str(cpu_max))
+        monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)))
+        assert server.available_cpus() == 8
+
+        cpu_max.write_text("150000 100000\n")
+        assert server.available_cpus() == 2
+        cpu_max.write_text("max 100000\n")
+        assert server.available_cpus() == 8
+
+    def test_several_workers_turn_off_per_process_caches(self):
+        """Test the response and user caches are off with several workers unless the response cache is shared"""
+        from app.config import Settings
+
+        single = Settings(database_url="sqlite://", secret_key="x")
+        server.configure_workers(single, 1)
+        assert single.response_cache_ttl_seconds == 60 and single.user_cache_ttl_seconds == 30
+
+        several = Settings(database_url="sqlite://", secret_key="x")
+        server.configure_workers(several, 3)
+        assert several.response_cache_ttl_seconds == 0 and several.user_cache_ttl_seconds == 0
+
+        shared = Settings(database_url="sqlite://", secret_key="x", response_cache_url="redis://cache:6379/0")
+        server.configure_workers(shared, 3)
+        assert shared.response_cache_ttl_seconds == 60 and shared.user_cache_ttl_seconds == 0
+
+    def test_tables_are_created_once_before_forking(self, monkeypatch):
+        """Test the parent creates the tables and the workers' lifespans are told not to"""
+        monkeypatch.setattr(server.settings, "create_tables", True)
+        monkeypatch.setattr(database.settings, "database_url", "sqlite://")
+        monkeypatch.setattr(database, "_engine", None)
+        created, forked_with = [], []
+        monkeypatch.setattr(database.Base.metadata, "create_all", lambda bind: created.append(bind))
+        monkeypatch.setattr(server, "bind_socket", lambda host, port: None)
+        monkeypatch.setattr(server.Supervisor, "run", lambda supervisor: forked_with.append(server.settings.create_tables) or 0)
+        assert server.main(["--workers", "1"]) == 0
+        assert len(created) == 1
+        assert forked_with == [False]
+
+    def test_forked_child_builds_its_own_engine(self, monkeypatch):
+        """Test a forked worker drops the inherited engine instead of sharing its connections"""
+        monkeypatch.setattr(database.settings, "database_url", "sqlite://")
+        monkeypatch.setattr(database, "_engine", None)
+        parent_engine = database.get_engine()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            fresh = database._engine is None and database.get_engine() is not parent_engine
+            os.write(write_fd, b"1" if fresh else b"0")
+            os._exit(0)
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        assert os.read(read_fd, 1) == b"1"
+        os.close(read_fd)
+        assert database.get_engine() is parent_engine
+
+
+class TestStaticAssets:
+    """Test hashed names, index rewriting, encoding negotiation and reload"""
+
+    def write_site(self, directory, script="console.log('hello');\n" * 50):
+        (directory / "app.js").write_text(script)
+        (directory / "index.html").write_text('<link href="/static/app.js"><script src="/static/app.js"></script>')
+
+    def test_index_points_at_hashed_names(self, tmp_path):
+        """Test assets get content-hashed names and the page refers to them"""
+        self.write_site(tmp_path)
+        bundle = AssetBundle(tmp_path)
+        hashed = bundle.hashed["app.js"]
+        assert hashed.startswith("app.") and hashed.endswith(".js") and hashed != "app.js"
+        assert bundle.index.variants["identity"].decode().count(f"/static/{hashed}") == 2
+        assert bundle.lookup(hashed) == (bundle.assets[hashed], assets.IMMUTABLE)
+        assert bundle.lookup("app.js") == (bundle.assets[hashed], assets.REVALIDATE)
+        assert bundle.lookup("missing.js")[0] is None
+
+    def test_precompressed_variants(self, tmp_path, monkeypatch):
+        """Test gzip and (when installed) brotli variants are built and small bodies are left alone"""
+        class FakeBrotli:
+            @staticmethod
+            def compress(body, quality):
+                return b"br"
+
+        monkeypatch.setattr(assets, "brotli", FakeBrotli)
+        self.write_site(tmp_path)
+        (tmp_path / "tiny.css").write_text("a{}")
+        bundle = AssetBundle(tmp_path)
+        script = bundle.assets[bundle.hashed["app.js"]]
+        assert set(script.variants) == {"identity", "gzip", "br"}
+        assert gzip.decompress(script.variants["gzip"]) == script.variants["identity"]
+        assert set(bundle.assets[bundle.hashed["tiny.css"]].variants) == {"identity"}
+
+    def test_negotiate(self):
+        """Test brotli is preferred, q=0 refuses an encoding and identity is the fallback"""
+        variants = {"identity": b"", "gzip": b"", "br": b""}
+        assert negotiate("gzip, deflate, br", variants) == "br"
+        assert negotiate("gzip, br;q=0", variants) == "gzip"
+        assert negotiate("*", {"identity": b"", "gzip": b""}) == "gzip"
+        assert negotiate("", variants) == "identity"
+        assert negotiate("br", {"identity": b"", "gzip": b""}) == "identity"
+
+    def test_reload_rebuilds_when_files_change(self, tmp_path):
+        """Test the bundle is kept until a file changes, and only rebuilt with reload on"""
+        self.write_site(tmp_path)
+        fixed, reloading = StaticAssets(tmp_path), StaticAssets(tmp_path, reload=True)
+        first_fixed, first_reloading = fixed.bundle(), reloading.bundle()
+        assert reloading.bundle() is first_reloading
+
+        self.write_site(tmp_path, script="console.log('changed');\n")
+        assert fixed.bundle() is first_fixed
+        assert reloading.bundle().hashed["app.js"] != first_reloading.hashed["app.js"]
+
+
+class TestCompression:
+    """Test the compression middleware's choice of what to compress and how"""
+
+    def run(self, messages, accept_encoding="gzip", **options):
+        """Send `messages` through the middleware and return what reaches the server"""
+        async def app(scope, receive, send):
+            for message in messages:
+                await send(message)
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            return {"type": "http.request"}
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+        asyncio.run(CompressionMiddleware(app, **options)(scope, receive, send))
+        return dict(sent[0]["headers"]), sent[1:]
+
+    def start(self, content_type, **headers):
+        raw = [(b"content-type", content_type.encode())]
+        raw += [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+        return {"type": "http.response.start", "status": 200, "headers": raw}
+
+    def test_gzip_round_trip_and_flush(self):
+        """Test every flushed chunk is decodable on its own and the whole stream is valid gzip"""
+        compressor = GzipCompressor(6)
+        decoder = zlib.decompressobj(31)
+        first = compressor.compress(b'{"id": 1}\n' * 100, flush=True)
+        assert decoder.decompress(first) == b'{"id": 1}\n' * 100
+        rest = compressor.compress(b'{"id": 2}\n', flush=True) + compressor.finish()
+        assert gzip.decompress(first + rest) == b'{"id": 1}\n' * 100 + b'{"id": 2}\n'
+
+    def test_compresses_large_bodies_only(self):
+        """Test bodies under the threshold pass through and larger ones get gzip and their new length"""
+        body = b'{"value": 1}' * 200
+        headers, chunks = self.run(
+            [self.start("application/json", content_length=str(len(body))), {"type": "http.response.body", "body": body}]
+        )
+        assert headers[b"content-encoding"] == b"gzip"
+        assert headers[b"vary"] == b"Accept-Encoding"
+        assert int(headers[b"content-length"]) == len(chunks[0]["body"]) < len(body)
+        assert gzip.decompress(chunks[0]["body"]) == body
+
+        headers, chunks = self.run([self.start("application/json"), {"type": "http.response.body", "body": b"{}"}])
+        assert b"content-encoding" not in headers
+        assert chunks[0]["body"] == b"{}"
+
+    def test_streams_chunk_by_chunk(self):
+        """Test a streamed body is compressed per chunk without a Content-Length"""
+        rows = [b'{"id": %d}\n' % i for i in range(3)]
+        messages = [self.start("application/x-ndjson")]
+        messages += [{"type": "http.response.body", "body": row, "more_body": True} for row in rows]
+        messages.append({"type": "http.response.body", "body": b""})
+        headers, chunks = self.run(messages)
+        assert headers[b"content-encoding"] == b"gzip"
+        assert b"content-length" not in headers
+        decoder = zlib.decompressobj(31)
+        assert decoder.decompress(chunks[0]["body"]) == rows[0]
+        assert gzip.decompress(b"".join(chunk["body"] for chunk in chunks)) == b"".join(rows)
+
+    def test_leaves_encoded_and_event_streams_alone(self):
+        """Test precompressed bodies, event streams and clients without gzip are passed through"""
+        body = b"x" * 5000
+        for start in (self.start("text/javascript", content_encoding="br"), self.start("text/event-stream")):
+            headers, chunks = self.run([start, {"type": "http.response.body", "body": body}])
+            assert b"content-encoding" not in headers or headers[b"content-encoding"] == b"br"
+            assert chunks[0]["body"] == body
+        headers, chunks = self.run([self.start("text/csv"), {"type": "http.response.body", "body": body}], "identity")
+        assert chunks[0]["body"] == body
+        assert not is_compressible("application/gzip")
+
+    def test_preference_follows_configuration(self):
+        """Test the configured order wins over the client's and unknown encodings are rejected"""
+        body = b"y" * 5000
+        headers, _ = self.run(
+            [self.start("text/plain"), {"type": "http.response.body", "body": body}], "gzip, br", encodings=("gzip",)
+        )
+        assert headers[b"content-encoding"] == b"gzip"
+        assert parse_encodings(" gzip, ") == ["gzip"]
+        assert parse_encodings("") == []
+        with pytest.raises(RuntimeError, match="deflate"):
+            parse_encodings("deflate")
+
+
+class TestRateLimit:
+    """Test the token buckets, their backends and the middleware's answers"""
+
+    def run(self, middleware, path="/api/auth/login", headers=(), client="10.0.0.1"):
+        """Send one POST through the middleware; returns (status, headers) and whether the app was called"""
+        called = []
+
+        async def app(scope, receive, send):
+            called.append(scope)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            return {"type": "http.request"}
+
+        scope = {"type": "http", "method": "POST", "path": path, "headers": list(headers), "client": (client, 1234)}
+        asyncio.run(RateLimitMiddleware(app, middleware)(scope, receive, send))
+        return sent[0]["status"], {k.decode(): v.decode() for k, v in sent[0]["headers"]}, bool(called)
+
+    def test_parse_limits(self):
+        """Test counts per period are parsed and malformed limits fail at startup"""
+        limits = parse_limits({"post /api/auth/login": "10/minute", "GET /health": "5/seconds"})
+        assert limits == {"POST /api/auth/login": RateLimit(10, 60), "GET /health": RateLimit(5, 1)}
+        for bad in ({"POST /api/auth/login": "ten/minute"}, {"POST /api/auth/login": "0/hour"},
+                    {"POST /api/auth/login": "10/fortnight"}, {"/api/auth/login": "10/minute"}):
+            with pytest.raises(RuntimeError):
+                parse_limits(bad)
+
+    def test_bucket_empties_and_refills(self):
+        """Test the burst is the count, then one token comes back per period/count seconds"""
+        clock = [0.0]
+        backend = rate_limit.InMemoryBackend(10, clock=lambda: clock[0])
+        limit = RateLimit(3, 60)
+        assert [backend.take("k", limit).remaining for _ in range(3)] == [2, 1, 0]
+        refused = backend.take("k", limit)
+        assert not refused.allowed and refused.retry_after == pytest.approx(20)
+        clock[0] += 10
+        assert backend.take("k", limit).retry_after == pytest.approx(10)
+        clock[0] += 10
+        assert backend.take("k", limit).allowed
+        assert backend.take("other", limit).remaining == 2
+        clock[0] += 3600
+        assert backend.take("k", limit).remaining == 2
+
+    def test_least_recently_used_bucket_is_evicted(self):
+        """Test the bucket count is bounded and an evicted bucket starts full"""
+        backend = rate_limit.InMemoryBackend(2)
+        limit = RateLimit(1, 60)
+        backend.take("a", limit)
+        backend.take("b", limit)
+        backend.take("c", limit)
+        assert backend.take("a", limit).allowed
+        assert not backend.take("c", limit).allowed
+
+    def test_redis_backend_round_trip(self):
+        """Test the shared backend sends one script call and reads redis' reply"""
+        class FakeRedis:
+            def __init__(self, reply):
+                self.reply = reply
+                self.calls = []
+
+            def eval(self, script, numkeys, *args):
+                self.calls.append((script, numkeys) + args)
+                return self.reply
+
+        client = FakeRedis([0, b"0.5"])
+        decision = RedisBackend(client).take("POST /api/auth/login:ip:10.0.0.1", RateLimit(10, 60))
+        assert client.calls == [(rate_limit.TAKE_TOKEN_SCRIPT, 1, "rl:POST /api/auth/login:ip:10.0.0.1", 10, repr(10 / 60))]
+        assert not decision.allowed and decision.retry_after == pytest.approx(3)
+        client.reply = [1, b"4.2"]
+        assert RedisBackend(client).take("k", RateLimit(10, 60)).remaining == 4
+
+    def test_middleware_answers_429(self):
+        """Test an empty bucket gets 429 with Retry-After without calling the app"""
+        limiter = RateLimiter(rate_limit.InMemoryBackend(10), {"POST /api/auth/login": RateLimit(1, 60)})
+        status, headers, called = self.run(limiter)
+        assert (status, called) == (200, True)
+        assert headers["x-ratelimit-limit"] == "1" and headers["x-ratelimit-remaining"] == "0"
+        status, headers, called = self.run(limiter)
+        assert (status, called) == (429, False)
+        assert headers["retry-after"] == "60"
+        assert self.run(limiter, client="10.0.0.2")[0] == 200
+        status, headers, called = self.run(limiter, path="/api/auth/register")
+        assert (status, called) == (200, True) and "x-ratelimit-limit" not in headers
+        assert limiter.metrics()["limited"] == 1
+
+    def test_users_have_their_own_buckets(self):
+        """Test a valid token is limited per user, whatever address it comes from, and a forged one per address"""
+        limiter = RateLimiter(rate_limit.InMemoryBackend(10), {"POST /api/calculations/": RateLimit(1, 60)})
+        token = create_user_token(TestUserCache().make_user(7))
+        bearer = [(b"authorization", f"Bearer {token}".encode())]
+        assert self.run(limiter, "/api/calculations/", bearer, client="10.0.0.1")[0] == 200
+        assert self.run(limiter, "/api/calculations/", bearer, client="10.0.0.2")[0] == 429
+        assert self.run(limiter, "/api/calculations/", client="10.0.0.1")[0] == 200
+        forged = [(b"authorization", f"Bearer {token[:-2]}xx".encode())]
+        assert self.run(limiter, "/api/calculations/", forged, client="10.0.0.1")[0] == 429
+
+    def test_auth_routes_are_limited_per_address(self):
+        """Test a valid token does not move login into a bucket of its own"""
+        limiter = RateLimiter(rate_limit.InMemoryBackend(10), {"POST /api/auth/login": RateLimit(1, 60)})
+        bearer = [(b"authorization", f"Bearer {create_user_token(TestUserCache().make_user(7))}".encode())]
+        assert self.run(limiter)[0] == 200
+        assert self.run(limiter, headers=bearer)[0] == 429
+        assert self.run(limiter, headers=bearer, client="10.0.0.2")[0] == 200
+
+    def test_expired_token_falls_back_to_address(self, monkeypatch):
+        """Test a cached token stops selecting its user's bucket once it expires"""
+        token = create_user_token(TestUserCache().make_user(7), expires_delta=timedelta(minutes=5))
+        assert rate_limit.token_user(token) == "7"
+        monkeypatch.setattr(rate_limit.time, "time", lambda: 10 ** 11)
+        assert rate_limit.token_user(token) is None
+
+    def test_backend_failure_lets_requests_through(self):
+        """Test an unreachable shared backend does not take the API down"""
+        class BrokenBackend:
+            def take(self, key, limit):
+                raise ConnectionError("redis is down")
+
+        limiter = RateLimiter(BrokenBackend(), {"POST /api/auth/login": RateLimit(1, 60)})
+        assert self.run(limiter)[0] == 200
+        assert self.run(limiter)[0] == 200
+        assert limiter.metrics()["backend_errors"] == 2